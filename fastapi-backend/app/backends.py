@@ -0,0 +1,602 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+import numpy as np
+import app.prompts as prompts
+import app.ml_newsly as ml_newsly
+from app.clients import generate_together
+from app.deadlines import Deadline, run_stage
+from app.limiter import call_modal, get_limiter
+from app.related import EMBEDDING_DIM, EMBEDDING_MODEL
+from app.routing import BackendError, router
+from app.tagging import TAG_DESCRIPTIONS, VALID_TAGS
+from app.tracing import span
+from app.token_budget import TOKEN_LIMITS, TOKENIZERS
+from app.newsly_types import (
+    LogicalFallacyComplete,
+    LogicalFallacyServerList,
+    LogicalFallacyServer,
+)
+
+# Inference backends the analysis stages can run on, by name. Which ones are
+# enabled is set by INFERENCE_BACKENDS, e.g. "fake" to load-test offline.
+INFERENCE_BACKENDS = os.environ.get("INFERENCE_BACKENDS", "modal,together")
+
+MODAL_APP = "newsly-modal-test"
+
+# name: (prompt, system message) of each logical fallacy type
+FALLACY_TYPES = {
+    "ad_hominem": (
+        prompts.ad_hominem,
+        "You are a helpful assistant that identifies ad hominem attacks in text.",
+    ),
+    "discrediting_sources": (
+        prompts.discrediting_sources,
+        "You are a helpful assistant that identifies discrediting sources in text.",
+    ),
+    "emotion_fallacy": (
+        prompts.emotion_fallacy,
+        "You are a helpful assistant that identifies emotion fallacy in text.",
+    ),
+    "false_dichotomy": (
+        prompts.false_dichotomy_fallacy,
+        "You are a helpful assistant that identifies false dichotomies in text.",
+    ),
+    "fear_mongering": (
+        prompts.fear_mongering_fallacy,
+        "You are a helpful assistant that identifies fear mongering in text.",
+    ),
+    "good_sources": (
+        prompts.good_sources,
+        "You are a helpful assistant that identifies good sources in text.",
+    ),
+    "non_sequitur": (
+        prompts.non_sequitur,
+        "You are a helpful assistant that identifies non-sequiturs in text.",
+    ),
+    "presenting_other_side": (
+        prompts.presenting_other_side,
+        "You are a helpful assistant that identifies presenting the other side in text.",
+    ),
+    "scapegoating": (
+        prompts.scapegoating,
+        "You are a helpful assistant that identifies scapegoating in text.",
+    ),
+}
+
+
+# Methods a backend may leave out, listing the ones it serves in its
+# `optional`:
+#   token_budget(text) -> dict, see app.token_budget
+#   lean_explanation(text, predicted_lean, lean_probability) -> str
+#   contextualize(text, topics) -> str
+#   keywords(text) -> list[str]
+#   llm_tag(text) -> str
+OPTIONAL_METHODS = frozenset(
+    ("token_budget", "lean_explanation", "contextualize", "keywords", "llm_tag")
+)
+
+
+class InferenceBackend(ABC):
+    """
+    The model calls behind the analysis stages. A backend implements the
+    abstract methods, and those of OPTIONAL_METHODS it lists in optional;
+    supports() tells the pipeline which methods it serves.
+
+    A backend may return more than asked for: political_lean may include the
+    "explanation" and extract_topics the "contextualization", in which case
+    the pipeline skips the lean_explanation and contextualize calls.
+    """
+
+    name = ""
+    # the OPTIONAL_METHODS this backend implements
+    optional: frozenset[str] = frozenset()
+    # stage name -> the token_budget view to pass instead of the stage's own
+    views: dict[str, str] = {}
+    # stage name -> the models behind it, part of the stage's version
+    # fingerprint (see app.versions)
+    models: dict[str, tuple[str, ...]] = {}
+
+    def supports(self, method: str) -> bool:
+        return method not in OPTIONAL_METHODS or method in self.optional
+
+    @abstractmethod
+    async def summarize(self, text: str) -> str: ...
+
+    @abstractmethod
+    async def political_lean(self, text: str) -> dict:
+        """
+        Returns {"predicted_lean": str, "probabilities": {lean: float}}.
+        """
+
+    @abstractmethod
+    async def extract_topics(self, text: str) -> dict:
+        """
+        Returns {"topics": list[str]}.
+        """
+
+    @abstractmethod
+    async def logical_fallacies(
+        self, text: str, deadline: Deadline | None = None
+    ) -> LogicalFallacyComplete: ...
+
+    @abstractmethod
+    async def embed_article(self, text: str) -> list[float]: ...
+
+    @abstractmethod
+    async def embed_texts(self, texts: list[str]) -> list[list[float]]: ...
+
+    @abstractmethod
+    async def probe(self) -> None:
+        """
+        A cheap call that raises if the backend is down.
+        """
+
+
+class ModalBackend(InferenceBackend):
+    """
+    The functions of the newsly Modal app (app/ml_modal.py). Handles are
+    looked up on first use, so nothing talks to Modal at import time.
+    """
+
+    name = "modal"
+    optional = frozenset(("token_budget", "keywords", "llm_tag"))
+    views = {
+        "lean": "lean_and_explanation",
+        "topics": "topics_and_contextualization",
+        "logical_fallacies": "modal_logical_fallacies",
+    }
+    models = {
+        "token_budget": tuple(TOKENIZERS.values()),
+        "summary": ("facebook/bart-large-cnn",),
+        "lean": ("bucketresearch/politicalBiasBERT",),
+        "lean_explanation": (
+            "bucketresearch/politicalBiasBERT",
+            "meta-llama/Llama-3.1-8B-Instruct",
+        ),
+        "topics": ("meta-llama/Llama-3.1-8B-Instruct",),
+        "contextualization": ("meta-llama/Llama-3.1-8B-Instruct",),
+        "logical_fallacies": ("mistralai/Mixtral-8x7B-Instruct-v0.1",),
+        "embedding": (EMBEDDING_MODEL,),
+        "keywords": (EMBEDDING_MODEL,),
+        "tag": ("meta-llama/Llama-3.1-8B-Instruct",),
+    }
+
+    def __init__(self, app_name: str = MODAL_APP):
+        self.app_name = app_name
+        self.handles = {}
+
+    def function(self, name: str):
+        if name not in self.handles:
+            import modal
+
+            self.handles[name] = modal.Function.from_name(self.app_name, name)
+        return self.handles[name]
+
+    def instance(self, cls_name: str):
+        if cls_name not in self.handles:
+            import modal
+
+            self.handles[cls_name] = modal.Cls.from_name(self.app_name, cls_name)()
+        return self.handles[cls_name]
+
+    async def token_budget(self, text: str) -> dict:
+        return await call_modal(
+            "Tokenizers.token_budget", self.instance("Tokenizers").token_budget, text
+        )
+
+    async def summarize(self, text: str) -> str:
+        return await call_modal("summarize", self.function("summarize"), text)
+
+    async def political_lean(self, text: str) -> dict:
+        # explanation included
+        return await call_modal(
+            "political_lean_with_explanation",
+            self.function("political_lean_with_explanation"),
+            text,
+        )
+
+    async def extract_topics(self, text: str) -> dict:
+        # contextualization included
+        return await call_modal(
+            "extract_topics_and_contextualize",
+            self.function("extract_topics_and_contextualize"),
+            text,
+        )
+
+    async def logical_fallacies(
+        self, text: str, deadline: Deadline | None = None
+    ) -> LogicalFallacyComplete:
+        """
+        Run every fallacy type on Mixtral concurrently, each under the
+        "fallacy" stage deadline; a slow one only loses its own result.
+        """
+
+        async def detect(fallacy_type: str, prompt: str) -> LogicalFallacyServerList:
+            try:
+                result = await run_stage(
+                    "fallacy",
+                    lambda: call_modal(
+                        "get_logical_fallacies",
+                        self.function("get_logical_fallacies"),
+                        text,
+                        fallacy_type,
+                        prompt,
+                    ),
+                    deadline,
+                    backend=self.name,
+                )
+                logical_fallacies = [
+                    LogicalFallacyServer(
+                        reason=fallacy["reason"],
+                        quote=fallacy["quote"],
+                        rating=fallacy["rating"],
+                        explanation=fallacy["explanation"],
+                    )
+                    for fallacy in result.get("logical_fallacies") or []
+                ]
+                return LogicalFallacyServerList(
+                    logical_fallacies=logical_fallacies, error=result.get("error")
+                )
+            except Exception as e:
+                print(f"Error processing {fallacy_type}: {e}")
+                return LogicalFallacyServerList(logical_fallacies=[], error=str(e))
+
+        lists = await asyncio.gather(
+            *(
+                detect(fallacy_type, prompt)
+                for fallacy_type, (prompt, _) in FALLACY_TYPES.items()
+            )
+        )
+        if all(result.error for result in lists):
+            # nothing usable, let the router fail over to the other backend
+            raise BackendError(f"All fallacy calls failed: {lists[0].error}")
+        return LogicalFallacyComplete(**dict(zip(FALLACY_TYPES, lists)))
+
+    async def embed_article(self, text: str) -> list[float]:
+        embedder = self.instance("Embedder")
+        artifact = await call_modal(
+            "Embedder.embed_article", embedder.embed_article, text
+        )
+        return artifact["document"]
+
+    async def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        embedder = self.instance("Embedder")
+        return await call_modal("Embedder.embed_texts", embedder.embed_texts, texts)
+
+    async def keywords(self, text: str) -> list[str]:
+        # the Embedder caches the article's embeddings, so this reuses them
+        embedder = self.instance("Embedder")
+        return await call_modal("Embedder.get_keywords", embedder.get_keywords, text)
+
+    async def llm_tag(self, text: str) -> str:
+        return await call_modal("get_tag", self.function("get_tag"), text)
+
+    async def probe(self) -> None:
+        # the Embedder is the cheapest container to start; called directly
+        # since a probe should not queue behind the limiter
+        with span(
+            "modal.probe",
+            **{"rpc.system": "modal", "rpc.method": "Embedder.embed_texts"},
+        ):
+            await self.instance("Embedder").embed_texts.remote.aio(["ping"])
+
+
+class TogetherBackend(InferenceBackend):
+    """
+    app/ml_newsly.py: the Together API, or local models where available.
+    """
+
+    name = "together"
+    optional = frozenset(("lean_explanation", "contextualize"))
+    # local models where installed, otherwise the Together model
+    models = {
+        "summary": (
+            "facebook/bart-large-cnn",
+            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+        ),
+        "lean": (
+            "bucketresearch/politicalBiasBERT",
+            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+        ),
+        "lean_explanation": (
+            "microsoft/phi-3-mini-128k-instruct",
+            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+        ),
+        "topics": (
+            "Qwen/Qwen2.5-3B-Instruct",
+            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+        ),
+        "contextualization": (
+            "TinyLlama/TinyLlama-1.1B-Chat-v1.0",
+            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+        ),
+        "logical_fallacies": ("meta-llama/Llama-3.3-70B-Instruct-Turbo",),
+        "embedding": (EMBEDDING_MODEL,),
+    }
+
+    @property
+    def views(self) -> dict[str, str]:
+        # the local BART and BERT run on a GPU only; elsewhere the summary and
+        # lean prompts go to Llama on Together, which reads the Llama view
+        # rather than text cut at the BART or BERT limit
+        if ml_newsly.get_device() == "cuda":
+            return {}
+        return {"summary": "lean_and_explanation", "lean": "lean_and_explanation"}
+
+    def supports(self, method: str) -> bool:
+        # the embeddings are local only, and sentence-transformers is optional
+        if method in ("embed_article", "embed_texts"):
+            if not ml_newsly.local_embedder_installed():
+                return False
+        return super().supports(method)
+
+    async def summarize(self, text: str) -> str:
+        return await ml_newsly.llm_summarize(text)
+
+    async def political_lean(self, text: str) -> dict:
+        return await ml_newsly.political_lean(text)
+
+    async def lean_explanation(
+        self, text: str, predicted_lean: str, lean_probability: float
+    ) -> str:
+        return await ml_newsly.lean_explanation(text, predicted_lean, lean_probability)
+
+    async def extract_topics(self, text: str) -> dict:
+        return await ml_newsly.extract_topics(text)
+
+    async def contextualize(self, text: str, topics: list[str]) -> str:
+        return await ml_newsly.contextualize_article(text, topics)
+
+    async def logical_fallacies(
+        self, text: str, deadline: Deadline | None = None
+    ) -> LogicalFallacyComplete:
+        return await ml_newsly.get_logical_fallacies(text)
+
+    async def embed_article(self, text: str) -> list[float]:
+        return await ml_newsly.embed_article(text)
+
+    async def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        return await ml_newsly.embed_texts(texts)
+
+    async def probe(self) -> None:
+        response = await generate_together(
+            model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
+            messages=[{"role": "user", "content": "ping"}],
+            max_tokens=1,
+        )
+        if response is None:
+            raise BackendError("No response from Together")
+
+
+STOPWORDS = set(
+    """a about after all also an and are as at be been but by can could for from
+    had has have he her his i if in into is it its more not of on or our over
+    said she so than that the their them there they this to up was we were what
+    when which who will with would you""".split()
+)
+
+
+class FakeBackendError(BackendError):
+    pass
+
+
+class FakeBackend(InferenceBackend):
+    """
+    An offline stand-in for load-testing the orchestration: every method
+    sleeps for a lognormal latency (scaled by the calls in flight beyond
+    capacity, with occasional cold starts), fails at failure_rate, and
+    otherwise returns plausible output derived from the text. The output is
+    deterministic per text; latencies and failures come from seed.
+    """
+
+    name = "fake"
+    optional = OPTIONAL_METHODS
+
+    # method: median seconds
+    LATENCIES = {
+        "token_budget": 0.1,
+        "summarize": 3.0,
+        "political_lean": 1.0,
+        "lean_explanation": 4.0,
+        "extract_topics": 2.0,
+        "contextualize": 5.0,
+        "logical_fallacies": 8.0,
+        "embed_article": 0.3,
+        "embed_texts": 0.3,
+        "keywords": 0.5,
+        "llm_tag": 1.5,
+        "probe": 0.05,
+    }
+
+    def __init__(
+        self,
+        latency_scale: float = float(os.environ.get("FAKE_LATENCY_SCALE", "1")),
+        latency_sigma: float = 0.5,
+        failure_rate: float = float(os.environ.get("FAKE_FAILURE_RATE", "0")),
+        cold_start_rate: float = float(os.environ.get("FAKE_COLD_START_RATE", "0.01")),
+        cold_start_seconds: float = 20.0,
+        capacity: int = int(os.environ.get("FAKE_CAPACITY", "32")),
+        seed: int | None = None,
+    ):
+        self.latency_scale = latency_scale
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.cold_start_rate = cold_start_rate
+        self.cold_start_seconds = cold_start_seconds
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.in_flight = Counter()
+
+    async def _simulate(self, method: str) -> None:
+        async with get_limiter(self.name, method).slot():
+            self.in_flight[method] += 1
+            try:
+                latency = self.LATENCIES[method] * self.latency_scale
+                latency *= self.rng.lognormvariate(0, self.latency_sigma)
+                # past capacity, calls queue up on the "GPU"
+                latency *= max(1.0, self.in_flight[method] / self.capacity)
+                if self.rng.random() < self.cold_start_rate:
+                    latency += self.cold_start_seconds * self.latency_scale
+                await asyncio.sleep(latency)
+                if self.rng.random() < self.failure_rate:
+                    raise FakeBackendError(f"Injected {method} failure")
+            finally:
+                self.in_flight[method] -= 1
+
+    @staticmethod
+    def _text_rng(text: str, salt: str = "") -> random.Random:
+        digest = hashlib.blake2b((salt + text).encode(), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+    @staticmethod
+    def _sentences(text: str) -> list[str]:
+        return [s for s in re.split(r"(?<=[.!?])\s+", text.strip()) if s]
+
+    @staticmethod
+    def _top_words(text: str, n: int) -> list[str]:
+        words = re.findall(r"[A-Za-z][A-Za-z'-]+", text.lower())
+        counts = Counter(w for w in words if len(w) > 3 and w not in STOPWORDS)
+        return [word for word, _ in counts.most_common(n)]
+
+    @staticmethod
+    def _embed(text: str) -> list[float]:
+        # feature hashing of the words, so texts sharing words are close
+        vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            if word in STOPWORDS:
+                continue
+            digest = hashlib.blake2b(word.encode(), digest_size=4).digest()
+            index = int.from_bytes(digest, "big")
+            vector[index % EMBEDDING_DIM] += 1.0 if index & (1 << 31) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    async def token_budget(self, text: str) -> dict:
+        await self._simulate("token_budget")
+        # about 1.3 tokens per word or punctuation mark
+        pieces = [m.end() for m in re.finditer(r"\w+|[^\w\s]", text)]
+        budget = {}
+        for name, limit in TOKEN_LIMITS.items():
+            tokens = int(len(pieces) * 1.3)
+            fits = int(limit / 1.3)
+            budget[name] = {
+                "tokenizer": "fake",
+                "tokens": tokens,
+                "limit": limit,
+                "char_end": pieces[fits - 1] if len(pieces) > fits else len(text),
+            }
+        return budget
+
+    async def summarize(self, text: str) -> str:
+        await self._simulate("summarize")
+        return " ".join(self._sentences(text)[:3])
+
+    async def political_lean(self, text: str) -> dict:
+        await self._simulate("political_lean")
+        rng = self._text_rng(text, "lean")
+        weights = [rng.gammavariate(1.0, 1.0) for _ in range(3)]
+        probabilities = {
+            lean: weight / sum(weights)
+            for lean, weight in zip(("left", "center", "right"), weights)
+        }
+        return {
+            "predicted_lean": max(probabilities, key=probabilities.get),
+            "probabilities": probabilities,
+        }
+
+    async def lean_explanation(
+        self, text: str, predicted_lean: str, lean_probability: float
+    ) -> str:
+        await self._simulate("lean_explanation")
+        words = ", ".join(self._top_words(text, 3))
+        return (
+            f"The article leans {predicted_lean} ({lean_probability:.2f}). "
+            f"Its coverage of {words} emphasizes arguments and sources commonly "
+            f"associated with {predicted_lean} viewpoints."
+        )
+
+    async def extract_topics(self, text: str) -> dict:
+        await self._simulate("extract_topics")
+        return {"topics": [word.title() for word in self._top_words(text, 3)]}
+
+    async def contextualize(self, text: str, topics: list[str]) -> str:
+        await self._simulate("contextualize")
+        return (
+            f"Debates about {', '.join(topics) or 'these issues'} have a long "
+            "history, and the article should be read against the political and "
+            "cultural developments that shaped them."
+        )
+
+    async def logical_fallacies(
+        self, text: str, deadline: Deadline | None = None
+    ) -> LogicalFallacyComplete:
+        await self._simulate("logical_fallacies")
+        sentences = self._sentences(text)
+        lists = {}
+        for fallacy_type in FALLACY_TYPES:
+            rng = self._text_rng(text, fallacy_type)
+            fallacies = []
+            if sentences and rng.random() < 0.3:
+                fallacies.append(
+                    LogicalFallacyServer(
+                        reason=fallacy_type.replace("_", " "),
+                        quote=rng.choice(sentences),
+                        rating=rng.randint(1, 5),
+                        explanation=f"This passage may be an instance of {fallacy_type.replace('_', ' ')}.",
+                    )
+                )
+            lists[fallacy_type] = LogicalFallacyServerList(logical_fallacies=fallacies)
+        return LogicalFallacyComplete(**lists)
+
+    async def embed_article(self, text: str) -> list[float]:
+        await self._simulate("embed_article")
+        return self._embed(text)
+
+    async def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        await self._simulate("embed_texts")
+        return [self._embed(text) for text in texts]
+
+    async def keywords(self, text: str) -> list[str]:
+        await self._simulate("keywords")
+        return self._top_words(text, 5)
+
+    async def llm_tag(self, text: str) -> str:
+        await self._simulate("llm_tag")
+        words = set(self._top_words(text, 20))
+        return max(
+            VALID_TAGS,
+            key=lambda tag: len(words & set(re.findall(r"\w+", TAG_DESCRIPTIONS[tag]))),
+        )
+
+    async def probe(self) -> None:
+        await self._simulate("probe")
+
+
+BACKEND_CLASSES = {
+    "modal": ModalBackend,
+    "together": TogetherBackend,
+    "fake": FakeBackend,
+}
+
+backends: dict[str, InferenceBackend] = {}
+
+
+def get_backends(names: tuple[str, ...] | None = None) -> dict[str, InferenceBackend]:
+    """
+    The enabled backends (INFERENCE_BACKENDS), or the given ones, by name.
+    Backends are created on first use and their probes registered with the router.
+    """
+    if names is None:
+        names = tuple(
+            name for name in map(str.strip, INFERENCE_BACKENDS.split(",")) if name
+        )
+    for name in names:
+        if name not in backends:
+            backends[name] = BACKEND_CLASSES[name]()
+            router.set_probe(name, backends[name].probe)
+    return {name: backends[name] for name in names}
@@ -0,0 +1,125 @@
+import re
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# Query parameters that identify the article itself on sites that route by query
+ID_PARAMS = {"id", "p", "story_id", "storyid", "article_id", "articleid", "aid"}
+
+# Subdomains that serve the same article as the main site
+ALIAS_SUBDOMAINS = ("www", "m", "mobile", "amp")
+
+# AMP variants of an article path, e.g. /2024/story/amp/ or /story.amp.html.
+# Only applied on sites known to serve AMP (an amp subdomain or a DomainRule
+# with amp set): elsewhere a path like /amp/... may be a real article.
+AMP_PATH_PATTERNS = [
+    (re.compile(r"^/amp(/.*)$"), r"\1"),
+    (re.compile(r"/amp/?$"), ""),
+    (re.compile(r"\.amp(\.html?)?$"), r"\1"),
+]
+
+
+@dataclass
+class DomainRule:
+    # query parameters (besides ID_PARAMS) that select the article on this site
+    keep_params: tuple[str, ...] = ()
+    # rewrite the host, e.g. regional editions that serve the same article
+    host: str | None = None
+    # the site serves AMP pages under AMP_PATH_PATTERNS paths
+    amp: bool = False
+
+
+# Keyed by host without alias subdomains; a rule also applies to its subdomains.
+DOMAIN_RULES: dict[str, DomainRule] = {
+    "edition.cnn.com": DomainRule(host="cnn.com"),
+    "us.cnn.com": DomainRule(host="cnn.com"),
+    "news.ycombinator.com": DomainRule(keep_params=("id",)),
+    "youtube.com": DomainRule(keep_params=("v",)),
+    "c-span.org": DomainRule(keep_params=("v",)),
+    "bbc.co.uk": DomainRule(host="bbc.com"),
+    "cbsnews.com": DomainRule(amp=True),
+    "foxnews.com": DomainRule(amp=True),
+}
+
+
+def _strip_alias_subdomains(host: str) -> str:
+    labels = host.split(".")
+    while len(labels) > 2 and labels[0] in ALIAS_SUBDOMAINS:
+        labels = labels[1:]
+    return ".".join(labels)
+
+
+def _find_rule(host: str) -> DomainRule | None:
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        rule = DOMAIN_RULES.get(".".join(labels[i:]))
+        if rule:
+            return rule
+    return None
+
+
+def site_of(url: str) -> str:
+    """
+    The registrable part of a URL's host, e.g. "bbc.co.uk" for
+    "https://www.bbc.co.uk/news". Used to check that a rel=canonical link
+    points at the same site that served the page.
+    """
+    host = (urlparse(url).hostname or "").lower()
+    labels = host.split(".")
+    # second-level public suffixes like co.uk or com.au
+    if len(labels) >= 3 and len(labels[-2]) <= 3 and len(labels[-1]) == 2:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonicalize an article URL so every variant of the same article maps to
+    one cache key: https scheme, lowercase host without www/mobile/amp
+    subdomains, no AMP path suffix (on sites serving AMP), no trailing slash,
+    no fragment, and only the query parameters that select the article.
+    The canonical URL is a cache key: fetch the URL as given, which may need
+    what this drops (a subdomain, http, a trailing slash or a parameter).
+    Args:
+        url (str): The URL to canonicalize.
+    Returns:
+        str: The canonical URL.
+    """
+    parsed = urlparse(url.strip())
+    if not parsed.netloc and parsed.path and "://" not in url:
+        # pasted without a scheme, e.g. "cnn.com/2024/..."
+        parsed = urlparse("https://" + url.strip())
+
+    full_host = (parsed.hostname or "").lower()
+    host = _strip_alias_subdomains(full_host)
+    rule = _find_rule(host)
+    serves_amp = bool(rule and rule.amp) or "amp" in full_host.split(".")[:-2]
+    if rule and rule.host:
+        host = rule.host
+
+    path = re.sub(r"/{2,}", "/", parsed.path or "/")
+    if serves_amp:
+        for pattern, replacement in AMP_PATH_PATTERNS:
+            path = pattern.sub(replacement, path)
+    path = path.rstrip("/")
+
+    keep = ID_PARAMS | set(rule.keep_params if rule else ())
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parsed.query, keep_blank_values=False)
+            if key.lower() in keep
+        )
+    )
+
+    return urlunparse(("https", host, path, "", query, ""))
+
+
+def fetch_url(url: str) -> str:
+    """
+    The URL to fetch for one as submitted: unchanged but for a missing scheme.
+    """
+    url = url.strip()
+    if "://" not in url:
+        # pasted without a scheme, e.g. "cnn.com/2024/..."
+        url = "https://" + url
+    return url
@@ -3,6 +3,8 @@ import time
 import aiohttp
 import asyncio
 import random
+from app.limiter import get_limiter
+from app.tracing import span
 
 
 async def generate_together(
@@ -12,42 +14,62 @@ async def generate_together(
 
     key = os.environ.get("TOGETHER_API_KEY")
 
-    for sleep_time in [1, 2, 4, 8, 16, 32]:
+    for attempt, sleep_time in enumerate([1, 2, 4, 8, 16, 32], 1):
 
         try:
-            endpoint = "https://api.together.xyz/v1/chat/completions"
-            random_multiplier = random.uniform(0.5, 1.5)
-            await asyncio.sleep(5 * random_multiplier)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    endpoint,
-                    json={
-                        "model": model,
-                        "max_tokens": max_tokens,
-                        "temperature": (temperature if temperature > 1e-4 else 0),
-                        "messages": messages,
-                        "response_format": (
-                            str if response_format is None else response_format
-                        ),
-                    },
-                    headers={
-                        "Authorization": f"Bearer {key}",
-                    },
-                ) as res:
-                    response_data = await res.json()
-
-                    if "error" in response_data:
-                        print("------------------------------------------")
-                        print(f"Model with Error: {model}")
-                        print(response_data)
-                        print("------------------------------------------")
-
-                        if response_data["error"]["type"] == "invalid_request_error":
-                            return None
-
-                    output = response_data["choices"][0]["message"]["content"]
-                    break
+            # a span per attempt, the jittered wait and the limiter queue included
+            with span(
+                "together.chat",
+                **{
+                    "gen_ai.system": "together",
+                    "gen_ai.request.model": model,
+                    "retry.attempt": attempt,
+                },
+            ) as s:
+                endpoint = "https://api.together.xyz/v1/chat/completions"
+                random_multiplier = random.uniform(0.5, 1.5)
+                await asyncio.sleep(5 * random_multiplier)
+
+                async with get_limiter("together", model).slot() as slot:
+                    s.add_event("slot acquired")
+                    async with aiohttp.ClientSession() as session:
+                        async with session.post(
+                            endpoint,
+                            json={
+                                "model": model,
+                                "max_tokens": max_tokens,
+                                "temperature": (
+                                    temperature if temperature > 1e-4 else 0
+                                ),
+                                "messages": messages,
+                                "response_format": (
+                                    str if response_format is None else response_format
+                                ),
+                            },
+                            headers={
+                                "Authorization": f"Bearer {key}",
+                            },
+                        ) as res:
+                            s.set_attribute("http.response.status_code", res.status)
+                            if res.status == 429:
+                                slot.overloaded()
+                            response_data = await res.json()
+
+                        if "error" in response_data:
+                            s.set_error(str(response_data["error"]))
+                            print("------------------------------------------")
+                            print(f"Model with Error: {model}")
+                            print(response_data)
+                            print("------------------------------------------")
+
+                            if (
+                                response_data["error"]["type"]
+                                == "invalid_request_error"
+                            ):
+                                return None
+
+                        output = response_data["choices"][0]["message"]["content"]
+                        break
 
         except Exception as e:
             print(f"{e} on response")
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from app.db import get_known_urls
+from app.deadlines import Deadline
+from app.server import process_article_db
+from app.utils import normalize_url, parse_timestamp
+
+# RSS/Atom feeds and (news) sitemaps to pre-analyze, comma separated. The
+# crawler warms the article cache so that users pasting a link to a fresh
+# story find it already analyzed.
+CRAWLER_FEEDS = [
+    feed.strip()
+    for feed in os.environ.get("CRAWLER_FEEDS", "").split(",")
+    if feed.strip()
+]
+CRAWLER_INTERVAL = float(os.environ.get("CRAWLER_INTERVAL_SECONDS", "600"))
+CRAWLER_CONCURRENCY = int(os.environ.get("CRAWLER_CONCURRENCY", "2"))
+# items older than this (when the feed dates them) are not worth analyzing
+CRAWLER_MAX_AGE = timedelta(hours=float(os.environ.get("CRAWLER_MAX_AGE_HOURS", "48")))
+CRAWLER_MAX_ITEMS_PER_FEED = int(os.environ.get("CRAWLER_MAX_ITEMS_PER_FEED", "50"))
+# sitemap indexes can list thousands of sitemaps; only the newest are followed
+MAX_CHILD_SITEMAPS = 5
+FETCH_TIMEOUT = 30
+
+
+def _local_name(element) -> str:
+    # "{http://www.sitemaps.org/schemas/sitemap/0.9}url" -> "url"
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _child_text(element, *names: str) -> str | None:
+    for child in element.iter():
+        if child is not element and _local_name(child) in names:
+            if child.text and child.text.strip():
+                return child.text.strip()
+    return None
+
+
+def _entry_link(entry) -> str | None:
+    for child in entry:
+        if _local_name(child) != "link":
+            continue
+        # Atom links keep the URL in href, next to self/enclosure links
+        if child.get("href"):
+            if child.get("rel", "alternate") == "alternate":
+                return child.get("href")
+        elif child.text and child.text.strip():
+            return child.text.strip()
+    return None
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)  # RSS
+    except (TypeError, ValueError):
+        pass
+    try:
+        return parse_timestamp(value)  # Atom, sitemaps
+    except ValueError:
+        return None
+
+
+def parse_feed(content: bytes) -> tuple[list[tuple[str, datetime | None]], list[str]]:
+    """
+    Parse an RSS or Atom feed, a sitemap or a sitemap index.
+    Returns:
+        (items, sitemaps): The (url, published date or None) of each item,
+        newest first where dated, and the child sitemaps of a sitemap index.
+    """
+    root = ElementTree.fromstring(content)
+    kind = _local_name(root)
+    items, sitemaps = [], []
+
+    if kind == "sitemapindex":
+        dated = [
+            (_child_text(sitemap, "loc"), _parse_date(_child_text(sitemap, "lastmod")))
+            for sitemap in root
+            if _local_name(sitemap) == "sitemap"
+        ]
+        sitemaps = [loc for loc, _ in _newest_first(dated) if loc]
+    elif kind == "urlset":
+        for entry in root:
+            if _local_name(entry) == "url":
+                # news sitemaps date items with news:publication_date
+                date = _child_text(entry, "publication_date", "lastmod")
+                items.append((_child_text(entry, "loc"), _parse_date(date)))
+    elif kind in ("rss", "RDF", "feed"):
+        for entry in root.iter():
+            if _local_name(entry) in ("item", "entry"):
+                date = _child_text(entry, "pubDate", "published", "updated", "date")
+                items.append((_entry_link(entry), _parse_date(date)))
+    else:
+        raise ValueError(f"Not a feed or sitemap: <{kind}>")
+
+    return [(url, date) for url, date in _newest_first(items) if url], sitemaps
+
+
+def _newest_first(items: list[tuple]) -> list[tuple]:
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+
+    def key(item):
+        date = item[1]
+        if date and date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return date or oldest
+
+    return sorted(items, key=key, reverse=True)
+
+
+async def fetch(session: aiohttp.ClientSession, url: str) -> bytes:
+    async with session.get(
+        url, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def discover(
+    session: aiohttp.ClientSession, feed: str, sitemap_depth: int = 1
+) -> list[str]:
+    """
+    The fresh article URLs listed by one feed or sitemap (index).
+    """
+    items, sitemaps = parse_feed(await fetch(session, feed))
+    if sitemap_depth > 0:
+        for sitemap in sitemaps[:MAX_CHILD_SITEMAPS]:
+            try:
+                items += [(url, None) for url in await discover(session, sitemap, 0)]
+            except Exception as e:
+                print(f"Crawler failed to read sitemap {sitemap}: {e}")
+
+    cutoff = datetime.now(timezone.utc) - CRAWLER_MAX_AGE
+    urls = []
+    for url, date in items:
+        if date and date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        if date is None or date >= cutoff:
+            urls.append(url)
+    return urls[:CRAWLER_MAX_ITEMS_PER_FEED]
+
+
+class Crawler:
+    """
+    Polls the feeds and pre-analyzes new articles through process_article_db,
+    a few at a time, in the scheduler's prefetch class so that interactive
+    requests go first.
+    """
+
+    def __init__(
+        self,
+        feeds: list[str] = CRAWLER_FEEDS,
+        concurrency: int = CRAWLER_CONCURRENCY,
+    ):
+        self.feeds = list(feeds)
+        self.concurrency = concurrency
+        # URLs already stored or tried -> when, so that they are not looked up
+        # again. Kept for CRAWLER_MAX_AGE, after which feeds no longer list
+        # them, so that a long-running server doesn't collect every URL.
+        self.seen: dict[str, float] = {}
+        self.last_crawl: dict = {}
+        self.totals = {"discovered": 0, "new": 0, "analyzed": 0, "failed": 0}
+
+    async def crawl_once(self) -> dict:
+        """
+        One pass over every feed. Returns the counts of the pass.
+        """
+        start = time.monotonic()
+        counts = {"discovered": 0, "new": 0, "analyzed": 0, "failed": 0}
+
+        async with aiohttp.ClientSession() as session:
+            found = await asyncio.gather(
+                *(discover(session, feed) for feed in self.feeds),
+                return_exceptions=True,
+            )
+        urls = []
+        # normalized URL -> the URL as listed, which is what gets fetched
+        listed = {}
+        for feed, result in zip(self.feeds, found):
+            if isinstance(result, Exception):
+                print(f"Crawler failed to read feed {feed}: {result}")
+                continue
+            for url in result:
+                urls.append(normalize_url(url))
+                listed.setdefault(urls[-1], url)
+        counts["discovered"] = len(urls)
+
+        cutoff = start - CRAWLER_MAX_AGE.total_seconds()
+        self.seen = {url: seen for url, seen in self.seen.items() if seen > cutoff}
+        urls = list(dict.fromkeys(url for url in urls if url not in self.seen))
+        known = await asyncio.to_thread(get_known_urls, urls)
+        self.seen.update(dict.fromkeys(known, start))
+        new = [url for url in urls if url not in known]
+        counts["new"] = len(new)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def analyze(url: str) -> None:
+            async with semaphore:
+                self.seen[url] = time.monotonic()
+                try:
+                    # not a read, even when the URL is an alias or the
+                    # canonical URL of a stored article
+                    await process_article_db(
+                        listed[url],
+                        deadline=Deadline(),
+                        priority="prefetch",
+                        count_read=False,
+                    )
+                    counts["analyzed"] += 1
+                except Exception as e:
+                    print(f"Crawler failed to analyze {url}: {e}")
+                    if getattr(e, "status_code", None) == 504:
+                        # timed out (likely queued behind users); retry next pass
+                        self.seen.pop(url, None)
+                    counts["failed"] += 1
+
+        await asyncio.gather(*(analyze(url) for url in new))
+
+        for key, value in counts.items():
+            self.totals[key] += value
+        self.last_crawl = {
+            **counts,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.monotonic() - start, 1),
+        }
+        print(f"Crawl finished: {self.last_crawl}")
+        return counts
+
+    async def run(self, interval: float = CRAWLER_INTERVAL) -> None:
+        """
+        Crawl every interval seconds, forever.
+        """
+        while True:
+            try:
+                await self.crawl_once()
+            except Exception as e:
+                print(f"Crawl failed: {e}")
+            await asyncio.sleep(interval)
+
+    def status(self) -> dict:
+        return {
+            "feeds": self.feeds,
+            "interval_seconds": CRAWLER_INTERVAL,
+            "last_crawl": self.last_crawl,
+            "totals": self.totals,
+        }
+
+
+crawler = Crawler()
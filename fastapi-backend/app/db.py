@@ -1,36 +1,57 @@
 from dataclasses import dataclass
 import dataclasses
-import os
-from supabase import create_client, Client
-from datetime import datetime
+import json
+from datetime import datetime, timezone
 from app.newsly_types import NewslyArticle
+from app.storage import get_store
+from app.text_store import load_text, save_text
+from app.tracing import span, traced
 
 import app.utils as utils
 
-# dotenv
-from dotenv import load_dotenv
+# The tables live in Supabase, or in SQLite with STORAGE_BACKEND=sqlite (see
+# app.storage); the store is opened on first use. Every call is traced (see
+# app.tracing).
 
-load_dotenv()
+# Analysis internals the client never sees: the embedding (384 floats), the
+# token budget, the stage versions and the fingerprint. Only read by
+# load_article_internals, for the indexes and (re)analysis; until then they
+# are None on an article read from the database, and left out of its writes.
+INTERNAL_COLUMNS = ("embedding", "token_budget", "stage_versions", "fingerprint")
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(url, key)
+# Every column but the text, which is stored compressed in app.text_store
+# (articles.text_hash) and only read by load_article_text, and the internals.
+ARTICLE_COLUMNS = ", ".join(
+    f.name
+    for f in dataclasses.fields(NewslyArticle)
+    if f.name != "text" and f.name not in INTERNAL_COLUMNS
+)
 
 
+def _article(row: dict) -> NewslyArticle:
+    # remove any extra fields, they would cause errors
+    article_data = utils.filter_article_data(row)
+    article_data.setdefault("text", "")
+    for column in INTERNAL_COLUMNS:
+        article_data.setdefault(column, None)
+    return NewslyArticle(**article_data)
+
+
+@traced()
 def get_all_articles() -> list[NewslyArticle]:
-    # Get all articles from the database
-    response = supabase.table("articles").select("*").execute()
-    return (
-        [
-            NewslyArticle(**utils.filter_article_data(article))  # filter first
-            for article in response.data
-        ]
-        if response.data
-        else []
-    )
+    """
+    Get all articles from the database (without their text), in memory. For
+    scans of the whole table use iter_article_pages, which keeps one page at
+    a time.
+    """
+    return [
+        _article(article)
+        for page in iter_article_pages(ARTICLE_COLUMNS)
+        for article in page
+    ]
 
 
+@traced()
 def get_article_by_url(url: str) -> NewslyArticle | None:
     # Get article by URL from the database
 
@@ -38,39 +59,264 @@ def get_article_by_url(url: str) -> NewslyArticle | None:
     if utils.TEST:
         return None
 
-    response = supabase.table("articles").select("*").eq("url", url).execute()
-    if response.data:
-        article_data = utils.filter_article_data(
-            response.data[0]
-        )  # do this step to remove any extra fields. extra fields will cause errors
-        return NewslyArticle(**article_data)
+    rows = get_store().select("articles", ARTICLE_COLUMNS, [("url", "eq", url)])
+    if rows:
+        return _article(rows[0])
+
+    # the URL may be a known variant of an article stored under another URL
+    article_id = get_article_id_by_alias(url)
+    if article_id:
+        return get_article_by_id(article_id)
+
+    return None
+
+
+# The article_aliases table maps URL variants (other canonical forms, legacy
+# cache keys, rel=canonical targets) to the article they resolve to:
+#   url text primary key, article_id uuid references articles(id) on delete cascade
+@traced()
+def get_article_id_by_alias(url: str) -> str | None:
+    rows = get_store().select("article_aliases", "article_id", [("url", "eq", url)])
+    if rows:
+        return rows[0]["article_id"]
+    return None
+
+
+@traced()
+def add_article_aliases(article_id: str, urls: list[str]):
+    """
+    Record URLs that resolve to the given article. Existing aliases are kept.
+    """
+    if utils.TEST or not article_id:
+        return []
+
+    rows = [{"url": url, "article_id": article_id} for url in set(urls) if url]
+    if not rows:
+        return []
+
+    return get_store().upsert(
+        "article_aliases", rows, on_conflict="url", ignore_duplicates=True
+    )
+
+
+@traced()
+def get_article_by_id(article_id: str) -> NewslyArticle | None:
+    # Get article by ID from the database
+    rows = get_store().select("articles", ARTICLE_COLUMNS, [("id", "eq", article_id)])
+    if rows:
+        return _article(rows[0])
     else:
         return None
 
 
+@traced()
+def load_article_text(article: NewslyArticle) -> str:
+    """
+    Fill in the text of an article read from the database: from the text
+    store, or from the text column of a row stored before the text store.
+    """
+    if article.text:
+        return article.text
+    text = None
+    if article.text_hash:
+        text = load_text(article.text_hash)
+    elif article.id and not utils.TEST:
+        rows = get_store().select("articles", "text", [("id", "eq", article.id)])
+        text = rows[0].get("text") if rows else None
+    article.text = text or ""
+    return article.text
+
+
+@traced()
+def load_article_internals(article: NewslyArticle) -> NewslyArticle:
+    """
+    Fill in the INTERNAL_COLUMNS of an article read from the database that
+    weren't loaded (None) yet.
+    """
+    missing = [
+        column for column in INTERNAL_COLUMNS if getattr(article, column) is None
+    ]
+    if not missing or not article.id:
+        return article
+    rows = get_store().select(
+        "articles", ", ".join(missing), [("id", "eq", article.id)]
+    )
+    row = rows[0] if rows else {}
+    fields = {f.name: f for f in dataclasses.fields(NewslyArticle)}
+    for column in missing:
+        value = row.get(column)
+        if value is None:
+            # unset in the row: the dataclass default
+            field = fields[column]
+            value = (
+                field.default
+                if field.default_factory is dataclasses.MISSING
+                else field.default_factory()
+            )
+        setattr(article, column, value)
+    return article
+
+
+def iter_article_pages(
+    columns: str,
+    page_size: int = 1000,
+    after: str | None = None,
+    not_null: str | None = None,
+    analyzed_after: str | None = None,
+):
+    """
+    Yield the rows of the articles table with the given columns, one page
+    (list of rows) at a time, ordered by id (Supabase caps a response at
+    1000 rows).
+    Pages follow a keyset cursor (id > the last id seen) rather than an
+    offset, so every page costs the same however deep the scan is, and rows
+    inserted or deleted meanwhile don't shift the pages.
+    Args:
+        columns (str): The columns to select; id is always included.
+        after (str): Start after this id, e.g. to resume a scan.
+        not_null (str): Only rows where this column is set.
+        analyzed_after (str): Only rows with a later last_analyzed_at.
+    """
+    if "id" not in [column.strip() for column in columns.split(",")] and columns != "*":
+        columns = "id, " + columns
+    filters = []
+    if not_null:
+        filters.append((not_null, "not_null", None))
+    if analyzed_after is not None:
+        filters.append(("last_analyzed_at", "gt", analyzed_after))
+    while True:
+        cursor = [("id", "gt", after)] if after is not None else []
+        # a span per page: one can't stay open across the yield
+        with span("db.iter_article_pages", **{"db.page_size": page_size}):
+            rows = get_store().select(
+                "articles", columns, filters + cursor, order="id", limit=page_size
+            )
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            break
+        after = rows[-1]["id"]
+
+
+def _select_pages(columns: str, not_null: str, page_size: int = 1000):
+    """
+    Yield every row of the articles table with the given columns, where the
+    not_null column is set.
+    """
+    for page in iter_article_pages(columns, page_size, not_null=not_null):
+        yield from page
+
+
+@traced()
+def get_article_fingerprints() -> list[tuple[str, str]]:
+    """
+    Get the (id, fingerprint) pair of every article that has a fingerprint.
+    Only the two columns are selected so this stays cheap as the table grows.
+    """
+    if utils.TEST:
+        return []
+
+    return [
+        (row["id"], row["fingerprint"])
+        for row in _select_pages("id, fingerprint", "fingerprint")
+        if row.get("fingerprint")
+    ]
+
+
+@traced()
+def get_article_embeddings() -> list[tuple[str, list[float]]]:
+    """
+    Get the (id, embedding) pair of every article that has an embedding
+    (a jsonb list of floats).
+    """
+    if utils.TEST:
+        return []
+
+    return [
+        (row["id"], row["embedding"])
+        for row in _select_pages("id, embedding", "embedding")
+        if row.get("embedding")
+    ]
+
+
+@traced()
+def get_article_token_budgets() -> list[dict]:
+    """
+    Get the token_budget (jsonb, see app.token_budget) of every article that has one.
+    """
+    if utils.TEST:
+        return []
+
+    return [
+        row["token_budget"]
+        for row in _select_pages("id, token_budget", "token_budget")
+        if row.get("token_budget")
+    ]
+
+
+@traced()
+def get_article_previews(article_ids: list[str]) -> list[dict]:
+    """
+    Get the fields needed to list articles (no text or analysis) for the given IDs.
+    """
+    if not article_ids:
+        return []
+
+    return get_store().select(
+        "articles",
+        "id, url, title, image_url, published_date, lean, tag",
+        [("id", "in", article_ids)],
+    )
+
+
+# The topic_backgrounds table caches LLM-written topic backgrounds shared by all
+# articles: topic_key text primary key, topic text, background text,
+# updated_at timestamptz
+@traced()
+def get_stored_topic_background(topic_key: str) -> dict | None:
+    rows = get_store().select(
+        "topic_backgrounds", "background, updated_at", [("topic_key", "eq", topic_key)]
+    )
+    return rows[0] if rows else None
+
+
+@traced()
+def save_topic_background(topic_key: str, topic: str, background: str):
+    return get_store().upsert(
+        "topic_backgrounds",
+        [
+            {
+                "topic_key": topic_key,
+                "topic": topic,
+                "background": background,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+        ],
+        on_conflict="topic_key",
+    )
+
+
+@traced()
 def delete_article_by_id(article_id: str):
     # Delete an article by ID from the database
-    response = supabase.table("articles").delete().eq("id", article_id).execute()
-    return response.data
+    return get_store().delete("articles", [("id", "eq", article_id)])
 
 
+@traced()
 def delete_article_by_url(url: str):
     # Delete an article by URL from the database
-    response = supabase.table("articles").delete().eq("url", url).execute()
-    return response.data
+    return get_store().delete("articles", [("url", "eq", url)])
 
 
+@traced()
 def increment_article_read_count(article_id: str, previous_read_count: int = 0):
     # Increment the read count of an article
-    response = (
-        supabase.table("articles")
-        .update({"read_count": previous_read_count + 1})
-        .eq("id", article_id)
-        .execute()
+    return get_store().update(
+        "articles", {"read_count": previous_read_count + 1}, [("id", "eq", article_id)]
     )
-    return response.data
 
 
+@traced()
 def add_article_to_db(article: NewslyArticle) -> NewslyArticle | None:
     """
     Add an article to the database.
@@ -79,27 +325,18 @@ def add_article_to_db(article: NewslyArticle) -> NewslyArticle | None:
     Returns:
         dict: The article data that got stored in the database.
     """
-    parsed_article = dataclasses.asdict(article)
-
-    # these are generated by the database, so we don't want to include them otherwise, supabase will throw an error
-    if not parsed_article.get("id"):
-        del parsed_article["created_at"]
-        del parsed_article["id"]
-
     # Add article to the database
     if not utils.TEST:
-        response = supabase.table("articles").insert(parsed_article).execute()
-        if response.data:
-            article_data = utils.filter_article_data(
-                response.data[0]
-            )  # do this step to remove any extra fields. extra fields will cause errors
-            return NewslyArticle(**article_data)
+        rows = get_store().insert("articles", [_article_row(article)])
+        if rows:
+            return _article(rows[0])
     else:
         return article
 
     return None
 
 
+@traced()
 def update_article(article: NewslyArticle) -> NewslyArticle | None:
     """
     Update an article in the database.
@@ -111,14 +348,108 @@ def update_article(article: NewslyArticle) -> NewslyArticle | None:
     if not article_id:
         raise ValueError("Article ID is required for updating.")
 
-    data = dataclasses.asdict(article)
+    data = _article_row(article)
 
     # Update an article by ID in the database
-    response = supabase.table("articles").update(data).eq("id", article_id).execute()
-    if response.data:
-        article_data = utils.filter_article_data(
-            response.data[0]
-        )  # do this step to remove any extra fields. extra fields will cause errors
-        return NewslyArticle(**article_data)
+    rows = get_store().update("articles", data, [("id", "eq", article_id)])
+    if rows:
+        return _article(rows[0])
     else:
         return None
+
+
+def _article_row(article: NewslyArticle) -> dict:
+    # a row stored before the text store would lose its text otherwise
+    if not article.text and not article.text_hash:
+        load_article_text(article)
+    row = dataclasses.asdict(article)
+    # internals that weren't loaded would overwrite the stored ones
+    for column in INTERNAL_COLUMNS:
+        if row[column] is None:
+            del row[column]
+
+    # these are generated by the database, so we don't want to include them otherwise, supabase will throw an error
+    if not row.get("id"):
+        del row["created_at"]
+        del row["id"]
+
+    # the body goes to the text store, deduplicated by hash
+    if article.text:
+        article.text_hash = row["text_hash"] = save_text(article.text)
+    row["text"] = ""
+    return row
+
+
+@traced()
+def add_articles_to_db(articles: list[NewslyArticle]) -> list[NewslyArticle]:
+    """
+    Insert new articles in one request. Returns the stored articles.
+    """
+    if utils.TEST:
+        return articles
+    if not articles:
+        return []
+
+    rows = get_store().insert("articles", [_article_row(a) for a in articles])
+    return [_article(row) for row in rows]
+
+
+@traced()
+def update_articles(articles: list[NewslyArticle]) -> list[NewslyArticle]:
+    """
+    Update stored articles (by ID) in one request. Returns the stored articles.
+    """
+    if any(not article.id for article in articles):
+        raise ValueError("Article ID is required for updating.")
+    if utils.TEST:
+        return articles
+    if not articles:
+        return []
+
+    rows = get_store().upsert(
+        "articles", [_article_row(a) for a in articles], on_conflict="id"
+    )
+    return [_article(row) for row in rows]
+
+
+@traced()
+def get_known_urls(urls: list[str], chunk_size: int = 100) -> set[str]:
+    """
+    The URLs among urls that are stored, as an article URL or an alias.
+    """
+    if utils.TEST:
+        return set()
+
+    known = set()
+    urls = list(set(urls))
+    for i in range(0, len(urls), chunk_size):
+        chunk = urls[i : i + chunk_size]
+        for table in ("articles", "article_aliases"):
+            rows = get_store().select(table, "url", [("url", "in", chunk)])
+            known.update(row["url"] for row in rows)
+    return known
+
+
+@traced()
+def update_article_fields(updates: dict[str, dict]) -> int:
+    """
+    Apply partial updates ({article id: {column: value}}), sending only the
+    changed columns. Articles getting the same changes share one request.
+    Returns the number of rows updated.
+    """
+    if utils.TEST or not updates:
+        return 0
+
+    groups: dict[str, tuple[dict, list[str]]] = {}
+    for article_id, fields in updates.items():
+        key = json.dumps(fields, sort_keys=True, default=str)
+        groups.setdefault(key, (fields, []))[1].append(article_id)
+
+    updated = 0
+    for fields, article_ids in groups.values():
+        for i in range(0, len(article_ids), 100):
+            rows = get_store().update(
+                "articles", fields, [("id", "in", article_ids[i : i + 100])]
+            )
+            updated += len(rows)
+    return updated
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+# Deadlines for the analysis fan-out. Every stage gets its own timeout, capped
+# by what is left of the request deadline, so one stuck Modal container can
+# no longer hold a request open forever.
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "300"))
+
+# seconds, per stage of server.analyze_article
+STAGE_DEADLINES = {
+    "token_budget": 30,
+    "summary": 120,
+    # on Modal, lean and topics also produce the explanation and contextualization
+    "lean": 120,
+    "lean_explanation": 90,
+    "topics": 180,
+    "contextualization": 120,
+    "logical_fallacies": 180,
+    "fallacy": 150,
+    "embedding": 60,
+    "tag": 60,
+    "keywords": 60,
+}
+DEFAULT_STAGE_DEADLINE = 120
+
+# A call still running after the stage's p95 latency gets a duplicate, and
+# whichever finishes first wins. The stages are pure inference, so running
+# one twice is safe; it costs at most ~5% extra calls.
+HEDGE_REQUESTS = bool(int(os.environ.get("HEDGE_REQUESTS", "1")))
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} did not finish within {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class Deadline:
+    """
+    An absolute deadline shared by all the stages of one request.
+    """
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful calls, per stage.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.samples: dict[str, deque] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(
+        self, stage: str, q: float, min_samples: int = HEDGE_MIN_SAMPLES
+    ) -> float | None:
+        """
+        The q-quantile latency of the stage, or None until there are
+        min_samples samples.
+        """
+        samples = self.samples.get(stage)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+latencies = LatencyTracker()
+
+
+async def _hedged(stage: str, call, hedge_after: float | None):
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            print(f"{stage} slower than p95 ({hedge_after:.1f}s), hedging")
+            tasks.append(asyncio.ensure_future(call()))
+            pending = set(tasks)
+
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if not pending:
+                # every attempt failed, raise the first error
+                return tasks[0].result()
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+    finally:
+        # cancelling the loser also cancels its Modal function call
+        for task in tasks:
+            task.cancel()
+            # the loser's error isn't needed, but must be retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def latency_key(stage: str, backend: str | None = None) -> str:
+    return f"{backend}:{stage}" if backend else stage
+
+
+async def run_stage(
+    stage: str,
+    call,
+    deadline: Deadline | None = None,
+    hedge=True,
+    backend: str | None = None,
+):
+    """
+    Run one stage under its deadline, hedging it if it is slower than usual.
+    Args:
+        stage (str): The stage name, a key of STAGE_DEADLINES.
+        call: A function returning a new awaitable for the stage each time it
+            is called, e.g. lambda: modal_summarize.remote.aio(text).
+        deadline (Deadline): The request deadline, if any.
+        hedge (bool): Whether a duplicate call may be started.
+        backend (str): The backend serving the call, latencies are tracked
+            per backend and stage.
+    Raises:
+        DeadlineExceeded: If the stage did not finish in time.
+    """
+    timeout = STAGE_DEADLINES.get(stage, DEFAULT_STAGE_DEADLINE)
+    if deadline:
+        timeout = min(timeout, deadline.remaining())
+
+    key = latency_key(stage, backend)
+    hedge_after = None
+    if hedge and HEDGE_REQUESTS:
+        hedge_after = latencies.quantile(key, HEDGE_QUANTILE)
+
+    start = time.monotonic()
+    try:
+        result = await asyncio.wait_for(_hedged(key, call, hedge_after), timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(key, timeout) from None
+    latencies.record(key, time.monotonic() - start)
+    return result
+
+
+async def cancel_on_disconnect(request, aw, poll_interval: float = 1.0):
+    """
+    Await aw, cancelling it if the client of the (Starlette) request goes away.
+    Returns None if the client disconnected.
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("Client disconnected, cancelling the analysis")
+                return None
+    finally:
+        task.cancel()
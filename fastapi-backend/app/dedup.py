@@ -0,0 +1,146 @@
+import hashlib
+import os
+import re
+
+# Articles whose fingerprints are at least this similar (1 - hamming / 64) are
+# treated as the same story, e.g. the same AP/Reuters copy on different outlets.
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+
+_word_re = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> list[str]:
+    words = _word_re.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return words
+    return [
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    ]
+
+
+def compute_fingerprint(text: str) -> str:
+    """
+    Compute a 64-bit SimHash fingerprint of the article text.
+    Near-identical texts (syndicated wire copy with a different byline or
+    footer) end up only a few bits apart.
+    Args:
+        text (str): The article text.
+    Returns:
+        str: The fingerprint as a 16 character hex string, or "" for empty text.
+    """
+    counts: dict[str, int] = {}
+    for shingle in _shingles(text or ""):
+        counts[shingle] = counts.get(shingle, 0) + 1
+
+    if not counts:
+        return ""
+
+    weights = [0] * FINGERPRINT_BITS
+    for shingle, count in counts.items():
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(FINGERPRINT_BITS):
+            if value >> bit & 1:
+                weights[bit] += count
+            else:
+                weights[bit] -= count
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+
+    return f"{fingerprint:016x}"
+
+
+def fingerprint_similarity(a: str, b: str) -> float:
+    """
+    Similarity between two fingerprints, from 0 (opposite) to 1 (identical).
+    """
+    if not a or not b:
+        return 0.0
+    distance = (int(a, 16) ^ int(b, 16)).bit_count()
+    return 1 - distance / FINGERPRINT_BITS
+
+
+class NearDuplicateIndex:
+    """
+    LSH index over SimHash fingerprints.
+
+    The 64 bits are split into (max_distance + 1) bands. Two fingerprints that
+    differ in at most max_distance bits must agree exactly on at least one band,
+    so looking up every band of a query finds all candidates within the
+    threshold without scanning the whole corpus.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.max_distance = int((1 - threshold) * FINGERPRINT_BITS)
+        n_bands = min(max(self.max_distance + 1, 1), FINGERPRINT_BITS)
+
+        # split the bits into n_bands nearly equal (start, width) chunks
+        self.bands = []
+        start = 0
+        for i in range(n_bands):
+            width = FINGERPRINT_BITS // n_bands + (
+                1 if i < FINGERPRINT_BITS % n_bands else 0
+            )
+            self.bands.append((start, width))
+            start += width
+
+        self.buckets: list[dict[int, set[str]]] = [{} for _ in self.bands]
+        self.fingerprints: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def _band_keys(self, fingerprint: str) -> list[int]:
+        value = int(fingerprint, 16)
+        return [value >> start & ((1 << width) - 1) for start, width in self.bands]
+
+    def add(self, key: str, fingerprint: str) -> None:
+        if not key or not fingerprint:
+            return
+        if key in self.fingerprints:
+            self.remove(key)
+
+        self.fingerprints[key] = fingerprint
+        for buckets, band_key in zip(self.buckets, self._band_keys(fingerprint)):
+            buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for buckets, band_key in zip(self.buckets, self._band_keys(fingerprint)):
+            bucket = buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del buckets[band_key]
+
+    def query(self, fingerprint: str) -> list[tuple[str, float]]:
+        """
+        Find indexed keys whose fingerprint is within the threshold.
+        Returns:
+            list[tuple[str, float]]: (key, similarity) pairs, most similar first.
+        """
+        if not fingerprint:
+            return []
+
+        candidates = set()
+        for buckets, band_key in zip(self.buckets, self._band_keys(fingerprint)):
+            candidates.update(buckets.get(band_key, ()))
+
+        matches = []
+        for key in candidates:
+            similarity = fingerprint_similarity(fingerprint, self.fingerprints[key])
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
@@ -0,0 +1,252 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+from app.db import iter_article_pages
+from app.text_store import load_text
+from app.utils import parse_timestamp
+
+# Columnar export of the analyzed articles for analytics. Two tables:
+#   articles: one row per article, the analysis results without the text
+#   fallacies: one row per logical fallacy found, keyed by article_id
+# An incremental export only has the articles (re)analyzed since the last one,
+# so readers should keep the row with the latest last_analyzed_at per id.
+ARTICLE_COLUMNS = (
+    "id, url, title, source_url, published_date, last_analyzed_at, created_at, "
+    "read_count, lean, tag, topics, keywords, summary, logical_fallacies"
+)
+EXPORT_PAGE_SIZE = 500
+STATE_FILE = "export-state.json"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Exports need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def article_schema(with_text: bool = False):
+    pa = _pyarrow()
+    timestamp = pa.timestamp("us", tz="UTC")
+    fields = [
+        ("id", pa.string()),
+        ("url", pa.string()),
+        ("title", pa.string()),
+        ("source_url", pa.string()),
+        ("published_date", timestamp),
+        ("last_analyzed_at", timestamp),
+        ("created_at", timestamp),
+        ("read_count", pa.int64()),
+        ("lean", pa.string()),
+        ("tag", pa.string()),
+        ("topics", pa.list_(pa.string())),
+        ("keywords", pa.list_(pa.string())),
+        ("summary", pa.string()),
+        ("fallacy_count", pa.int32()),
+    ]
+    if with_text:
+        fields.append(("text", pa.string()))
+    return pa.schema(fields)
+
+
+def fallacy_schema():
+    pa = _pyarrow()
+    return pa.schema(
+        [
+            ("article_id", pa.string()),
+            ("last_analyzed_at", pa.timestamp("us", tz="UTC")),
+            ("fallacy_type", pa.string()),
+            ("quote", pa.string()),
+            ("reason", pa.string()),
+            ("explanation", pa.string()),
+            ("rating", pa.int32()),
+        ]
+    )
+
+
+def _timestamp(value) -> datetime | None:
+    try:
+        return parse_timestamp(value) if value else None
+    except ValueError:
+        return None
+
+
+def _lean(value) -> str | None:
+    # rows from before lean was a plain label store the classifier output
+    if isinstance(value, dict):
+        return value.get("predicted_lean") or value.get("predicted_bias")
+    return value
+
+
+def flatten_fallacies(row: dict) -> list[dict]:
+    """
+    One record per fallacy in the row's logical_fallacies
+    ({type: {"logical_fallacies": [...], "error": ...}}).
+    """
+    records = []
+    for fallacy_type, found in (row.get("logical_fallacies") or {}).items():
+        if not isinstance(found, dict):
+            continue
+        for fallacy in found.get("logical_fallacies") or []:
+            try:
+                rating = int(fallacy.get("rating"))
+            except (TypeError, ValueError):
+                rating = None
+            records.append(
+                {
+                    "article_id": row["id"],
+                    "last_analyzed_at": _timestamp(row.get("last_analyzed_at")),
+                    "fallacy_type": fallacy_type,
+                    "quote": fallacy.get("quote"),
+                    "reason": fallacy.get("reason"),
+                    "explanation": fallacy.get("explanation"),
+                    "rating": rating,
+                }
+            )
+    return records
+
+
+def article_record(row: dict, fallacy_count: int, with_text: bool) -> dict:
+    record = {
+        "id": row["id"],
+        "url": row.get("url"),
+        "title": row.get("title"),
+        "source_url": row.get("source_url"),
+        "published_date": _timestamp(row.get("published_date")),
+        "last_analyzed_at": _timestamp(row.get("last_analyzed_at")),
+        "created_at": _timestamp(row.get("created_at")),
+        "read_count": row.get("read_count"),
+        "lean": _lean(row.get("lean")),
+        "tag": row.get("tag"),
+        "topics": row.get("topics") or [],
+        "keywords": row.get("keywords") or [],
+        "summary": row.get("summary"),
+        "fallacy_count": fallacy_count,
+    }
+    if with_text:
+        # rows stored before the text store still have it in the text column
+        text = row.get("text")
+        if not text and row.get("text_hash"):
+            text = load_text(row["text_hash"])
+        record["text"] = text
+    return record
+
+
+class _TableWriter:
+    """
+    Appends record batches to one Parquet (a row group per batch) or Arrow
+    IPC file, so that only one page is ever in memory.
+    """
+
+    def __init__(self, path: str, schema, format: str):
+        pa = _pyarrow()
+        self.schema = schema
+        self.rows = 0
+        if format == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            self.writer = pa.ipc.new_file(path, schema)
+
+    def write(self, records: list[dict]) -> None:
+        if not records:
+            return
+        batch = _pyarrow().RecordBatch.from_pylist(records, schema=self.schema)
+        self.writer.write_batch(batch)
+        self.rows += len(records)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def load_state(out_dir: str) -> dict:
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def export_articles(
+    out_dir: str,
+    format: str = "parquet",
+    since: str | None = None,
+    incremental: bool = False,
+    with_text: bool = False,
+    page_size: int = EXPORT_PAGE_SIZE,
+) -> dict:
+    """
+    Export the articles table to out_dir as articles-<time>-<id> and
+    fallacies-<time>-<id> files, reading it one page at a time. Nothing is
+    written when no article matches.
+    Args:
+        format (str): "parquet" or "arrow" (Arrow IPC file).
+        since (str): Only articles analyzed after this ISO timestamp.
+        incremental (bool): Only articles analyzed after the latest one of
+            the previous incremental export to out_dir (or since).
+        with_text (bool): Include the article text.
+    Returns:
+        dict: The files written, row counts and the since/until timestamps.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format}")
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    if incremental and not since:
+        since = state.get("last_analyzed_at")
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    # the suffix keeps two exports started in the same second apart
+    suffix = f"{stamp}-{uuid.uuid4().hex[:8]}{FORMATS[format]}"
+    paths = {
+        table: os.path.join(out_dir, f"{table}-{suffix}")
+        for table in ("articles", "fallacies")
+    }
+    # opened with the first page, so that an empty export leaves no files
+    articles = fallacies = None
+
+    columns = ARTICLE_COLUMNS + (", text, text_hash" if with_text else "")
+    latest = since
+    try:
+        for page in iter_article_pages(columns, page_size, analyzed_after=since):
+            if articles is None:
+                articles = _TableWriter(
+                    paths["articles"], article_schema(with_text), format
+                )
+                fallacies = _TableWriter(paths["fallacies"], fallacy_schema(), format)
+            article_records, fallacy_records = [], []
+            for row in page:
+                found = flatten_fallacies(row)
+                fallacy_records += found
+                article_records.append(article_record(row, len(found), with_text))
+                analyzed = row.get("last_analyzed_at")
+                if analyzed and (
+                    not latest or _timestamp(analyzed) > _timestamp(latest)
+                ):
+                    latest = analyzed
+            articles.write(article_records)
+            fallacies.write(fallacy_records)
+            print(f"Exported {articles.rows} articles, {fallacies.rows} fallacies")
+    finally:
+        if articles is not None:
+            articles.close()
+            fallacies.close()
+
+    if incremental:
+        with open(os.path.join(out_dir, STATE_FILE), "w") as f:
+            json.dump({"last_analyzed_at": latest, "exported_at": stamp}, f)
+
+    if articles is None:
+        print("No articles to export")
+    return {
+        "files": paths if articles else {},
+        "articles": articles.rows if articles else 0,
+        "fallacies": fallacies.rows if fallacies else 0,
+        "since": since,
+        "until": latest,
+    }
@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from app.text_store import compress, decompress
+from app.tracing import current_span, traced
+
+# Article pages fetched before, with their ETag/Last-Modified, in one SQLite
+# file. A re-fetch sends them back (If-None-Match/If-Modified-Since) and on a
+# 304 the cached page is used instead of downloading it again. Pages without
+# either validator aren't kept. The least recently used pages are evicted
+# beyond FETCH_CACHE_MAX_MB. An empty FETCH_CACHE_PATH disables the cache.
+FETCH_CACHE_PATH = os.environ.get("FETCH_CACHE_PATH", "fetch-cache.db")
+FETCH_CACHE_MAX_MB = float(os.environ.get("FETCH_CACHE_MAX_MB", "256"))
+BINARY_CONTENT_TYPES = ("application", "image", "video", "audio", "font")
+VALIDATORS = {"If-None-Match", "If-Modified-Since"}
+
+
+@dataclass
+class FetchResult:
+    url: str
+    html: str
+    # the publisher answered 304: the page is the one fetched before
+    not_modified: bool = False
+
+
+class FetchCache:
+    def __init__(
+        self,
+        path: str = FETCH_CACHE_PATH,
+        max_bytes: int = int(FETCH_CACHE_MAX_MB * 2**20),
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        # fetches run in worker threads (asyncio.to_thread)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "create table if not exists responses (url text primary key, "
+                "etag text, last_modified text, codec text, body blob, "
+                "size integer, used_at real)"
+            )
+            self.connection.execute(
+                "create index if not exists responses_used_at on responses (used_at)"
+            )
+            self.size = self.connection.execute(
+                "select coalesce(sum(size), 0) from responses"
+            ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def validators(self, url: str) -> dict:
+        """
+        The conditional request headers for the cached page of url, if any.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "select etag, last_modified from responses where url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def get(self, url: str) -> str | None:
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "select codec, body from responses where url = ?", (url,)
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "update responses set used_at = ? where url = ?",
+                    (time.time(), url),
+                )
+        return decompress(row[0], row[1]) if row else None
+
+    def put(self, url: str, html: str, etag: str | None, last_modified: str | None):
+        if not etag and not last_modified:
+            return
+        codec, body = compress(html)
+        with self.lock, self.connection:
+            previous = self.connection.execute(
+                "select size from responses where url = ?", (url,)
+            ).fetchone()
+            self.connection.execute(
+                "insert or replace into responses values (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, codec, body, len(body), time.time()),
+            )
+            self.size += len(body) - (previous[0] if previous else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        # least recently used first, until the cache fits
+        while self.size > self.max_bytes:
+            rows = self.connection.execute(
+                "select url, size from responses order by used_at limit 100"
+            ).fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self.connection.execute("delete from responses where url = ?", (url,))
+                self.size -= size
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute(
+                "select count(*) from responses"
+            ).fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "not_modified": self.hits,
+            "downloaded": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+_fetch_cache: FetchCache | None = None
+
+
+def get_fetch_cache() -> FetchCache | None:
+    """
+    The FETCH_CACHE_PATH cache, opened on first use (None if disabled).
+    """
+    global _fetch_cache
+    if _fetch_cache is None and FETCH_CACHE_PATH:
+        _fetch_cache = FetchCache()
+    return _fetch_cache
+
+
+@traced()
+def fetch_html(
+    url: str, cache: FetchCache | None = None, conditional: bool = True
+) -> FetchResult:
+    """
+    Download an article page the way newspaper's Article.download would,
+    conditionally if the cache has it (and conditional is set).
+    Raises:
+        ArticleException: If the page can't be downloaded.
+    """
+    import requests
+    from newspaper import network, parsers
+    from newspaper.configuration import Configuration
+    from newspaper.exceptions import ArticleException
+
+    cache = cache or get_fetch_cache()
+    config = Configuration()
+    params = dict(config.requests_params)
+    headers = dict(params.pop("headers", {}))
+    if cache and conditional:
+        headers.update(cache.validators(url))
+    span = current_span()
+    span.set_attribute("url.full", url)
+    span.set_attribute("fetch_cache.conditional", bool(headers.keys() & VALIDATORS))
+    try:
+        response = network.session.get(url, headers=headers, **params)
+    except requests.exceptions.RequestException as e:
+        raise ArticleException(str(e))
+    span.set_attribute("http.response.status_code", response.status_code)
+
+    if response.status_code == 304 and cache:
+        html = cache.get(url)
+        if html is not None:
+            cache.hits += 1
+            span.set_attribute("fetch_cache.hit", True)
+            return FetchResult(url, html, not_modified=True)
+        # evicted since the validators were read
+        return fetch_html(url, cache, conditional=False)
+
+    # newspaper's is_binary_url costs a HEAD and a ranged GET per page; the
+    # Content-Type of the response tells as much
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(BINARY_CONTENT_TYPES) and not any(
+        text_type in content_type for text_type in ("json", "xml")
+    ):
+        raise ArticleException(f"Article is binary data ({content_type}): {url}")
+
+    html, status_code, _ = network.get_html_status(url, config, response=response)
+    if isinstance(html, bytes):
+        html = parsers.get_unicode_html(html)
+    if status_code >= 400 or status_code == 304:
+        raise ArticleException(f"Status code {status_code} for url {url}")
+    if cache:
+        cache.misses += 1
+        cache.put(
+            url,
+            html,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+    return FetchResult(url, html)
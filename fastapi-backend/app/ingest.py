@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import IO
+
+from app.db import add_article_aliases, add_articles_to_db, update_articles
+from app.deadlines import Deadline
+from app.newsly_types import NewslyArticle
+from app.server import index_article, process_article_db
+from app.utils import normalize_url
+
+INGEST_CONCURRENCY = int(os.environ.get("INGEST_CONCURRENCY", "8"))
+# articles buffered before they are written to the database in one request
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "25"))
+# buffered articles are written at least this often, so that a slow run
+# still checkpoints its progress
+INGEST_FLUSH_SECONDS = 30
+INGEST_STATS_SECONDS = 10
+
+
+class BatchWriter:
+    """
+    Buffers the articles process_article_db would store and writes them in
+    batches. The outcome of every URL is appended to the state file only once
+    its article is in the database, so an interrupted run redoes at most the
+    unwritten batch.
+    """
+
+    def __init__(self, state_file: str | None, batch_size: int = INGEST_BATCH_SIZE):
+        self.state_file = state_file
+        self.batch_size = batch_size
+        # (submitted URL, article, aliases); outcomes are keyed by the
+        # submitted URL, which the article's canonical URL may differ from
+        self.inserts: list[tuple[str, NewslyArticle, list[str]]] = []
+        self.updates: list[tuple[str, NewslyArticle]] = []
+        self.outcomes: list[dict] = []
+        self.inserted = 0
+        self.updated = 0
+        self.write_errors = 0
+
+    def insert(self, url: str, article: NewslyArticle, aliases: list[str] = ()) -> None:
+        self.inserts.append((url, article, list(aliases)))
+
+    def update(self, url: str, article: NewslyArticle) -> None:
+        self.updates.append((url, article))
+
+    def done(self, url: str, error: str = "") -> None:
+        outcome = {"url": url, "status": "failed" if error else "ok"}
+        if error:
+            outcome["error"] = error
+        self.outcomes.append(outcome)
+        if len(self.inserts) + len(self.updates) >= self.batch_size:
+            self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self.inserts) + len(self.updates)
+
+    def flush(self) -> None:
+        inserts, self.inserts = self.inserts, []
+        updates, self.updates = self.updates, []
+        outcomes, self.outcomes = self.outcomes, []
+
+        failed = {}
+        if inserts:
+            failed.update(self._write_inserts(self._by_canonical_url(inserts)))
+        if updates:
+            failed.update(self._write_updates(updates))
+        self._checkpoint(outcomes, failed)
+
+    @staticmethod
+    def _by_canonical_url(inserts) -> list[tuple[list[str], NewslyArticle, list[str]]]:
+        """
+        One (submitted URLs, article, aliases) per canonical URL: submitted
+        URLs sharing one would otherwise insert it twice and fail the batch.
+        """
+        groups = {}
+        for url, article, aliases in inserts:
+            if article.url not in groups:
+                groups[article.url] = ([], article, [])
+            urls, _, group_aliases = groups[article.url]
+            urls.append(url)
+            group_aliases += [alias for alias in aliases if alias not in group_aliases]
+        return list(groups.values())
+
+    def _write_inserts(self, inserts) -> dict[str, str]:
+        articles = [article for _, article, _ in inserts]
+        try:
+            stored = add_articles_to_db(articles)
+        except Exception as e:
+            # one bad row fails the whole batch; retry one by one to find it
+            print(f"Batch insert of {len(articles)} articles failed: {e}")
+            return self._one_by_one(inserts, lambda item: self._write_inserts([item]))
+
+        stored_by_url = {article.url: article for article in stored}
+        for _, article, aliases in inserts:
+            stored_article = stored_by_url.get(article.url)
+            if not stored_article:
+                continue
+            index_article(stored_article)
+            add_article_aliases(
+                stored_article.id, [url for url in aliases if url != article.url]
+            )
+        self.inserted += len(stored)
+        return {}
+
+    def _write_updates(self, updates) -> dict[str, str]:
+        try:
+            stored = update_articles([article for _, article in updates])
+        except Exception as e:
+            print(f"Batch update of {len(updates)} articles failed: {e}")
+            return self._one_by_one(updates, lambda item: self._write_updates([item]))
+
+        for article in stored:
+            index_article(article)
+        self.updated += len(stored)
+        return {}
+
+    def _one_by_one(self, items, write) -> dict[str, str]:
+        if len(items) == 1:
+            self.write_errors += 1
+            urls = items[0][0]
+            # the submitted URLs of an insert, or of an update
+            urls = [urls] if isinstance(urls, str) else urls
+            return {url: "database write failed" for url in urls}
+        failed = {}
+        for item in items:
+            failed.update(write(item))
+        return failed
+
+    def _checkpoint(self, outcomes: list[dict], failed: dict[str, str]) -> None:
+        if not self.state_file or not outcomes:
+            return
+        with open(self.state_file, "a") as f:
+            for outcome in outcomes:
+                if outcome["url"] in failed:
+                    outcome = {
+                        **outcome,
+                        "status": "failed",
+                        "error": failed[outcome["url"]],
+                    }
+                f.write(json.dumps(outcome) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_state(state_file: str | None) -> dict[str, dict]:
+    """
+    The last recorded outcome of every URL in the state file.
+    """
+    if not state_file or not os.path.exists(state_file):
+        return {}
+    state = {}
+    with open(state_file) as f:
+        for line in f:
+            try:
+                outcome = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of a run killed mid-write
+                continue
+            state[outcome["url"]] = outcome
+    return state
+
+
+@dataclass
+class IngestStats:
+    started: float = field(default_factory=time.monotonic)
+    ok: int = 0
+    failed: int = 0
+    skipped: int = 0
+    in_flight: int = 0
+    errors: dict[str, int] = field(default_factory=dict)
+
+    def line(self, writer: BatchWriter) -> str:
+        elapsed = time.monotonic() - self.started
+        done = self.ok + self.failed
+        return (
+            f"[{elapsed:7.0f}s] {done} done ({self.ok} ok, {self.failed} failed), "
+            f"{self.skipped} skipped, {60 * done / max(elapsed, 1e-9):.1f}/min, "
+            f"{self.in_flight} in flight, {writer.inserted} inserted, "
+            f"{writer.updated} updated, {writer.pending} unwritten"
+        )
+
+
+def _error_message(e: Exception) -> str:
+    # HTTPException keeps its message in detail
+    return str(getattr(e, "detail", None) or e) or type(e).__name__
+
+
+async def ingest(
+    lines: IO[str],
+    state_file: str | None = None,
+    concurrency: int = INGEST_CONCURRENCY,
+    batch_size: int = INGEST_BATCH_SIZE,
+    retry_failed: bool = True,
+    deadline_seconds: float | None = None,
+    stats_interval: float = INGEST_STATS_SECONDS,
+    stats_out: IO[str] = sys.stderr,
+) -> IngestStats:
+    """
+    Analyze and store the articles at the URLs read from lines (one per line,
+    blank lines and #comments ignored), concurrency at a time.
+    Args:
+        lines (IO[str]): The URL stream, e.g. a file or stdin.
+        state_file (str): Where progress is checkpointed; URLs that finished
+            in an earlier run with the same state file are skipped.
+        retry_failed (bool): Whether URLs that failed earlier are tried again.
+        deadline_seconds (float): Per-article deadline (default REQUEST_DEADLINE).
+    Returns:
+        IngestStats: The counts of this run.
+    """
+    state = load_state(state_file)
+    finished = {
+        url
+        for url, outcome in state.items()
+        if outcome["status"] == "ok" or not retry_failed
+    }
+    writer = BatchWriter(state_file, batch_size)
+    stats = IngestStats()
+    # the URLs as read, to be fetched as given; outcomes are keyed by the
+    # normalized URL
+    queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=2 * concurrency)
+
+    async def read_urls() -> None:
+        seen = set()
+        while True:
+            # stdin may block for a long time; don't hold up the workers
+            line = await asyncio.to_thread(lines.readline)
+            if not line:
+                break
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            url = normalize_url(line)
+            if url in finished or url in seen:
+                stats.skipped += 1
+                continue
+            seen.add(url)
+            await queue.put(line)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work() -> None:
+        while (line := await queue.get()) is not None:
+            url = normalize_url(line)
+            stats.in_flight += 1
+            try:
+                deadline = Deadline(deadline_seconds) if deadline_seconds else None
+                await process_article_db(
+                    line, deadline=deadline, writer=writer, priority="backfill"
+                )
+            except Exception as e:
+                error = _error_message(e)
+                stats.failed += 1
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+                writer.done(url, error)
+            else:
+                stats.ok += 1
+                writer.done(url)
+            finally:
+                stats.in_flight -= 1
+
+    async def report() -> None:
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(stats_interval)
+            if time.monotonic() - last_flush >= INGEST_FLUSH_SECONDS:
+                writer.flush()
+                last_flush = time.monotonic()
+            print(stats.line(writer), file=stats_out, flush=True)
+
+    reporter = asyncio.ensure_future(report())
+    tasks = [asyncio.ensure_future(read_urls())]
+    tasks += [asyncio.ensure_future(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+        # keep what finished before an interrupt; the rest is redone on resume
+        writer.flush()
+        print(stats.line(writer), file=stats_out, flush=True)
+
+    return stats
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+from collections import deque
+from app.tracing import span
+
+# Concurrency limits for outbound model calls, per backend and model. Each
+# limit adapts AIMD-style: it grows by about one per round of successful
+# calls while the limiter is saturated, and shrinks multiplicatively when the
+# provider pushes back (429s) or latency climbs well above the recent median,
+# the sign of queueing or a container storm.
+LIMITS = {
+    # backend: (initial, maximum)
+    "modal": (
+        int(os.environ.get("MODAL_CONCURRENCY", "16")),
+        int(os.environ.get("MODAL_MAX_CONCURRENCY", "64")),
+    ),
+    "together": (
+        int(os.environ.get("TOGETHER_CONCURRENCY", "8")),
+        int(os.environ.get("TOGETHER_MAX_CONCURRENCY", "32")),
+    ),
+    # backends.FakeBackend, for load tests
+    "fake": (16, 256),
+}
+MIN_LIMIT = 1
+# latency above this multiple of the recent median counts as overload
+LATENCY_TOLERANCE = float(os.environ.get("LIMITER_LATENCY_TOLERANCE", "3"))
+RATE_LIMITED_BACKOFF = 0.5
+SLOW_BACKOFF = 0.9
+WINDOW = 100
+
+
+class Slot:
+    """
+    One acquired unit of concurrency. Call overloaded() if the provider
+    rejected the call as rate limited.
+    """
+
+    def __init__(self, limiter: "AdaptiveLimiter"):
+        self.limiter = limiter
+        self.started_at = time.monotonic()
+        self.rate_limited = False
+
+    def overloaded(self) -> None:
+        self.rate_limited = True
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int, maximum: int):
+        self.name = name
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.latencies: deque[float] = deque(maxlen=WINDOW)
+        self.waits: deque[float] = deque(maxlen=WINDOW)
+        self.last_decrease = 0.0
+        self.calls = 0
+        self.rate_limited = 0
+        self.slow = 0
+
+    async def acquire(self) -> float:
+        """
+        Wait for a free slot. Returns the seconds spent waiting.
+        """
+        start = time.monotonic()
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                # release() hands the slot over by resolving the future
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_slot()
+                else:
+                    self.waiters.remove(waiter)
+                raise
+        waited = time.monotonic() - start
+        self.waits.append(waited)
+        return waited
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, slot: Slot, ok: bool) -> None:
+        """
+        Free the slot and adapt the limit to how the call went.
+        """
+        latency = time.monotonic() - slot.started_at
+        saturated = self.in_flight >= int(self.limit)
+        self.calls += 1
+
+        if slot.rate_limited:
+            self.rate_limited += 1
+            self._decrease(slot, RATE_LIMITED_BACKOFF)
+        elif ok:
+            if self.latencies and latency > LATENCY_TOLERANCE * self.median_latency():
+                self.slow += 1
+                self._decrease(slot, SLOW_BACKOFF)
+            elif saturated:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.latencies.append(latency)
+
+        self._release_slot()
+
+    def median_latency(self) -> float:
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def _decrease(self, slot: Slot, factor: float) -> None:
+        # calls already in flight at the last decrease saw the old limit, so
+        # they must not shrink it again
+        if slot.started_at < self.last_decrease:
+            return
+        self.limit = max(MIN_LIMIT, self.limit * factor)
+        self.last_decrease = time.monotonic()
+
+    def slot(self) -> "_SlotContext":
+        """
+        async with limiter.slot() as slot: ...
+        """
+        return _SlotContext(self)
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.waiters),
+            "mean_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_seconds": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "slow": self.slow,
+        }
+
+
+class _SlotContext:
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.slot = None
+
+    async def __aenter__(self) -> Slot:
+        await self.limiter.acquire()
+        # the latency clock starts once the slot is held
+        self.slot = Slot(self.limiter)
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        ok = exc_type is None
+        if isinstance(exc, asyncio.TimeoutError):
+            self.slot.overloaded()
+        self.limiter.release(self.slot, ok)
+        return False
+
+
+limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(backend: str, model: str) -> AdaptiveLimiter:
+    """
+    The limiter for one model (a Together model or a Modal function) on a backend.
+    """
+    name = f"{backend}:{model}"
+    if name not in limiters:
+        initial, maximum = LIMITS[backend]
+        limiters[name] = AdaptiveLimiter(name, initial, maximum)
+    return limiters[name]
+
+
+async def call_modal(name: str, function, *args, **kwargs):
+    """
+    Call a Modal function (or Cls method) through its limiter.
+    Args:
+        name (str): The function name, or Class.method for a Cls method (each
+            method has its own limiter), used as the model of the limiter.
+        function: The modal.Function or method, called with .remote.aio.
+    """
+    with span(f"modal.{name}", **{"rpc.system": "modal", "rpc.method": name}) as s:
+        async with get_limiter("modal", name).slot():
+            s.add_event("slot acquired")
+            return await function.remote.aio(*args, **kwargs)
+
+
+def limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in sorted(limiters.items())}
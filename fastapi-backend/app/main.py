@@ -1,7 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+import dataclasses
+import os
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
 from app.newsly_types import ArticleAnalysisRequest
-from app.server import process_article_db
+from app.db import INTERNAL_COLUMNS
+from app.server import process_article_db, get_related_articles
 from app.ml_newsly import get_logical_fallacies
+from app.deadlines import cancel_on_disconnect
+from app.routing import router
+from app.limiter import limiter_stats
+from app.crawler import crawler
+from app.scheduler import scheduler
+from app.fetch_cache import get_fetch_cache
+from app.profiling import PROFILE_DIR, PROFILE_HEADER, Profiler, profile_token_ok
 import app.utils as utils
 import uvicorn
 import argparse
@@ -15,14 +27,103 @@ load_dotenv()
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def start_crawler():
+    # pre-analyze fresh articles from CRAWLER_FEEDS, if any are configured
+    if crawler.feeds:
+        app.state.crawler_task = asyncio.ensure_future(crawler.run())
+
+
 @app.get("/")
 def read_root():
     return {"hello": "world"}
 
 
 @app.post("/articles/analyze")
-async def analyze_article(article_analysis_request: ArticleAnalysisRequest):
-    return await process_article_db(article_analysis_request.url)
+async def analyze_article(
+    article_analysis_request: ArticleAnalysisRequest,
+    request: Request,
+    response: Response,
+    profile: str | None = None,
+):
+    # ?profile=<PROFILE_TOKEN> or the X-Profile header saves a profile of the
+    # analysis (see app/profiling.py)
+    profile = profile or request.headers.get(PROFILE_HEADER)
+    if profile is not None and not profile_token_ok(profile):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+    # no point finishing the analysis if nobody is waiting for it
+    analysis = cancel_on_disconnect(
+        request, process_article_db(article_analysis_request.url)
+    )
+    if profile is None:
+        article = await analysis
+    else:
+        with Profiler(article_analysis_request.url) as profiler:
+            article = await analysis
+        response.headers["X-Profile-Url"] = f"/profiles/{profiler.file_name}"
+    if not article:
+        return article
+    # the client shows the analysis, not the body, which is most of the bytes,
+    # nor the embedding and the other internals
+    article = dataclasses.replace(article, text="")
+    return {
+        name: value
+        for name, value in dataclasses.asdict(article).items()
+        if name not in INTERNAL_COLUMNS
+    }
+
+
+@app.get("/articles/{article_id}/related")
+async def related_articles(article_id: str, k: int = Query(5, ge=1, le=50)):
+    related = get_related_articles(article_id, k)
+    if related is None:
+        raise HTTPException(
+            status_code=404, detail="Article not found or not yet analyzed"
+        )
+    return related
+
+
+@app.get("/backends")
+def backends():
+    # circuit state, latency and error rate of the Modal and Together backends
+    return router.status()
+
+
+@app.get("/limits")
+def limits():
+    # concurrency limit, queue depth and wait times per backend and model
+    return limiter_stats()
+
+
+@app.get("/scheduler")
+def scheduler_stats():
+    # in-flight and queued analyses and queue wait times per priority class
+    return scheduler.stats()
+
+
+@app.get("/fetch-cache")
+def fetch_cache_stats():
+    # size and 304 hits of the conditional-GET cache of article pages
+    cache = get_fetch_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+
+@app.get("/profiles/{file_name}")
+def profile_file(file_name: str, request: Request, profile: str | None = None):
+    # a saved profile, to open in https://www.speedscope.app
+    if not profile_token_ok(profile or request.headers.get(PROFILE_HEADER) or ""):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+    path = os.path.join(PROFILE_DIR, os.path.basename(file_name))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json")
+
+
+@app.get("/crawler")
+def crawler_status():
+    # feeds, last crawl and totals of the pre-analysis crawler
+    return crawler.status()
 
 
 # for testing, but lets keep pls
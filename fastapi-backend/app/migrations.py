@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from app.db import iter_article_pages, update_article_fields
+
+MIGRATION_PAGE_SIZE = 1000
+MIGRATION_BATCH_SIZE = 200
+MAX_ERRORS = 100
+
+
+@dataclass
+class Migration:
+    """
+    A data migration or backfill over the articles table.
+
+    migrate gets each row (only the projected columns, plus id) and returns
+    the columns to change, or None to leave the row alone. With not_null,
+    only rows where that column is set are scanned. A dry run prints every
+    change unless show_changes is off.
+    """
+
+    name: str
+    columns: str
+    migrate: Callable[[dict], dict | None]
+    not_null: str | None = None
+    show_changes: bool = True
+
+
+@dataclass
+class MigrationProgress:
+    last_id: str | None = None
+    scanned: int = 0
+    changed: int = 0
+    updated: int = 0
+    failed: int = 0
+    # the first MAX_ERRORS failures
+    errors: list[str] = field(default_factory=list)
+
+
+def load_checkpoint(path: str | None, migration: Migration) -> MigrationProgress:
+    if not path or not os.path.exists(path):
+        return MigrationProgress()
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("migration") != migration.name:
+        raise ValueError(
+            f"{path} is the checkpoint of {checkpoint.get('migration')}, "
+            f"not {migration.name}"
+        )
+    return MigrationProgress(**checkpoint["progress"])
+
+
+def save_checkpoint(
+    path: str | None, migration: Migration, progress: MigrationProgress
+) -> None:
+    if not path:
+        return
+    # write then rename, so that an interrupted run never leaves half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump({"migration": migration.name, "progress": vars(progress)}, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_migration(
+    migration: Migration,
+    dry_run: bool = False,
+    checkpoint: str | None = None,
+    page_size: int = MIGRATION_PAGE_SIZE,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    limit: int | None = None,
+) -> MigrationProgress:
+    """
+    Stream the table page by page and write the changes in batches, so memory
+    stays at one page and one batch however big the table is.
+    Args:
+        migration (Migration): What to change.
+        dry_run (bool): Only count and print the changes.
+        checkpoint (str): A file the progress is saved to after every written
+            batch; a run given the same file resumes after the last written row.
+        limit (int): Stop after scanning this many rows.
+    Returns:
+        MigrationProgress: The totals, including those of resumed runs.
+    """
+    progress = load_checkpoint(checkpoint, migration)
+    if progress.last_id:
+        print(f"{migration.name}: resuming after {progress.last_id}")
+
+    start = time.monotonic()
+    pending: dict[str, dict] = {}
+
+    def flush(last_id: str) -> None:
+        if pending and not dry_run:
+            progress.updated += update_article_fields(pending)
+        pending.clear()
+        progress.last_id = last_id
+        if not dry_run:
+            save_checkpoint(checkpoint, migration, progress)
+
+    pages = iter_article_pages(
+        migration.columns, page_size, progress.last_id, migration.not_null
+    )
+    scanned = 0
+    for page in pages:
+        for row in page:
+            try:
+                changes = migration.migrate(row)
+            except Exception as e:
+                progress.failed += 1
+                if len(progress.errors) < MAX_ERRORS:
+                    progress.errors.append(f"{row['id']}: {e}")
+                changes = None
+            if changes:
+                progress.changed += 1
+                pending[row["id"]] = changes
+                if dry_run and migration.show_changes:
+                    print(f"{row['id']}: {changes}")
+            if len(pending) >= batch_size:
+                flush(row["id"])
+        progress.scanned += len(page)
+        scanned += len(page)
+        flush(page[-1]["id"])
+        print(
+            f"{migration.name}: scanned {progress.scanned}, "
+            f"{'would change' if dry_run else 'updated'} "
+            f"{progress.changed if dry_run else progress.updated}, "
+            f"{scanned / max(time.monotonic() - start, 1e-9):.0f} rows/s"
+        )
+        if limit and scanned >= limit:
+            break
+
+    if progress.failed:
+        print(f"{migration.name}: {progress.failed} rows failed to migrate")
+    return progress
@@ -12,9 +12,17 @@ from app.prompts import (
     presenting_other_side,
     scapegoating,
 )
+from app.related import EMBEDDING_MODEL
+from app.tagging import TagClassifier, tag_label_texts
+from app.structured_output import generate_tag, generate_topics
+from app.token_budget import TOKENIZERS, TOKEN_LIMITS
+import hashlib
 import json
 import re
 
+# candidate n-gram embeddings kept per Embedder container
+MAX_CACHED_WORDS = 200_000
+
 # settings for timeout
 IDLE_TIMEOUT = 60  # seconds
 
@@ -27,6 +35,8 @@ image = (
     .pip_install("transformers")
     .pip_install("huggingface_hub[hf_xet]")
     .pip_install("keybert")
+    .pip_install("sentence-transformers")
+    .pip_install("lm-format-enforcer")
     .pip_install("python-dotenv")
 )
 app = modal.App(name="newsly-modal-test")
@@ -221,19 +231,228 @@ async def political_lean_with_explanation(text: str) -> dict:
     }
 
 
-@app.function(
-    gpu="L4",
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """
+    Split text into sentences, returned as (start, end) character offsets.
+    """
+    spans = []
+    start = 0
+    for match in re.finditer(r"(?<=[.!?])\s+|\n+", text):
+        if text[start : match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+
+@app.cls(
     image=image,
     volumes={"/root/.cache/huggingface": hf_cache_vol},
     scaledown_window=IDLE_TIMEOUT,
 )
-async def get_keywords(text: str) -> dict:
-    from keybert import KeyBERT
+class Embedder:
+    """
+    Sentence-embedding stages, all on CPU. The model is loaded once per
+    container, and each article's embeddings (document vector plus sentence
+    vectors) are computed once and kept in a shared modal.Dict keyed by the
+    text's hash, so keywords, tags and related-article search reuse them.
+    """
+
+    @modal.enter()
+    def load(self):
+        from sentence_transformers import SentenceTransformer
+        from keybert import KeyBERT
+
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
+        self.kw_model = KeyBERT(model=self.model)
+        self.artifacts = modal.Dict.from_name(
+            "newsly-article-embeddings", create_if_missing=True
+        )
+        # candidate n-grams repeat across articles, so their embeddings are kept
+        self.word_embeddings = {}
 
-    kw_model = KeyBERT()
-    keywords = kw_model.extract_keywords(text)
-    words = [keyword[0] for keyword in keywords]
-    return words
+    def _encode(self, texts: list[str]):
+        return self.model.encode(texts, normalize_embeddings=True, batch_size=32)
+
+    def _artifacts(self, texts: list[str]) -> list[dict]:
+        keys = [
+            f"{EMBEDDING_MODEL}:{hashlib.sha256(text.encode()).hexdigest()}"
+            for text in texts
+        ]
+        artifacts = [self.artifacts.get(key) for key in keys]
+
+        missing = [i for i, artifact in enumerate(artifacts) if artifact is None]
+        if missing:
+            spans = [split_sentences(texts[i]) for i in missing]
+            sentences = [
+                texts[i][start:end]
+                for i, doc in zip(missing, spans)
+                for start, end in doc
+            ]
+            documents = self._encode([texts[i] for i in missing])
+            sentence_vectors = self._encode(sentences) if sentences else []
+
+            offset = 0
+            for i, doc_spans, document in zip(missing, spans, documents):
+                artifacts[i] = {
+                    "model": EMBEDDING_MODEL,
+                    "document": document.tolist(),
+                    "sentences": [
+                        vector.tolist()
+                        for vector in sentence_vectors[offset : offset + len(doc_spans)]
+                    ],
+                    "sentence_spans": doc_spans,
+                }
+                offset += len(doc_spans)
+                self.artifacts[keys[i]] = artifacts[i]
+
+        return artifacts
+
+    @modal.method()
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a batch of short texts (e.g. tag labels). Not cached.
+        """
+        return self._encode(texts).tolist()
+
+    @modal.method()
+    def embed_article(self, text: str) -> dict:
+        """
+        Get the article's embedding artifact: {"model", "document",
+        "sentences", "sentence_spans"}, computing it only on a cache miss.
+        """
+        return self._artifacts([text])[0]
+
+    def _keywords(self, texts: list[str], top_n: int = 5) -> list[list[str]]:
+        import numpy as np
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        documents = np.array(
+            [artifact["document"] for artifact in self._artifacts(texts)]
+        )
+
+        # KeyBERT fits this same vectorizer on the docs, so its candidate
+        # order matches the word embeddings we pass in
+        vectorizer = CountVectorizer(stop_words="english")
+        words = vectorizer.fit(texts).get_feature_names_out()
+        new_words = [word for word in words if word not in self.word_embeddings]
+        if len(self.word_embeddings) + len(new_words) > MAX_CACHED_WORDS:
+            self.word_embeddings = {}
+            new_words = list(words)
+        if new_words:
+            for word, vector in zip(new_words, self._encode(new_words)):
+                self.word_embeddings[word] = vector
+        word_vectors = np.array([self.word_embeddings[word] for word in words])
+
+        keywords = self.kw_model.extract_keywords(
+            texts,
+            vectorizer=vectorizer,
+            top_n=top_n,
+            doc_embeddings=documents,
+            word_embeddings=word_vectors,
+        )
+        # KeyBERT returns a flat list for a single document
+        if len(texts) == 1:
+            keywords = [keywords]
+        return [[keyword for keyword, _ in doc_keywords] for doc_keywords in keywords]
+
+    @modal.method()
+    def get_keywords(self, text: str) -> list[str]:
+        return self._keywords([text])[0]
+
+    @modal.method()
+    def get_keywords_batch(self, texts: list[str], top_n: int = 5) -> list[list[str]]:
+        """
+        KeyBERT keywords for a batch of articles (e.g. backfills), reusing the
+        cached document vectors and embedding each new candidate n-gram once.
+        """
+        return self._keywords(texts, top_n)
+
+    @modal.method()
+    def classify_tags(self, texts: list[str]) -> list[dict]:
+        """
+        Zero-shot tag classification of a batch of articles: each article's
+        cached document vector is compared against the tag label embeddings.
+        Returns a {"tag", "margin"} dict per text. Callers can send articles
+        with a small margin to get_tag.
+        """
+        classifier = TagClassifier(self._encode(tag_label_texts()))
+        documents = [artifact["document"] for artifact in self._artifacts(texts)]
+        return [
+            {"tag": tag, "margin": margin}
+            for tag, margin in classifier.classify(documents)
+        ]
+
+
+@app.cls(
+    image=image,
+    secrets=[modal.Secret.from_name("huggingface-secret")],
+    volumes={"/root/.cache/huggingface": hf_cache_vol},
+    scaledown_window=IDLE_TIMEOUT,
+)
+class Tokenizers:
+    """
+    Tokenizes each article once with every stage's tokenizer (fast tokenizers,
+    CPU only) so the server can hand each stage a pre-truncated view.
+    """
+
+    @modal.enter()
+    def load(self):
+        from transformers import AutoTokenizer
+        import os
+
+        hf_token = os.environ["HF_TOKEN"]
+        self.tokenizers = {
+            name: AutoTokenizer.from_pretrained(
+                model_name, token=hf_token, cache_dir="/root/.cache/huggingface"
+            )
+            for name, model_name in TOKENIZERS.items()
+        }
+
+        # get_logical_fallacies truncates the whole formatted prompt, so the
+        # article only gets what the longest fallacy prompt leaves over
+        fallacy_prompts = [
+            ad_hominem,
+            discrediting_sources,
+            emotion_fallacy,
+            false_dichotomy_fallacy,
+            fear_mongering_fallacy,
+            good_sources,
+            non_sequitur,
+            presenting_other_side,
+            scapegoating,
+        ]
+        prompt_tokens = max(
+            len(self.tokenizers["mixtral"](prompt.format(text=""))["input_ids"])
+            for prompt in fallacy_prompts
+        )
+        self.limits = {
+            **TOKEN_LIMITS,
+            "mixtral": TOKEN_LIMITS["mixtral"] - prompt_tokens,
+        }
+
+    @modal.method()
+    def token_budget(self, text: str) -> dict:
+        """
+        Per tokenizer: the article's token count, the stage limit, and the
+        character offset where the text has to be cut to fit the limit.
+        """
+        budget = {}
+        for name, tokenizer in self.tokenizers.items():
+            offsets = tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True
+            )["offset_mapping"]
+            limit = self.limits[name]
+            budget[name] = {
+                "tokenizer": TOKENIZERS[name],
+                "tokens": len(offsets),
+                "limit": limit,
+                "char_end": (
+                    offsets[limit - 1][1] if len(offsets) > limit else len(text)
+                ),
+            }
+        return budget
 
 
 @app.function(
@@ -245,7 +464,6 @@ async def get_keywords(text: str) -> dict:
 )
 async def get_tag(text: str) -> str:
     from transformers import pipeline
-    import re
     import os
 
     hf_token = os.environ["HF_TOKEN"]
@@ -258,68 +476,7 @@ async def get_tag(text: str) -> str:
         # load_in_4bit=True,
     )
 
-    prompt = """Given the following text;
-{text}
-
-    extract a single tag from the following list:
-•	Politics & Government
-•	Business & Economy
-•	Health & Science
-•	Technology & Innovation
-•	Social Issues & Inequality
-•	Crime & Law
-•	World Affairs
-•	Environment & Climate
-•	Culture & Entertainment
-•	Sports
-•	Education
-•	Opinion & Editorial
-•	Religion & Ethics
-
-The output should be the tag and nothing else.
-    """
-    tag = "N/A"
-
-    retry = 0
-    while retry < 3:
-
-        result = pipe(
-            prompt.format(text=text),
-            max_new_tokens=10,
-            do_sample=True,
-            temperature=0.3,
-            return_full_text=False,
-            pad_token_id=pipe.tokenizer.eos_token_id,
-        )
-        print(result)
-
-        tag = result[0]["generated_text"].split("\n")[0].strip()
-        tag = re.sub(r"^[^\w\s&]+|[^\w\s&]+$", "", tag)
-
-        valid_tags = [
-            "Politics & Government",
-            "Business & Economy",
-            "Health & Science",
-            "Technology & Innovation",
-            "Social Issues & Inequality",
-            "Crime & Law",
-            "World Affairs",
-            "Environment & Climate",
-            "Culture & Entertainment",
-            "Sports",
-            "Education",
-            "Opinion & Editorial",
-            "Religion & Ethics",
-        ]
-
-        # Find the best match
-        if tag not in valid_tags:
-            retry += 1
-            print(f"Invalid tag: {tag}, retrying...")
-            continue
-
-        break
-
+    tag, _ = generate_tag(pipe, text)
     return tag
 
 
@@ -336,7 +493,6 @@ async def extract_topics_and_contextualize(text: str, n_topics: int = 3) -> dict
     """
     from transformers import pipeline, AutoTokenizer
     import os
-    import re
 
     hf_token = os.environ["HF_TOKEN"]
 
@@ -349,43 +505,9 @@ async def extract_topics_and_contextualize(text: str, n_topics: int = 3) -> dict
         # load_in_4bit=True,
     )
 
-    topic_prompt = f"""Extract the main topics into a list of strings of 1-2 words.
-    It should come from the following text: {text}
-
-    The output should be the list and nothing else.
-    Do not write any code.
-    It should look like this: ["topic1", "topic2", "topic3"]
-    The list should contain MAXIMUM of {n_topics} topics. 
-    The list is: 
-    """
-
-    retry = 0
-    topics = []
-    while retry < 3:
-        result = pipe(
-            topic_prompt,
-            max_new_tokens=50,
-            do_sample=True,
-            return_full_text=False,
-        )
-        print(f"Result: {result}")
-        topics_str = result[0]["generated_text"]
-        topics_match = re.search(r'\[(?:\s*"[^"]*"\s*,?)*\]', topics_str)
-        if not topics_match:
-            retry += 1
-            continue
-
-        try:
-            topics = eval(topics_match.group(0))
-            break
-        except Exception as e:
-            print(f"Error evaluating topics: {e}")
-            retry += 1
-            continue
-
-    if retry == 3:
+    topics, _ = generate_topics(pipe, text, n_topics)
+    if not topics:
         print("Failed to extract topics")
-        topics = []
 
     # --- Step 2: Contextualize Article ---
 
@@ -414,6 +536,52 @@ async def extract_topics_and_contextualize(text: str, n_topics: int = 3) -> dict
     }
 
 
+@app.function(
+    gpu="L40S",
+    image=image,
+    secrets=[modal.Secret.from_name("huggingface-secret")],
+    volumes={"/root/.cache/huggingface": hf_cache_vol},
+    timeout=3600,
+)
+def benchmark_constrained_decoding(texts: list[str], n_topics: int = 3) -> dict:
+    """
+    Run topic and tag generation over the texts with and without constrained
+    decoding and report generations, failures and GPU time for each mode.
+    """
+    from transformers import pipeline
+    import os
+    import time
+
+    pipe = pipeline(
+        "text-generation",
+        model="meta-llama/Llama-3.1-8B-Instruct",
+        token=os.environ["HF_TOKEN"],
+    )
+
+    stats = {}
+    for mode, constrained in [("unconstrained", False), ("constrained", True)]:
+        mode_stats = {}
+        for stage, generate in [
+            ("topics", lambda text: generate_topics(pipe, text, n_topics, constrained)),
+            ("tag", lambda text: generate_tag(pipe, text, constrained)),
+        ]:
+            generations = 0
+            failures = 0
+            start = time.time()
+            for text in texts:
+                output, attempts = generate(text)
+                generations += attempts
+                failures += output in ([], "N/A")
+            mode_stats[stage] = {
+                "generations": generations,
+                "failures": failures,
+                "seconds": time.time() - start,
+            }
+        stats[mode] = mode_stats
+
+    return stats
+
+
 @app.function(
     gpu="A100-80GB",
     image=image,
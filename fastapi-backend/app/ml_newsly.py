@@ -5,39 +5,47 @@ from app.newsly_types import (
     LogicalFallacyListAPI,
     LogicalFallacyComplete,
     CombinedAnalysisAPI,
+    TopicsAPI,
 )
 from app.clients import generate_together
+from app.routing import BackendError
+from app.db import get_stored_topic_background, save_topic_background
 from app.utils import extract_json
 import app.prompts as prompts
 
 import app.utils as utils
 import asyncio
+import importlib.util
+import os
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 
 
 class ArticleAnalysisRequest(BaseModel):
     url: str
 
 
-try:
-    import torch
+_device = None
 
-    if torch.cuda.is_available():
-        from transformers import (
-            AutoTokenizer,
-            AutoModelForSequenceClassification,
-            pipeline,
-        )
 
-        device = torch.device("cuda")
-        print("Using GPU")
-    else:
-        device = torch.device("cpu")
-        print("GPU not available, using CPU")
-except ImportError:
-    # Fallback if torch is not installed
-    device = "cpu"
-    print("PyTorch not installed, using CPU")
+def get_device() -> str:
+    """
+    "cuda" if torch is installed and sees a GPU, otherwise "cpu". torch is
+    imported on the first call rather than with this module.
+    """
+    global _device
+    if _device is None:
+        try:
+            import torch
+        except ImportError:
+            # Fallback if torch is not installed
+            print("PyTorch not installed, using CPU")
+            _device = "cpu"
+        else:
+            _device = "cuda" if torch.cuda.is_available() else "cpu"
+            print("Using GPU" if _device == "cuda" else "GPU not available, using CPU")
+    return _device
 
 
 async def lean_explanation(
@@ -67,7 +75,7 @@ async def lean_explanation(
             return output[idx + len(marker) :].strip()
         return output.strip()
 
-    if device == "cuda":
+    if get_device() == "cuda":
         from transformers import pipeline, AutoTokenizer
 
         model_name = "microsoft/phi-3-mini-128k-instruct"
@@ -101,7 +109,7 @@ async def lean_explanation(
             },
             {"role": "user", "content": prompt},
         ]
-        result = generate_together(
+        result = await generate_together(
             model="microsoft/phi-3-mini-128k-instruct",
             messages=messages,
             max_tokens=512,
@@ -109,6 +117,9 @@ async def lean_explanation(
             top_p=0.9,
             repetition_penalty=1.2,
         )
+        if result is None:
+            # raising lets the router count the failure and fail over
+            raise BackendError("No response from Together")
         explanation = extract_explanation(result)
         return explanation
 
@@ -126,7 +137,10 @@ async def political_lean(text: str) -> dict:
             "predicted_lean": "test_center",
         }
 
-    if device == "cuda":
+    if get_device() == "cuda":
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
         tokenizer = AutoTokenizer.from_pretrained("bucketresearch/politicalBiasBERT")
         model = AutoModelForSequenceClassification.from_pretrained(
             "bucketresearch/politicalBiasBERT"
@@ -176,14 +190,18 @@ async def political_lean(text: str) -> dict:
             {"role": "user", "content": prompt},
         ]
 
-        response = generate_together(
+        response = await generate_together(
             model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
             messages=messages,
             max_tokens=1024,
             temperature=0.7,
         )
+        if response is None:
+            raise BackendError("No response from Together")
 
         json_response = extract_json(response)
+        if json_response is None:
+            raise BackendError("Unparseable political lean from Together")
 
         return json_response
 
@@ -194,7 +212,9 @@ async def llm_summarize(text: str, max_length: int = 130, min_length: int = 40)
         print("Test active summary")
         return "Test active summary"
 
-    if device == "cuda":
+    if get_device() == "cuda":
+        from transformers import pipeline
+
         summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
         summary = summarizer(
             text, max_length=max_length, min_length=min_length, do_sample=False
@@ -216,7 +236,7 @@ async def llm_summarize(text: str, max_length: int = 130, min_length: int = 40)
             {"role": "user", "content": prompt},
         ]
 
-        summary = generate_together(
+        summary = await generate_together(
             model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
             messages=messages,
             max_tokens=130,
@@ -226,7 +246,8 @@ async def llm_summarize(text: str, max_length: int = 130, min_length: int = 40)
             early_stopping=True,
         )
 
-        # Extract the summary from the response
+        if summary is None:
+            raise BackendError("No response from Together")
         return summary
 
 
@@ -237,9 +258,9 @@ async def extract_topics(text: str) -> dict:
         print("Test active topic scrapping")
         return {"topics": ["topic_1", "topic_2"]}
 
-    if device == "cuda":
+    if get_device() == "cuda":
         from transformers import pipeline
-        import re
+        from app.structured_output import generate_topics
 
         pipe = pipeline(
             "text-generation",
@@ -247,49 +268,14 @@ async def extract_topics(text: str) -> dict:
             # load_in_4bit=True,
         )
 
-        prompt = """Extract the main topics into a list of strings of 1-2 words.
-        It should come from the following text: {text}
-        The output should be the list and nothing else.
-        It should look like this: ["topic1", "topic2", "topic3"]
-        The list should contain up to {n_topics} topics. 
-        """
-
-        n_topics = 3
-        retry = 0
-        while retry < 3:
-            result = pipe(
-                prompt.format(n_topics=n_topics, text=text),
-                max_new_tokens=50,
-                do_sample=True,
-                return_full_text=False,
-            )
-            print(f"Result: {result}")
-            topics_str = result[0].get("generated_text", result[0].get("text", ""))
-            topics_match = re.search(r'\[(?:\s*"[^"]*"\s*,?)*\]', topics_str)
-            if not topics_match:
-                retry += 1
-                continue
-
-            try:
-                topics = topics_match.group(0)
-                topics = eval(topics)
-                break
-            except Exception as e:
-                print(f"Error evaluating topics: {e}")
-                retry += 1
-                continue
-
-        if retry == 3:
-            print("Failed to extract topics")
-            return {"topics": []}
-
+        topics, _ = generate_topics(pipe, text, n_topics=3)
         print(f"Topics: {topics}")
 
         return {"topics": topics}
     else:
         prompt = f"""
             Extract the key political, historical, and cultural topics related to the following text.
-            Return only the topics as a comma-separated list.
+            Return the topics as a JSON object of the form {{"topics": ["topic1", "topic2"]}}.
             
             Text: {text}
             
@@ -304,21 +290,116 @@ async def extract_topics(text: str) -> dict:
             {"role": "user", "content": prompt},
         ]
 
-        response = generate_together(
+        response = await generate_together(
             model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
             messages=messages,
             max_tokens=256,
             temperature=0.3,
+            response_format={
+                "type": "json_object",
+                "schema": TopicsAPI.model_json_schema(),
+            },
         )
 
-        topics = [topic.strip() for topic in response.split(",")]
-        return {"topics": topics}
+        try:
+            topics = TopicsAPI.model_validate_json(response).topics
+        except (ValidationError, TypeError) as e:
+            print(f"Error parsing topics: {e}")
+            topics = []
+        return {"topics": [topic.strip() for topic in topics]}
 
 
-async def get_topic_background(topic: str) -> str:
+_embedder = None
+# the embeddings run in executor threads, which shouldn't load it twice
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
     """
-    Helper for getting topic backgrounds for informed contextualizations.
+    The local EMBEDDING_MODEL, loaded on the first call (like Modal's
+    Embedder does once per container) rather than on every embedding.
+    Raises:
+        RuntimeError: If sentence-transformers isn't installed.
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                # an empty embedding would be stored as a result; fail the stage
+                raise RuntimeError("sentence-transformers not installed")
+            from app.related import EMBEDDING_MODEL
+
+            _embedder = SentenceTransformer(EMBEDDING_MODEL)
+    return _embedder
+
+
+def local_embedder_installed() -> bool:
     """
+    Whether sentence-transformers is installed, without importing it.
+    """
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+async def embed_article(text: str) -> list[float]:
+    """
+    Embed the article with a local sentence-transformers model.
+    Raises:
+        RuntimeError: If sentence-transformers isn't installed.
+    """
+    from app.related import EMBEDDING_DIM
+
+    if utils.TEST:
+        print("Test active embedding")
+        return [1.0] + [0.0] * (EMBEDDING_DIM - 1)
+
+    loop = asyncio.get_event_loop()
+    embedding = await loop.run_in_executor(
+        None,
+        lambda: get_embedder().encode(text, normalize_embeddings=True),
+    )
+    return embedding.tolist()
+
+
+async def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Embed a batch of texts with a local sentence-transformers model.
+    Raises:
+        RuntimeError: If sentence-transformers isn't installed.
+    """
+    from app.related import EMBEDDING_DIM
+
+    if utils.TEST:
+        return [[1.0] + [0.0] * (EMBEDDING_DIM - 1) for _ in texts]
+
+    loop = asyncio.get_event_loop()
+    embeddings = await loop.run_in_executor(
+        None,
+        lambda: get_embedder().encode(texts, normalize_embeddings=True),
+    )
+    return embeddings.tolist()
+
+
+# Topic backgrounds are shared across articles ("Supreme Court" reads the same
+# everywhere), so they are cached in memory and in the topic_backgrounds table
+# and only regenerated once they are older than the TTL. A stale background
+# served because its refresh failed is retried after TOPIC_BACKGROUND_RETRY.
+TOPIC_BACKGROUND_TTL = timedelta(
+    days=float(os.environ.get("TOPIC_BACKGROUND_TTL_DAYS", "30"))
+)
+TOPIC_BACKGROUND_RETRY = timedelta(minutes=10)
+
+# key -> (background, when it expires)
+topic_backgrounds: dict[str, tuple[str, datetime]] = {}
+topic_background_requests: dict[str, asyncio.Future] = {}
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic.lower().split())
+
+
+async def generate_topic_background(topic: str) -> str:
     prompt = f"Provide a concise, unbiased explanation or historical context for the topic: '{topic}'."
     messages = [
         {
@@ -327,23 +408,101 @@ async def get_topic_background(topic: str) -> str:
         },
         {"role": "user", "content": prompt},
     ]
-    background = generate_together(
+    background = await generate_together(
         model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
         messages=messages,
         max_tokens=128,
         temperature=0.3,
     )
+    if background is None:
+        raise RuntimeError(f"Failed to generate background for topic {topic}")
     return background.strip()
 
 
-async def contextualize_article(text: str) -> str:
+async def refresh_topic_background(topic: str, key: str) -> str:
+    stored = await asyncio.to_thread(get_stored_topic_background, key)
+    if stored:
+        expires = utils.parse_timestamp(stored["updated_at"]) + TOPIC_BACKGROUND_TTL
+        if datetime.now(timezone.utc) < expires:
+            topic_backgrounds[key] = (stored["background"], expires)
+            return stored["background"]
+
+    try:
+        background = await generate_topic_background(topic)
+    except Exception as e:
+        if stored:
+            # serve the stale background rather than nothing, and don't ask
+            # the failing LLM again for every article meanwhile
+            print(f"Error refreshing background for {key}, using stale one: {e}")
+            retry = datetime.now(timezone.utc) + TOPIC_BACKGROUND_RETRY
+            topic_backgrounds[key] = (stored["background"], retry)
+            return stored["background"]
+        raise
+
+    await asyncio.to_thread(save_topic_background, key, topic, background)
+    topic_backgrounds[key] = (
+        background,
+        datetime.now(timezone.utc) + TOPIC_BACKGROUND_TTL,
+    )
+    return background
+
+
+async def get_topic_background(topic: str) -> str:
+    """
+    Helper for getting topic backgrounds for informed contextualizations.
+    Backgrounds are keyed by the case/whitespace-normalized topic and reused
+    until they are older than TOPIC_BACKGROUND_TTL. Concurrent requests for
+    the same topic share a single LLM call.
+    """
+    if utils.TEST:
+        print("Test active topic background")
+        return f"Test active background for {topic}"
+
+    key = normalize_topic(topic)
+    cached = topic_backgrounds.get(key)
+    if cached and datetime.now(timezone.utc) < cached[1]:
+        return cached[0]
+
+    request = topic_background_requests.get(key)
+    if request is None:
+        request = asyncio.ensure_future(refresh_topic_background(topic, key))
+        topic_background_requests[key] = request
+        request.add_done_callback(lambda _: topic_background_requests.pop(key, None))
+
+    # shield so one caller being cancelled doesn't cancel the shared request
+    return await asyncio.shield(request)
+
+
+async def get_topic_backgrounds_section(topics: list[str]) -> str:
+    """
+    Format the backgrounds of the given topics for a contextualization prompt.
+    Topics whose background can't be fetched are left out.
+    """
+    backgrounds = await asyncio.gather(
+        *(get_topic_background(topic) for topic in topics), return_exceptions=True
+    )
+    lines = [
+        f"- {topic}: {background}"
+        for topic, background in zip(topics, backgrounds)
+        if isinstance(background, str)
+    ]
+    if not lines:
+        return ""
+    return "Background on these topics:\n" + "\n".join(lines) + "\n\n"
+
+
+async def contextualize_article(text: str, topics: list[str] | None = None) -> str:
     if utils.TEST:
         print("Test active contextualization")
         return "Test active contextualization of the article's broader context."
 
-    # First extract topics
-    topics_result = await extract_topics(text)
-    topics = topics_result.get("topics", [])
+    # First extract topics, unless the caller already has them
+    if topics is None:
+        topics_result = await extract_topics(text)
+        topics = topics_result.get("topics", [])
+    # one Together call per topic not cached yet; Modal's
+    # extract_topics_and_contextualize doesn't use backgrounds
+    backgrounds = await get_topic_backgrounds_section(topics)
 
     # Use TinyLlama or similar small model if available, otherwise fallback to generate_together
     try:
@@ -358,7 +517,7 @@ async def contextualize_article(text: str) -> str:
                 token=hf_token,
                 temperature=0.3,
             )
-            prompt = f"""You are an expert analyst of political, cultural, and historical discourse.\n\nGiven the article excerpt: {text}\nand the following topics identified within it: {', '.join(topics)}\n\nWrite a single, concise paragraph that analyzes how historical, cultural, and political factors relate to and shape these topics in the context of the article. Do not include headings, bullet points, or lists. Your response should be fluid, academic in tone, and approximately 5–6 sentences long. Output only the paragraph.\n"""
+            prompt = f"""You are an expert analyst of political, cultural, and historical discourse.\n\nGiven the article excerpt: {text}\nand the following topics identified within it: {', '.join(topics)}\n\n{backgrounds}Write a single, concise paragraph that analyzes how historical, cultural, and political factors relate to and shape these topics in the context of the article. Do not include headings, bullet points, or lists. Your response should be fluid, academic in tone, and approximately 5–6 sentences long. Output only the paragraph.\n"""
             result = context_pipe(
                 prompt,
                 max_new_tokens=192,
@@ -372,7 +531,7 @@ async def contextualize_article(text: str) -> str:
         print("Falling back to generate_together due to:", e)
 
     # Fallback: use generate_together API
-    prompt = f"""You are an expert analyst of political, cultural, and historical discourse.\n\nGiven the article excerpt: {text}\nand the following topics identified within it: {', '.join(topics)}\n\nWrite a single, concise paragraph that analyzes how historical, cultural, and political factors relate to and shape these topics in the context of the article. Do not include headings, bullet points, or lists. Your response should be fluid, academic in tone, and approximately 5–6 sentences long. Output only the paragraph.\n"""
+    prompt = f"""You are an expert analyst of political, cultural, and historical discourse.\n\nGiven the article excerpt: {text}\nand the following topics identified within it: {', '.join(topics)}\n\n{backgrounds}Write a single, concise paragraph that analyzes how historical, cultural, and political factors relate to and shape these topics in the context of the article. Do not include headings, bullet points, or lists. Your response should be fluid, academic in tone, and approximately 5–6 sentences long. Output only the paragraph.\n"""
     messages = [
         {
             "role": "system",
@@ -380,7 +539,7 @@ async def contextualize_article(text: str) -> str:
         },
         {"role": "user", "content": prompt},
     ]
-    contextualization = generate_together(
+    contextualization = await generate_together(
         model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
         messages=messages,
         max_tokens=192,
@@ -23,6 +23,10 @@ class LogicalFallacyListAPI(BaseModel):
     )
 
 
+class TopicsAPI(BaseModel):
+    topics: list[str] = Field(description="The main topics of the text, 1-2 words each")
+
+
 class CombinedAnalysisAPI(BaseModel):
     analysis: dict[str, list[LogicalFallacyAPI]] = Field(
         description="Analysis results organized by fallacy type",
@@ -103,6 +107,12 @@ class NewslyArticle:
     keywords: list[str] = field(default_factory=list)
     images: list[str] = field(default_factory=list)  # images found in the article
     movies: list[str] = field(default_factory=list)  # videos found in the article
+    fingerprint: str = ""  # SimHash of the text, used to find syndicated copies
+    # the text is kept in app.text_store under this hash; articles read from
+    # the database have an empty text until db.load_article_text
+    text_hash: str = ""
+    # per-tokenizer token counts and truncation offsets, see app.token_budget
+    token_budget: dict = field(default_factory=dict)
 
     # fields from analysis
     summary: str = ""
@@ -114,6 +124,9 @@ class NewslyArticle:
     logical_fallacies: LogicalFallacyComplete = field(
         default_factory=LogicalFallacyComplete
     )
+    embedding: list[float] = field(default_factory=list)  # for related articles
+    # stage -> {"backend", "version"} of each analysis result, see app.versions
+    stage_versions: dict = field(default_factory=dict)
 
     # fields for the database
     # These fields are set by the database and should not be set manually
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from app.deadlines import Deadline
+from app.routing import router
+from app.tracing import span
+
+
+@dataclass
+class StageContext:
+    """
+    What a stage function gets: the article, the results of the stages that
+    have finished so far and the backend that produced each (by stage name),
+    and the request deadline.
+    """
+
+    article: Any
+    results: dict
+    deadline: Deadline | None = None
+    backends: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class Stage:
+    """
+    One node of the analysis DAG.
+
+    calls maps a backend name to a function taking a StageContext and
+    returning an awaitable; the router picks the backend. reuse may return
+    the stage's result from its dependencies (e.g. when a backend computed
+    two stages in one call), in which case nothing is called. An optional
+    stage that fails, or has no call for the allowed backends, yields None
+    instead of failing the pipeline.
+    """
+
+    name: str
+    calls: dict[str, Callable[[StageContext], Any]]
+    deps: tuple[str, ...] = ()
+    reuse: Callable[[StageContext], Any] | None = None
+    optional: bool = False
+    hedge: bool = True
+
+
+@dataclass
+class StageTiming:
+    backend: str
+    started: float  # seconds since the pipeline started
+    seconds: float
+    error: str = ""
+
+
+@dataclass
+class PipelineRun:
+    results: dict = field(default_factory=dict)
+    timings: dict[str, StageTiming] = field(default_factory=dict)
+    # stage -> the backend that produced its result
+    backends: dict[str, str] = field(default_factory=dict)
+
+    def report(self) -> str:
+        """
+        One line per stage, in start order: backend, start offset and duration.
+        """
+        lines = []
+        for name, timing in sorted(self.timings.items(), key=lambda t: t[1].started):
+            line = (
+                f"{name:<18} {timing.backend:<9} "
+                f"+{timing.started:6.1f}s {timing.seconds:6.1f}s"
+            )
+            lines.append(line + (f" failed: {timing.error}" if timing.error else ""))
+        return "\n".join(lines)
+
+
+def check_stages(stages: list[Stage]) -> None:
+    """
+    Raise ValueError on unknown dependencies or a dependency cycle.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = set(stage.deps) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown {unknown}")
+
+    deps = {stage.name: set(stage.deps) for stage in stages}
+    while deps:
+        ready = [name for name, needs in deps.items() if not needs]
+        if not ready:
+            raise ValueError(f"Dependency cycle between stages {sorted(deps)}")
+        for name in ready:
+            del deps[name]
+        for needs in deps.values():
+            needs.difference_update(ready)
+
+
+async def _run_stage(
+    stage: Stage,
+    context: StageContext,
+    backends: tuple[str, ...] | None,
+    run: PipelineRun,
+    pipeline_start: float,
+):
+    # the stage's Modal and Together calls are its children (see app.tracing)
+    with span(f"stage.{stage.name}", **{"stage.name": stage.name}) as s:
+        start = time.monotonic()
+
+        def record(backend: str, error: str = "") -> None:
+            run.timings[stage.name] = StageTiming(
+                backend, start - pipeline_start, time.monotonic() - start, error
+            )
+            s.set_attribute("stage.backend", backend)
+
+        if stage.reuse:
+            result = stage.reuse(context)
+            if result is not None:
+                record("reused")
+                # made by the call of the stage it was reused from
+                if stage.deps and stage.deps[0] in context.backends:
+                    context.backends[stage.name] = context.backends[stage.deps[0]]
+                return result
+
+        calls = {
+            backend: (lambda call=call: call(context))
+            for backend, call in stage.calls.items()
+            if backends is None or backend in backends
+        }
+        if not calls:
+            if stage.optional:
+                record("skipped")
+                return None
+            raise ValueError(f"No backend among {backends} can run stage {stage.name}")
+
+        try:
+            backend, result = await router.route(
+                stage.name, calls, context.deadline, hedge=stage.hedge
+            )
+        except Exception as e:
+            record("failed", str(e))
+            s.set_error(str(e))
+            if stage.optional:
+                print(f"Optional stage {stage.name} failed: {e}")
+                return None
+            raise
+        record(backend)
+        context.backends[stage.name] = backend
+        return result
+
+
+async def run_stages(
+    stages: list[Stage],
+    article,
+    deadline: Deadline | None = None,
+    backends: tuple[str, ...] | None = None,
+) -> PipelineRun:
+    """
+    Run the stages, each as soon as all of its dependencies have finished.
+    Args:
+        stages (list[Stage]): The DAG.
+        article: Passed to the stages in their StageContext.
+        deadline (Deadline): The request deadline, if any.
+        backends (tuple[str]): Only route to these backends (default: all).
+    Returns:
+        PipelineRun: The result and timing of every stage.
+    Raises:
+        The error of the first required stage that failed; the stages still
+        running are cancelled.
+    """
+    check_stages(stages)
+    run = PipelineRun()
+    context = StageContext(article, run.results, deadline, run.backends)
+    pipeline_start = time.monotonic()
+
+    waiting = {stage.name: stage for stage in stages}
+    running: dict[asyncio.Future, str] = {}
+    try:
+        while waiting or running:
+            for name, stage in list(waiting.items()):
+                if all(dep in run.results for dep in stage.deps):
+                    del waiting[name]
+                    task = asyncio.ensure_future(
+                        _run_stage(stage, context, backends, run, pipeline_start)
+                    )
+                    running[task] = name
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                run.results[running.pop(task)] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
+        # retrieve their errors, a stage may fail while it is being cancelled
+        await asyncio.gather(*running, return_exceptions=True)
+
+    return run
@@ -0,0 +1,329 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# POST /articles/analyze?profile=<PROFILE_TOKEN> (or with an X-Profile header
+# carrying it) samples the analysis every PROFILE_INTERVAL_MS and saves where
+# the time went as a speedscope file (https://www.speedscope.app) under
+# PROFILE_DIR, linked from the X-Profile-Url response header. Samples follow
+# the request's task tree: a task awaiting Modal or Together counts with its
+# await chain, one awaiting asyncio.to_thread (or run_in_executor on the
+# default executor) with the worker thread's stack.
+# Concurrent stages each count their own time. Without PROFILE_TOKEN
+# profiling is off, and unprofiled requests don't pay for any of it.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HEADER = "X-Profile"
+
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+# loop -> (profilers running on it, the task factory it had before)
+_factories = {}
+# loops whose default executor is a _ProfilingExecutor (kept once installed)
+_executor_loops = weakref.WeakSet()
+
+
+def profile_token_ok(token: str) -> bool:
+    # bytes, as compare_digest rejects non-ASCII strings
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(
+        token.encode(), PROFILE_TOKEN.encode()
+    )
+
+
+def _profiling_task_factory(loop, coro, **kwargs):
+    # records the tasks a profiled request creates, with the task creating them
+    previous = _factories[loop][1]
+    if previous:
+        task = previous(loop, coro, **kwargs)
+    else:
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+    profiler = _active_profiler.get()
+    if profiler is not None:
+        profiler.add_task(task, asyncio.current_task(loop))
+    return task
+
+
+def _stack(frame) -> list:
+    # outermost frame first
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro) -> tuple[list, object]:
+    """
+    The frames of a suspended coroutine and of those it awaits, outermost
+    first, and what the innermost one awaits (e.g. a Future).
+    """
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames, coro
+
+
+class _ProfilingExecutor(ThreadPoolExecutor):
+    """
+    The default executor while profiling: work submitted by a profiled task
+    tells the profiler which thread runs it for that task.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        profiler = _active_profiler.get()
+        if profiler is None:
+            return super().submit(fn, *args, **kwargs)
+        # submit runs on the event loop, in the submitting task
+        task = asyncio.current_task()
+        return super().submit(_run_for, profiler, task, fn, *args, **kwargs)
+
+
+def _run_for(profiler, task, fn, *args, **kwargs):
+    ident = threading.get_ident()
+    profiler.add_worker(ident, task)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.remove_worker(ident)
+
+
+_RUN_FOR = _run_for.__code__
+
+
+class Profiler:
+    """
+    Samples the tasks of the current request (the task entering it and every
+    task created under it) from a background thread, into wall clock and CPU
+    stacks. CPU is the sampled thread's CPU time since the previous sample.
+    Use it as a context manager inside the request's task; the profile is
+    saved under PROFILE_DIR on exit, as file_name.
+    """
+
+    def __init__(
+        self, name: str, interval: float = PROFILE_INTERVAL_MS / 1000, path=None
+    ):
+        self.name = name
+        self.interval = interval
+        self.path = path or PROFILE_DIR
+        self.file_name = None
+        # (function, file, line) -> index in the speedscope frames
+        self.frames: dict[tuple, int] = {}
+        # stack of frame indices -> seconds
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.samples = 0
+        # task -> the task that created it
+        self.tasks = {}
+        # executor thread id -> the task it runs work for
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self._cpu_times = {}
+
+    def add_task(self, task, parent) -> None:
+        if not self.stopped.is_set():
+            with self.lock:
+                self.tasks[task] = parent
+
+    def add_worker(self, ident: int, task) -> None:
+        with self.lock:
+            self.workers[ident] = task
+
+    def remove_worker(self, ident: int) -> None:
+        with self.lock:
+            self.workers.pop(ident, None)
+
+    def __enter__(self):
+        self.loop = asyncio.get_running_loop()
+        if self.loop not in _executor_loops:
+            self.loop.set_default_executor(
+                _ProfilingExecutor(thread_name_prefix="asyncio")
+            )
+            _executor_loops.add(self.loop)
+        self.loop_thread = threading.get_ident()
+        self.add_task(asyncio.current_task(), None)
+        count, previous = _factories.get(self.loop, (0, self.loop.get_task_factory()))
+        _factories[self.loop] = (count + 1, previous)
+        self.loop.set_task_factory(_profiling_task_factory)
+        self.token = _active_profiler.set(self)
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.elapsed = time.monotonic() - self.started
+        _active_profiler.reset(self.token)
+        count, previous = _factories.pop(self.loop)
+        if count > 1:
+            _factories[self.loop] = (count - 1, previous)
+        else:
+            self.loop.set_task_factory(previous)
+        with self.lock:
+            self.tasks.clear()
+        self.file_name = self.save()
+        print(
+            f"Profiled {self.name} ({self.elapsed:.1f}s, {self.samples} samples): "
+            f"{os.path.join(self.path, self.file_name)}"
+        )
+        return False
+
+    def _run(self) -> None:
+        last = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            now = time.monotonic()
+            try:
+                self._sample(now - last)
+            except Exception as e:
+                # the event loop moved on while its tasks were being walked
+                print(f"Profiler skipped a sample: {e}")
+            last = now
+
+    def _thread_cpu(self, ident: int) -> float:
+        """
+        CPU seconds the thread used since it was last asked about (0 if unknown).
+        """
+        try:
+            now = time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return 0.0
+        used = now - self._cpu_times.get(ident, now)
+        self._cpu_times[ident] = now
+        return used
+
+    def _frame_index(self, key: tuple) -> int:
+        return self.frames.setdefault(key, len(self.frames))
+
+    def _keys(self, frames: list) -> list[tuple]:
+        return [
+            (
+                getattr(frame.f_code, "co_qualname", frame.f_code.co_name),
+                frame.f_code.co_filename,
+                frame.f_code.co_firstlineno,
+            )
+            for frame in frames
+        ]
+
+    def _sample(self, elapsed: float) -> None:
+        thread_frames = sys._current_frames()
+        # every thread, so that a delta never spans work done for other requests
+        cpu = {ident: self._thread_cpu(ident) for ident in thread_frames}
+        for ident in set(self._cpu_times) - set(thread_frames):
+            del self._cpu_times[ident]
+        with self.lock:
+            for task in [task for task in self.tasks if task.done()]:
+                del self.tasks[task]
+            tasks = dict(self.tasks)
+            # task -> the executor threads running work for it
+            workers = {}
+            for ident, task in self.workers.items():
+                workers.setdefault(task, []).append(ident)
+        waiting_on_children = set(tasks.values())
+
+        prefixes = {}
+
+        def prefix(task) -> list[tuple]:
+            # the await chains of the tasks that created this one
+            parent = tasks.get(task)
+            if parent not in tasks:
+                return []
+            if parent not in prefixes:
+                chain, _ = _await_chain(parent.get_coro())
+                prefixes[parent] = prefix(parent) + self._keys(chain)
+            return prefixes[parent]
+
+        def add(stack: list[tuple], thread: int | None) -> None:
+            stack = tuple(self._frame_index(key) for key in stack)
+            self.wall[stack] += elapsed
+            if thread is not None:
+                self.cpu[stack] += cpu.get(thread, 0.0)
+
+        for task in tasks:
+            coro = task.get_coro()
+            if getattr(coro, "cr_running", False):
+                # running on the loop thread: its live stack from the task down
+                stack = _stack(thread_frames.get(self.loop_thread))
+                roots = [i for i, frame in enumerate(stack) if frame is coro.cr_frame]
+                keys = self._keys(stack[roots[0] if roots else 0 :])
+                add(prefix(task) + keys, self.loop_thread)
+                continue
+            if task in waiting_on_children:
+                # sampled through its children
+                continue
+            chain, awaited = _await_chain(coro)
+            keys = prefix(task) + self._keys(chain)
+            idents = [
+                ident for ident in workers.get(task, ()) if ident in thread_frames
+            ]
+            if idents:
+                # awaiting executor work: the worker's stack below _run_for
+                stack = _stack(thread_frames[idents[-1]])
+                starts = [
+                    i for i, frame in enumerate(stack) if frame.f_code is _RUN_FOR
+                ]
+                keys += self._keys(stack[starts[0] + 1 :] if starts else stack)
+                add(keys, idents[-1])
+                continue
+            if awaited is None:
+                keys.append(("[waiting for the event loop]", "", 0))
+            else:
+                # awaiting a Future goes through its __await__ iterator
+                name = type(awaited).__name__.removesuffix("Iter")
+                keys.append((f"[await {name}]", "", 0))
+            add(keys, None)
+        self.samples += 1
+
+    def speedscope(self) -> dict:
+        profiles = []
+        for label, stacks in (("wall clock", self.wall), ("CPU", self.cpu)):
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": f"{label}: {self.name}",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(stacks.values()),
+                    "samples": [list(stack) for stack in stacks],
+                    "weights": list(stacks.values()),
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "newsly",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": name, "file": file, "line": line}
+                    for name, file, line in self.frames
+                ]
+            },
+            "profiles": profiles,
+        }
+
+    def save(self) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        file_name = (
+            f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+            ".speedscope.json"
+        )
+        with open(os.path.join(self.path, file_name), "w") as f:
+            json.dump(self.speedscope(), f)
+        return file_name
@@ -291,3 +291,35 @@ Maximum 3 examples per category for all categories.
 
 JSON Response:
 """
+
+
+tag = """Given the following text;
+{text}
+
+    extract a single tag from the following list:
+•	Politics & Government
+•	Business & Economy
+•	Health & Science
+•	Technology & Innovation
+•	Social Issues & Inequality
+•	Crime & Law
+•	World Affairs
+•	Environment & Climate
+•	Culture & Entertainment
+•	Sports
+•	Education
+•	Opinion & Editorial
+•	Religion & Ethics
+
+The output should be the tag and nothing else.
+    """
+
+topics = """Extract the main topics into a list of strings of 1-2 words.
+    It should come from the following text: {text}
+
+    The output should be the JSON object and nothing else.
+    Do not write any code.
+    It should look like this: {{"topics": ["topic1", "topic2", "topic3"]}}
+    The list should contain MAXIMUM of {n_topics} topics.
+    The JSON object is:
+    """
@@ -0,0 +1,306 @@
+import asyncio
+import dataclasses
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from app.backends import BACKEND_CLASSES, OPTIONAL_METHODS
+from app.db import get_article_by_id, iter_article_pages, update_article_fields
+from app.deadlines import Deadline
+from app.migrations import Migration
+from app.server import (
+    ANALYSIS_STAGES,
+    RESTORABLE_STAGES,
+    STAGE_DEPS,
+    analyze_article,
+    index_article,
+    refresh_article,
+)
+from app.versions import is_outdated, stamp
+
+REANALYSIS_CONCURRENCY = int(os.environ.get("REANALYSIS_CONCURRENCY", "4"))
+REANALYSIS_PAGE_SIZE = 200
+# an optional stage without a stored version may just have had no backend,
+# so only a stale stamp makes it outdated
+REQUIRED_STAGES = {
+    name for name, _, _, options in ANALYSIS_STAGES if not options.get("optional")
+}
+# what the planner needs of each row: the versions, and the fields the
+# restorable stages are rebuilt from
+PLAN_COLUMNS = ", ".join(
+    ["stage_versions"] + [field_name for field_name, _ in RESTORABLE_STAGES.values()]
+)
+MAX_ERRORS = 100
+
+
+def outdated_stages(
+    stage_versions: dict | None, stages: list[str] | None = None
+) -> set[str]:
+    """
+    The stages (among stages, default all) whose stored result is out of date.
+    """
+    stage_versions = stage_versions or {}
+    outdated = set()
+    for name in stages or STAGE_DEPS:
+        entry = stage_versions.get(name)
+        if entry is None and name not in REQUIRED_STAGES:
+            continue
+        if is_outdated(name, entry):
+            outdated.add(name)
+    return outdated
+
+
+def stages_to_run(outdated: set[str], row: dict) -> set[str]:
+    """
+    The stages to re-run so that the outdated ones are current: those, the
+    stages depending on them, and the dependencies that can't be restored
+    from the row (or whose call also produced the stage, as the lean's does
+    the lean explanation on Modal).
+    """
+    stage_versions = row.get("stage_versions") or {}
+    run = set(outdated)
+    while True:
+        added = set()
+        for name, deps in STAGE_DEPS.items():
+            if name not in run:
+                if any(dep in run for dep in deps):
+                    added.add(name)
+                continue
+            reused_from = (stage_versions.get(name) or {}).get("reused_from")
+            for dep in deps:
+                if dep in run:
+                    continue
+                field_name, restore = RESTORABLE_STAGES.get(dep, (None, None))
+                if (
+                    dep == reused_from
+                    or restore is None
+                    or restore(row.get(field_name)) is None
+                ):
+                    added.add(dep)
+        if not added:
+            return run
+        run |= added
+
+
+def iter_plan(
+    stages: list[str] | None = None,
+    page_size: int = REANALYSIS_PAGE_SIZE,
+    after: str | None = None,
+):
+    """
+    Yield (page, {article id: (outdated stages, stages to run)}) for every page
+    of the articles table, listing only the articles that need work.
+    """
+    for page in iter_article_pages(PLAN_COLUMNS, page_size, after):
+        work = {}
+        for row in page:
+            outdated = outdated_stages(row.get("stage_versions"), stages)
+            if outdated:
+                work[row["id"]] = (outdated, stages_to_run(outdated, row))
+        yield page, work
+
+
+@dataclass
+class ReanalysisPlan:
+    scanned: int = 0
+    articles: int = 0
+    # stage -> articles where it is out of date
+    outdated: Counter = field(default_factory=Counter)
+    # stage -> articles it would be re-run on
+    runs: Counter = field(default_factory=Counter)
+
+    def report(self) -> str:
+        lines = [f"{self.articles} of {self.scanned} articles need re-analysis"]
+        for name in STAGE_DEPS:
+            if self.runs[name]:
+                lines.append(
+                    f"{name:<18} outdated {self.outdated[name]:>7}  "
+                    f"re-run {self.runs[name]:>7}"
+                )
+        return "\n".join(lines)
+
+
+def plan_reanalysis(
+    stages: list[str] | None = None,
+    limit: int | None = None,
+    page_size: int = REANALYSIS_PAGE_SIZE,
+) -> ReanalysisPlan:
+    """
+    Count the outdated stages, and the stage runs bringing them up to date,
+    without running anything.
+    Args:
+        stages (list[str]): Only consider these stages outdated (default all).
+        limit (int): Stop after this many articles that need work.
+    """
+    plan = ReanalysisPlan()
+    for page, work in iter_plan(stages, page_size):
+        plan.scanned += len(page)
+        for outdated, run in work.values():
+            plan.articles += 1
+            plan.outdated.update(outdated)
+            plan.runs.update(run)
+            if limit and plan.articles >= limit:
+                return plan
+    return plan
+
+
+@dataclass
+class ReanalysisProgress:
+    last_id: str | None = None
+    scanned: int = 0
+    reanalyzed: int = 0
+    updated: int = 0
+    failed: int = 0
+    # stage -> times re-run
+    runs: Counter = field(default_factory=Counter)
+    # the first MAX_ERRORS failures
+    errors: list[str] = field(default_factory=list)
+
+
+async def reanalyze(
+    stages: list[str] | None = None,
+    limit: int | None = None,
+    concurrency: int = REANALYSIS_CONCURRENCY,
+    page_size: int = REANALYSIS_PAGE_SIZE,
+    deadline_seconds: float | None = None,
+    after: str | None = None,
+) -> ReanalysisProgress:
+    """
+    Re-run the outdated stages of every article, at backfill priority,
+    writing only the fields of the stages that ran (plus stage_versions and
+    last_analyzed_at) once per page.
+    Args:
+        stages (list[str]): Only re-run these stages when outdated (and what
+            they need), instead of every outdated stage.
+        limit (int): Stop after this many articles.
+        deadline_seconds (float): Per-article deadline (default none).
+        after (str): Resume after this article id (the last_id of a run).
+    """
+    progress = ReanalysisProgress(last_id=after)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    async def reanalyze_one(article_id: str, run: set[str], pending: dict) -> None:
+        async with semaphore:
+            try:
+                article = await asyncio.to_thread(get_article_by_id, article_id)
+                if article is None:
+                    return
+                deadline = Deadline(deadline_seconds) if deadline_seconds else None
+                await analyze_article(
+                    article, deadline=deadline, priority="backfill", only=run
+                )
+            except Exception as e:
+                progress.failed += 1
+                if len(progress.errors) < MAX_ERRORS:
+                    progress.errors.append(f"{article_id}: {e}")
+                print(f"Re-analysis of {article_id} failed: {e}")
+                return
+        values = dataclasses.asdict(article)
+        changes = {name: values[name] for name in run}
+        changes["stage_versions"] = article.stage_versions
+        changes["last_analyzed_at"] = datetime.now(timezone.utc).isoformat()
+        pending[article_id] = changes
+        progress.reanalyzed += 1
+        progress.runs.update(run)
+        if "embedding" in run:
+            index_article(article)
+
+    attempted = 0
+    for page, work in iter_plan(stages, page_size, after):
+        last_id = page[-1]["id"]
+        if limit and len(work) > limit - attempted:
+            work = dict(list(work.items())[: limit - attempted])
+            last_id = list(work)[-1] if work else progress.last_id
+        attempted += len(work)
+        pending: dict[str, dict] = {}
+        await asyncio.gather(
+            *(
+                reanalyze_one(article_id, run, pending)
+                for article_id, (_, run) in work.items()
+            )
+        )
+        progress.updated += await asyncio.to_thread(update_article_fields, pending)
+        progress.scanned += len(page)
+        progress.last_id = last_id
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print(
+            f"Re-analysis: scanned {progress.scanned}, re-analyzed "
+            f"{progress.reanalyzed}, failed {progress.failed}, "
+            f"{progress.reanalyzed / elapsed:.2f} articles/s, last id {progress.last_id}"
+        )
+        if limit and attempted >= limit:
+            break
+
+    return progress
+
+
+async def refresh_articles(
+    limit: int | None = None,
+    concurrency: int = REANALYSIS_CONCURRENCY,
+    page_size: int = REANALYSIS_PAGE_SIZE,
+    deadline_seconds: float | None = None,
+    after: str | None = None,
+) -> Counter:
+    """
+    Re-fetch every stored article (see server.refresh_article), re-analyzing
+    those whose text changed, at backfill priority.
+    Returns:
+        Counter: Articles by outcome: not_modified, unchanged, changed, failed.
+    """
+    outcomes = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def refresh_one(article_id: str) -> None:
+        async with semaphore:
+            try:
+                article = await asyncio.to_thread(get_article_by_id, article_id)
+                if article is None:
+                    return
+                deadline = Deadline(deadline_seconds) if deadline_seconds else None
+                outcomes[await refresh_article(article, deadline)] += 1
+            except Exception as e:
+                outcomes["failed"] += 1
+                print(f"Refresh of {article_id} failed: {e}")
+
+    seen = 0
+    for page in iter_article_pages("url", page_size, after):
+        if limit:
+            page = page[: limit - seen]
+        seen += len(page)
+        await asyncio.gather(*(refresh_one(row["id"]) for row in page))
+        print(f"Refresh: {seen} articles, {dict(outcomes)}, last id {page[-1]['id']}")
+        if limit and seen >= limit:
+            break
+    return outcomes
+
+
+def stamp_migration(backend: str) -> Migration:
+    """
+    A migration giving the analyzed articles that have no stage_versions yet
+    (analyzed before they were recorded) the current versions of the backend
+    that analyzed them, so that only later changes make them outdated.
+    """
+    backend_class = BACKEND_CLASSES[backend]
+    stage_versions = {}
+    for name, method, _, options in ANALYSIS_STAGES:
+        if name not in REQUIRED_STAGES:
+            continue
+        # e.g. the lean explanation comes with the lean on Modal
+        reused = options.get("reuse") and (
+            method in OPTIONAL_METHODS and method not in backend_class.optional
+        )
+        stage_versions[name] = stamp(
+            name, backend, STAGE_DEPS[name][0] if reused else None
+        )
+
+    def migrate(row: dict) -> dict | None:
+        if row.get("stage_versions") or not row.get("summary"):
+            return None
+        return {"stage_versions": stage_versions}
+
+    return Migration(
+        f"stamp_stage_versions_{backend}", "stage_versions, summary", migrate
+    )
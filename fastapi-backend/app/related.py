@@ -0,0 +1,192 @@
+import numpy as np
+
+# Sentence-transformers model used for article embeddings (see ml_modal.embed_article)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+
+class RelatedArticlesIndex:
+    """
+    Approximate nearest-neighbour index over normalized article embeddings.
+
+    Vectors live in one contiguous float32 matrix. Until the index holds
+    train_size vectors, queries are exact (one matrix-vector product). After
+    that it works as an inverted file: vectors are bucketed by their nearest
+    k-means centroid and a query only scores the n_probe closest buckets.
+    Centroids are retrained whenever the index has doubled since the last
+    training, so buckets stay balanced as articles are added.
+    """
+
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        n_probe: int = 8,
+        train_size: int = 5000,
+        kmeans_iterations: int = 10,
+        seed: int = 0,
+    ):
+        self.dim = dim
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.rng = np.random.default_rng(seed)
+
+        self.vectors = np.zeros((1024, dim), dtype=np.float32)
+        self.ids: list[str | None] = []
+        self.rows: dict[str, int] = {}
+
+        self.centroids: np.ndarray | None = None
+        self.lists: list[list[int]] = []
+        self.list_arrays: list[np.ndarray | None] = []
+        self.assignments: list[int] = []
+        self.trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, article_id: str) -> bool:
+        return article_id in self.rows
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+        return vector / np.maximum(norm, 1e-12)
+
+    def get_vector(self, article_id: str) -> np.ndarray | None:
+        row = self.rows.get(article_id)
+        return None if row is None else self.vectors[row]
+
+    def add(self, article_id: str, embedding) -> None:
+        if not article_id or embedding is None or len(embedding) != self.dim:
+            return
+
+        vector = self._normalize(embedding)
+        row = self.rows.get(article_id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.vectors):
+                grown = np.zeros((2 * len(self.vectors), self.dim), dtype=np.float32)
+                grown[:row] = self.vectors
+                self.vectors = grown
+            self.ids.append(article_id)
+            self.assignments.append(-1)
+            self.rows[article_id] = row
+        else:
+            self._unassign(row)
+
+        self.vectors[row] = vector
+
+        if self.centroids is None:
+            if len(self.rows) >= self.train_size:
+                self.train()
+        elif len(self.rows) >= 2 * self.trained_size:
+            self.train()
+        else:
+            self._assign(row)
+
+    def remove(self, article_id: str) -> None:
+        row = self.rows.pop(article_id, None)
+        if row is None:
+            return
+        self._unassign(row)
+        self.ids[row] = None
+        self.vectors[row] = 0
+
+    def _assign(self, row: int) -> None:
+        centroid = int(np.argmax(self.centroids @ self.vectors[row]))
+        self.lists[centroid].append(row)
+        self.list_arrays[centroid] = None
+        self.assignments[row] = centroid
+
+    def _unassign(self, row: int) -> None:
+        centroid = self.assignments[row]
+        if centroid >= 0:
+            self.lists[centroid].remove(row)
+            self.list_arrays[centroid] = None
+            self.assignments[row] = -1
+
+    def _list_array(self, centroid: int) -> np.ndarray:
+        # bucket contents as an array, cached until the bucket changes
+        if self.list_arrays[centroid] is None:
+            self.list_arrays[centroid] = np.array(self.lists[centroid], dtype=np.int64)
+        return self.list_arrays[centroid]
+
+    def train(self) -> None:
+        """
+        Run spherical k-means on a sample of the vectors and rebuild the buckets.
+        """
+        live_rows = np.fromiter(self.rows.values(), dtype=np.int64)
+        n_lists = max(1, int(np.sqrt(len(live_rows))))
+
+        sample_size = min(len(live_rows), 64 * n_lists)
+        sample = self.vectors[self.rng.choice(live_rows, sample_size, replace=False)]
+        centroids = sample[self.rng.choice(sample_size, n_lists, replace=False)]
+
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = self._normalize(sums)
+
+        self.centroids = centroids
+        self.lists = [[] for _ in range(n_lists)]
+        self.list_arrays = [None] * n_lists
+        self.assignments = [-1] * len(self.ids)
+
+        labels = np.empty(len(live_rows), dtype=np.int64)
+        for start in range(0, len(live_rows), 8192):
+            chunk = live_rows[start : start + 8192]
+            labels[start : start + 8192] = np.argmax(
+                self.vectors[chunk] @ centroids.T, axis=1
+            )
+        for row, label in zip(live_rows.tolist(), labels.tolist()):
+            self.lists[label].append(row)
+            self.assignments[row] = label
+
+        self.trained_size = len(live_rows)
+
+    def search(
+        self, embedding, k: int = 5, exclude: set[str] | None = None
+    ) -> list[tuple[str, float]]:
+        """
+        Find the k most similar articles.
+        Args:
+            embedding: The query embedding.
+            k (int): Number of results.
+            exclude (set[str]): Article IDs to leave out, e.g. the query article.
+        Returns:
+            list[tuple[str, float]]: (article_id, cosine similarity), best first.
+        """
+        if not self.rows:
+            return []
+
+        query = self._normalize(embedding)
+        if self.centroids is None:
+            candidates = np.arange(len(self.ids))
+        else:
+            n_probe = min(self.n_probe, len(self.centroids))
+            closest = np.argpartition(-(self.centroids @ query), n_probe - 1)
+            candidates = np.concatenate(
+                [self._list_array(c) for c in closest[:n_probe]]
+            )
+            if len(candidates) == 0:
+                return []
+
+        scores = self.vectors[candidates] @ query
+        n_extra = len(exclude or ()) + 1
+        top = min(k + n_extra, len(candidates))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        for i in best:
+            article_id = self.ids[candidates[i]]
+            if article_id is None or (exclude and article_id in exclude):
+                continue
+            results.append((article_id, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
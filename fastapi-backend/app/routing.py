@@ -0,0 +1,250 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from app.deadlines import Deadline, DeadlineExceeded, latencies, latency_key, run_stage
+
+# Backends in order of preference, until the router has latencies for them
+# (see backends.py for what each one is)
+BACKEND_PREFERENCE = ("modal", "together", "fake")
+# stages that prefer another order
+STAGE_PREFERENCE = {
+    "logical_fallacies": ("together", "modal", "fake"),
+}
+
+# consecutive failures of a backend (any stage) before its circuit opens
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+# how often an open circuit probes its backend
+CIRCUIT_PROBE_INTERVAL = float(os.environ.get("CIRCUIT_PROBE_SECONDS", "30"))
+PROBE_TIMEOUT = 60
+# share of calls sent to a backend other than the best one, so that the
+# router keeps up-to-date latencies for every backend
+ROUTER_EXPLORE_RATE = float(os.environ.get("ROUTER_EXPLORE_RATE", "0.02"))
+# calls needed on a backend before its latency is trusted for routing
+MIN_SAMPLES = 5
+OUTCOME_WINDOW = 100
+# exception modules whose errors are transport failures (connection, RPC)
+TRANSPORT_MODULES = ("aiohttp", "grpclib", "modal")
+
+
+class BackendError(Exception):
+    """
+    A backend couldn't serve a call: no reply after its retries, or a result
+    that can't be used. Counts against the backend.
+    """
+
+
+def is_backend_failure(e: Exception) -> bool:
+    """
+    Whether the error says the backend is unhealthy (transport errors,
+    timeouts, 5xx and 429 responses, BackendError), rather than that the
+    input was bad, which would fail on any backend and mustn't open its
+    circuit.
+    """
+    timeouts = (DeadlineExceeded, asyncio.TimeoutError, TimeoutError)
+    if isinstance(e, (BackendError, ConnectionError, *timeouts)):
+        return True
+    status = getattr(e, "status_code", None) or getattr(e, "status", None)
+    if isinstance(status, int):
+        # 429: the provider is over capacity
+        return status >= 500 or status == 429
+    return type(e).__module__.split(".")[0] in TRANSPORT_MODULES
+
+
+class CircuitBreaker:
+    """
+    Opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures. While open,
+    the backend gets no traffic and is probed in the background every
+    CIRCUIT_PROBE_INTERVAL seconds; the first successful probe closes it.
+    Without a probe, the circuit closes again after one interval and real
+    traffic decides (half-open).
+    """
+
+    def __init__(self, backend: str, probe=None):
+        self.backend = backend
+        self.probe = probe
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probe_task: asyncio.Future | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.failures = 0
+            self.close()
+            return
+
+        self.failures += 1
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD and not self.is_open:
+            print(f"Circuit for {self.backend} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.probe_task = asyncio.ensure_future(self._probe_until_closed())
+
+    def close(self) -> None:
+        if self.is_open:
+            print(f"Circuit for {self.backend} closed")
+        self.opened_at = None
+        if self.probe_task and self.probe_task is not asyncio.current_task():
+            self.probe_task.cancel()
+        self.probe_task = None
+
+    async def _probe_until_closed(self) -> None:
+        while self.is_open:
+            await asyncio.sleep(CIRCUIT_PROBE_INTERVAL)
+            if self.probe is None:
+                self.failures = CIRCUIT_FAILURE_THRESHOLD - 1
+                self.close()
+                return
+            try:
+                await asyncio.wait_for(self.probe(), PROBE_TIMEOUT)
+            except Exception as e:
+                print(f"Probe of {self.backend} failed: {e}")
+                continue
+            self.failures = 0
+            self.close()
+
+
+class Router:
+    """
+    Routes each analysis stage to the healthier backend.
+
+    Backends whose circuit is open are skipped. Among the others, the one
+    with the lowest median latency for the stage, inflated by its recent
+    error rate, is tried first; until every backend has MIN_SAMPLES calls
+    the stage's preferred backend goes first. If the call fails, the next
+    backend is tried while the request deadline allows it. Only failures
+    that is_backend_failure blames on the backend count against it.
+    """
+
+    def __init__(self):
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.outcomes: dict[str, deque] = {}
+
+    def breaker(self, backend: str) -> CircuitBreaker:
+        if backend not in self.breakers:
+            self.breakers[backend] = CircuitBreaker(backend)
+        return self.breakers[backend]
+
+    def set_probe(self, backend: str, probe) -> None:
+        """
+        Set the coroutine function used to check if the backend has recovered.
+        """
+        self.breaker(backend).probe = probe
+
+    def record(self, backend: str, stage: str, ok: bool) -> None:
+        key = latency_key(stage, backend)
+        self.outcomes.setdefault(key, deque(maxlen=OUTCOME_WINDOW)).append(ok)
+        self.breaker(backend).record(ok)
+
+    def error_rate(self, backend: str, stage: str) -> float:
+        outcomes = self.outcomes.get(latency_key(stage, backend))
+        if not outcomes:
+            return 0.0
+        return 1 - sum(outcomes) / len(outcomes)
+
+    def score(self, backend: str, stage: str) -> float | None:
+        """
+        Expected seconds per successful call, or None without enough samples.
+        """
+        median = latencies.quantile(latency_key(stage, backend), 0.5, MIN_SAMPLES)
+        if median is None:
+            return None
+        return median / max(0.05, 1 - self.error_rate(backend, stage))
+
+    def candidates(self, stage: str, backends) -> list[str]:
+        """
+        The backends to try for the stage, in order.
+        """
+        preference = STAGE_PREFERENCE.get(stage, BACKEND_PREFERENCE)
+        backends = sorted(
+            backends,
+            key=lambda b: preference.index(b) if b in preference else len(preference),
+        )
+        healthy = [b for b in backends if not self.breaker(b).is_open]
+        if not healthy:
+            # everything is tripped; trying is still better than failing outright
+            return backends
+
+        scores = [self.score(backend, stage) for backend in healthy]
+        if None not in scores:
+            healthy = [b for _, b in sorted(zip(scores, healthy))]
+        if len(healthy) > 1 and random.random() < ROUTER_EXPLORE_RATE:
+            healthy[0], healthy[1] = healthy[1], healthy[0]
+        return healthy
+
+    async def run(
+        self,
+        stage: str,
+        calls: dict,
+        deadline: Deadline | None = None,
+        hedge: bool = True,
+    ):
+        """
+        Run the stage on the best backend, failing over to the next one.
+        Args:
+            stage (str): The stage name.
+            calls (dict): Backend name to a function returning a new awaitable
+                for the stage, see deadlines.run_stage.
+            deadline (Deadline): The request deadline, if any.
+            hedge (bool): Whether slow calls may be hedged.
+        """
+        _, result = await self.route(stage, calls, deadline, hedge)
+        return result
+
+    async def route(
+        self,
+        stage: str,
+        calls: dict,
+        deadline: Deadline | None = None,
+        hedge: bool = True,
+    ) -> tuple[str, object]:
+        """
+        Like run, but returns (backend, result).
+        """
+        error = None
+        for backend in self.candidates(stage, calls.keys()):
+            if deadline and not deadline.remaining():
+                break
+            try:
+                result = await run_stage(
+                    stage, calls[backend], deadline, hedge=hedge, backend=backend
+                )
+            except Exception as e:
+                print(f"{stage} failed on {backend}: {e}")
+                if is_backend_failure(e):
+                    self.record(backend, stage, ok=False)
+                error = e
+                continue
+            self.record(backend, stage, ok=True)
+            return backend, result
+
+        raise error or DeadlineExceeded(stage, 0)
+
+    def status(self) -> dict:
+        """
+        Circuit state and per-stage latency and error rate of every backend.
+        """
+        status = {
+            backend: {
+                "circuit_open": breaker.is_open,
+                "consecutive_failures": breaker.failures,
+                "stages": {},
+            }
+            for backend, breaker in self.breakers.items()
+        }
+        for key, outcomes in sorted(self.outcomes.items()):
+            backend, stage = key.split(":", 1)
+            status[backend]["stages"][stage] = {
+                "calls": len(outcomes),
+                "p50_seconds": latencies.quantile(key, 0.5, 1),
+                "p95_seconds": latencies.quantile(key, 0.95, 1),
+                "error_rate": self.error_rate(backend, stage),
+            }
+        return status
+
+
+router = Router()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from collections import deque
+from app.deadlines import Deadline, DeadlineExceeded
+
+# Article analyses share the Modal and Together capacity whoever asks for
+# them. The scheduler admits at most ANALYSIS_CONCURRENCY at a time and, when
+# they have to queue, picks the next one by weighted fair queueing between
+# the priority classes, so backfills and the crawler get a share of the
+# capacity without starving users.
+PRIORITY_WEIGHTS = {
+    "interactive": 8,  # POST /articles/analyze
+    "prefetch": 2,  # the crawler
+    "backfill": 1,  # cli.py ingest and migrations
+}
+ANALYSIS_CONCURRENCY = int(os.environ.get("ANALYSIS_CONCURRENCY", "32"))
+# slots only the interactive class may use, so that a user request never
+# waits for a backfill analysis to finish
+INTERACTIVE_RESERVED = int(os.environ.get("INTERACTIVE_RESERVED", "8"))
+WINDOW = 1000
+
+
+class _Waiter:
+    def __init__(self, priority: str, finish: float):
+        self.priority = priority
+        self.finish = finish
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class PriorityScheduler:
+    """
+    Weighted fair queueing over the priority classes: each queued analysis
+    gets a virtual finish time of max(now, its class's last finish) plus
+    1 / weight, and the queued analysis with the earliest finish time is
+    admitted next. Only interactive analyses may take the last
+    INTERACTIVE_RESERVED slots.
+    """
+
+    def __init__(
+        self,
+        capacity: int = ANALYSIS_CONCURRENCY,
+        reserved: int = INTERACTIVE_RESERVED,
+        weights: dict[str, float] = PRIORITY_WEIGHTS,
+    ):
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.weights = dict(weights)
+        self.in_flight = {priority: 0 for priority in weights}
+        self.queues: dict[str, deque[_Waiter]] = {p: deque() for p in weights}
+        self.virtual_time = 0.0
+        self.last_finish = {priority: 0.0 for priority in weights}
+        self.waits = {priority: deque(maxlen=WINDOW) for priority in weights}
+        self.admitted = {priority: 0 for priority in weights}
+        self.expired = {priority: 0 for priority in weights}
+
+    def _limit(self, priority: str) -> int:
+        if priority == "interactive":
+            return self.capacity
+        return self.capacity - self.reserved
+
+    def _dispatch(self) -> None:
+        while True:
+            total = sum(self.in_flight.values())
+            heads = [
+                queue[0]
+                for priority, queue in self.queues.items()
+                if queue and total < self._limit(priority)
+            ]
+            if not heads:
+                return
+            waiter = min(heads, key=lambda w: w.finish)
+            self.queues[waiter.priority].popleft()
+            self.virtual_time = waiter.finish
+            self.in_flight[waiter.priority] += 1
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority: str, deadline: Deadline | None = None) -> float:
+        """
+        Wait until an analysis of the priority class may start.
+        Returns the seconds spent queueing.
+        Raises:
+            DeadlineExceeded: If the deadline passed while queueing.
+        """
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority {priority}")
+
+        start = max(self.virtual_time, self.last_finish[priority])
+        self.last_finish[priority] = start + 1 / self.weights[priority]
+        waiter = _Waiter(priority, self.last_finish[priority])
+        self.queues[priority].append(waiter)
+        self._dispatch()
+
+        try:
+            if deadline:
+                await asyncio.wait_for(
+                    asyncio.shield(waiter.future), deadline.remaining()
+                )
+            else:
+                await waiter.future
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(priority)
+            else:
+                waiter.future.cancel()
+                self.queues[priority].remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired[priority] += 1
+                raise DeadlineExceeded("queue", time.monotonic() - waiter.enqueued_at)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        self.waits[priority].append(waited)
+        self.admitted[priority] += 1
+        return waited
+
+    def release(self, priority: str) -> None:
+        self.in_flight[priority] -= 1
+        self._dispatch()
+
+    def slot(self, priority: str, deadline: Deadline | None = None):
+        """
+        async with scheduler.slot("backfill"): ...
+        """
+        return _SchedulerSlot(self, priority, deadline)
+
+    def stats(self) -> dict:
+        stats = {}
+        for priority in self.weights:
+            waits = sorted(self.waits[priority])
+            stats[priority] = {
+                "weight": self.weights[priority],
+                "in_flight": self.in_flight[priority],
+                "queued": len(self.queues[priority]),
+                "admitted": self.admitted[priority],
+                "expired_in_queue": self.expired[priority],
+                "mean_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait_seconds": (
+                    waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+                ),
+                "max_wait_seconds": waits[-1] if waits else 0.0,
+            }
+        return {
+            "capacity": self.capacity,
+            "interactive_reserved": self.reserved,
+            "classes": stats,
+        }
+
+
+class _SchedulerSlot:
+    def __init__(self, scheduler: PriorityScheduler, priority: str, deadline):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.deadline = deadline
+
+    async def __aenter__(self) -> float:
+        return await self.scheduler.acquire(self.priority, self.deadline)
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        self.scheduler.release(self.priority)
+        return False
+
+
+scheduler = PriorityScheduler()
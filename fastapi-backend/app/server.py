@@ -1,266 +1,628 @@
-import modal
 import asyncio
+from datetime import datetime, timezone
 from fastapi import HTTPException
-from newspaper import Article
 
 
-from app.ml_newsly import (
-    llm_summarize,
-    political_lean,
-    extract_topics,
-    contextualize_article,
-    get_logical_fallacies,
-    get_combined_logical_fallacies,
-    lean_explanation,
+from app.utils import (
+    normalize_url,
+    legacy_normalize_url,
+    parse_article,
+    NewslyArticle,
 )
-from app.utils import normalize_url, parse_article, NewslyArticle
 from app.db import (
     get_article_by_url,
+    get_article_by_id,
+    get_article_fingerprints,
+    get_article_embeddings,
+    get_article_previews,
+    add_article_aliases,
     increment_article_read_count,
     add_article_to_db,
     update_article,
+    load_article_text,
+    load_article_internals,
 )
-import app.prompts as prompts
-from app.newsly_types import (
-    LogicalFallacyComplete,
-    LogicalFallacyServerList,
-    LogicalFallacyServer,
+from app.canonical import fetch_url
+from app.dedup import NearDuplicateIndex, NEAR_DUPLICATE_THRESHOLD
+from app.related import RelatedArticlesIndex
+from app.token_budget import article_view, token_report
+from app.pipeline import Stage, StageContext, run_stages
+from app.backends import InferenceBackend, get_backends
+from app.routing import BackendError
+from app.deadlines import Deadline, DeadlineExceeded
+from app.scheduler import scheduler
+from app.fetch_cache import fetch_html
+from app.text_store import text_hash
+from app.versions import stamp
+from app.tracing import current_span, traced
+from app.tagging import (
+    TagClassifier,
+    tag_label_texts,
+    VALID_TAGS,
+    TAG_MARGIN_THRESHOLD,
+    TAG_LLM_FALLBACK,
 )
 
-modal_summarize = modal.Function.from_name("newsly-modal-test", "summarize")
-modal_political_lean_and_explanation = modal.Function.from_name(
-    "newsly-modal-test", "political_lean_with_explanation"
-)
-modal_extract_topics = modal.Function.from_name("newsly-modal-test", "extract_topics")
-modal_get_keywords = modal.Function.from_name("newsly-modal-test", "get_keywords")
-modal_get_tag = modal.Function.from_name("newsly-modal-test", "get_tag")
-modal_contextualize_article = modal.Function.from_name(
-    "newsly-modal-test", "contextualize_article"
-)
-modal_lean_explanation = modal.Function.from_name(
-    "newsly-modal-test", "lean_explanation"
-)
-modal_get_logical_fallacies = modal.Function.from_name(
-    "newsly-modal-test", "get_logical_fallacies"
-)
-modal_extract_topics_and_contextualize = modal.Function.from_name(
-    "newsly-modal-test", "extract_topics_and_contextualize"
+# fields produced by analyze_article, copied over when reusing a near-duplicate's analysis
+ANALYSIS_FIELDS = (
+    "summary",
+    "lean",
+    "lean_explanation",
+    "topics",
+    "keywords",
+    "tag",
+    "contextualization",
+    "logical_fallacies",
+    "embedding",
+    "stage_versions",
 )
 
-NO_MODAL = False
+near_duplicate_index: NearDuplicateIndex | None = None
+related_articles_index: RelatedArticlesIndex | None = None
+# zero-shot tag classifiers, by the backend whose embeddings they use
+tag_classifiers: dict[str, TagClassifier] = {}
+
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """
+    Get the near-duplicate index, loading the stored fingerprints on first use.
+    """
+    global near_duplicate_index
+    if near_duplicate_index is None:
+        index = NearDuplicateIndex(NEAR_DUPLICATE_THRESHOLD)
+        for article_id, fingerprint in get_article_fingerprints():
+            index.add(article_id, fingerprint)
+        print(f"Loaded {len(index)} article fingerprints")
+        near_duplicate_index = index
+    return near_duplicate_index
+
 
+def get_related_articles_index() -> RelatedArticlesIndex:
+    """
+    Get the related-articles index, loading the stored embeddings on first use.
+    """
+    global related_articles_index
+    if related_articles_index is None:
+        index = RelatedArticlesIndex()
+        for article_id, embedding in get_article_embeddings():
+            index.add(article_id, embedding)
+        print(f"Loaded {len(index)} article embeddings")
+        related_articles_index = index
+    return related_articles_index
 
-async def get_modal_logical_fallacies(text: str) -> LogicalFallacyComplete:
+
+def index_article(article: NewslyArticle) -> None:
     """
-    Get all logical fallacies using Modal functions.
+    Add a stored article to the in-memory near-duplicate and related-articles indexes.
     """
-    # Define all fallacy types with their prompts and system messages
-    fallacy_configs = {
-        "ad_hominem": {
-            "prompt": prompts.ad_hominem,
-            "system_message": "You are a helpful assistant that identifies ad hominem attacks in text.",
-        },
-        "discrediting_sources": {
-            "prompt": prompts.discrediting_sources,
-            "system_message": "You are a helpful assistant that identifies discrediting sources in text.",
-        },
-        "emotion_fallacy": {
-            "prompt": prompts.emotion_fallacy,
-            "system_message": "You are a helpful assistant that identifies emotion fallacy in text.",
-        },
-        "false_dichotomy": {
-            "prompt": prompts.false_dichotomy_fallacy,
-            "system_message": "You are a helpful assistant that identifies false dichotomies in text.",
-        },
-        "fear_mongering": {
-            "prompt": prompts.fear_mongering_fallacy,
-            "system_message": "You are a helpful assistant that identifies fear mongering in text.",
-        },
-        "good_sources": {
-            "prompt": prompts.good_sources,
-            "system_message": "You are a helpful assistant that identifies good sources in text.",
-        },
-        "non_sequitur": {
-            "prompt": prompts.non_sequitur,
-            "system_message": "You are a helpful assistant that identifies non-sequiturs in text.",
-        },
-        "presenting_other_side": {
-            "prompt": prompts.presenting_other_side,
-            "system_message": "You are a helpful assistant that identifies presenting the other side in text.",
-        },
-        "scapegoating": {
-            "prompt": prompts.scapegoating,
-            "system_message": "You are a helpful assistant that identifies scapegoating in text.",
-        },
+    if not article or not article.id:
+        return
+    get_near_duplicate_index().add(article.id, article.fingerprint)
+    get_related_articles_index().add(article.id, article.embedding)
+
+
+def get_related_articles(article_id: str, k: int = 5) -> list[dict] | None:
+    """
+    Get the k articles whose embeddings are closest to the given article's,
+    e.g. other outlets' coverage of the same story.
+    Returns None if the article is unknown or has no embedding.
+    """
+    index = get_related_articles_index()
+    embedding = index.get_vector(article_id)
+    if embedding is None:
+        article = get_article_by_id(article_id)
+        if article:
+            load_article_internals(article)
+        if not article or not article.embedding:
+            return None
+        embedding = article.embedding
+
+    matches = index.search(embedding, k, exclude={article_id})
+    previews = {
+        preview["id"]: preview
+        for preview in get_article_previews([match_id for match_id, _ in matches])
     }
+    return [
+        {**previews[match_id], "similarity": similarity}
+        for match_id, similarity in matches
+        if match_id in previews
+    ]
 
-    # Create async tasks for all fallacy types
-    tasks = []
-    for fallacy_type, config in fallacy_configs.items():
-        task = modal_get_logical_fallacies.remote.aio(
-            text, fallacy_type, config["prompt"]
-        )
-        tasks.append((fallacy_type, task))
-
-    # Wait for all tasks to complete
-    results = {}
-    for fallacy_type, task in tasks:
-        try:
-            result = await task
-            # Convert the result to LogicalFallacyServerList
-            logical_fallacies = []
-            if result.get("logical_fallacies"):
-                for fallacy in result["logical_fallacies"]:
-                    logical_fallacies.append(
-                        LogicalFallacyServer(
-                            reason=fallacy["reason"],
-                            quote=fallacy["quote"],
-                            rating=fallacy["rating"],
-                            explanation=fallacy["explanation"],
-                        )
-                    )
-
-            results[fallacy_type] = LogicalFallacyServerList(
-                logical_fallacies=logical_fallacies, error=result.get("error")
-            )
-        except Exception as e:
-            print(f"Error processing {fallacy_type}: {e}")
-            results[fallacy_type] = LogicalFallacyServerList(
-                logical_fallacies=[], error=str(e)
-            )
 
-    # Create LogicalFallacyComplete object
-    return LogicalFallacyComplete(
-        ad_hominem=results["ad_hominem"],
-        discrediting_sources=results["discrediting_sources"],
-        emotion_fallacy=results["emotion_fallacy"],
-        false_dichotomy=results["false_dichotomy"],
-        fear_mongering=results["fear_mongering"],
-        good_sources=results["good_sources"],
-        non_sequitur=results["non_sequitur"],
-        presenting_other_side=results["presenting_other_side"],
-        scapegoating=results["scapegoating"],
+def is_analyzed(article: NewslyArticle) -> bool:
+    return bool(
+        article.summary
+        and article.lean
+        and article.lean_explanation
+        and article.topics
+        and article.contextualization
+        and article.logical_fallacies
     )
 
 
-async def analyze_article(article: NewslyArticle, no_modal: bool = NO_MODAL) -> None:
+def find_analyzed_near_duplicate(article: NewslyArticle) -> NewslyArticle | None:
     """
-    Analyze an article. It will set the properties of the article to the result of the analysis.
+    Find an already analyzed article with (nearly) the same text, e.g. the same
+    wire story published under another outlet's URL.
     """
+    for article_id, similarity in get_near_duplicate_index().query(article.fingerprint):
+        duplicate = get_article_by_id(article_id)
+        if duplicate and is_analyzed(duplicate):
+            print(f"Found near-duplicate {article_id} (similarity {similarity:.2f})")
+            return duplicate
+    return None
 
-    print("Analyzing article")
-    if no_modal:
-        print("Running no modal")
-        summary = await llm_summarize(article.text)
-        lean = await political_lean(article.text)
-        topics = await extract_topics(article.text)
-        logical_fallacies = await get_combined_logical_fallacies(article.text)
-        lean_explanation_text = await lean_explanation(
-            article.text,
-            lean["predicted_lean"],
-            lean["probabilities"][lean["predicted_lean"]],
-        )
-        predicted_lean = lean["predicted_lean"]
-        lean_probability = lean["probabilities"][lean["predicted_lean"]]
-    else:
-        print("Running modal")
-        summary = modal_summarize.remote.aio(article.text)
-        lean_and_explanation = modal_political_lean_and_explanation.remote.aio(
-            article.text
+
+def copy_analysis(source: NewslyArticle, target: NewslyArticle) -> None:
+    for field_name in ANALYSIS_FIELDS:
+        setattr(target, field_name, getattr(source, field_name))
+
+
+async def get_tag_classifier(backend: InferenceBackend) -> TagClassifier | None:
+    """
+    Get the zero-shot tag classifier for the backend's embeddings, embedding
+    the tag labels on first use.
+    """
+    if backend.name not in tag_classifiers:
+        label_embeddings = await backend.embed_texts(tag_label_texts())
+        if not label_embeddings:
+            return None
+        tag_classifiers[backend.name] = TagClassifier(label_embeddings)
+    return tag_classifiers[backend.name]
+
+
+async def classify_tag(
+    text: str,
+    embedding: list[float],
+    embedder: InferenceBackend,
+    tagger: InferenceBackend,
+) -> str:
+    """
+    Tag the article by comparing its embedding (made by embedder) with the
+    tag label embeddings. Only ambiguous articles (margin below
+    TAG_MARGIN_THRESHOLD) go to the tagger's LLM, if TAG_LLM_FALLBACK is set
+    and the tagger has one.
+    """
+    tag = ""
+    classifier = await get_tag_classifier(embedder) if embedding else None
+    if classifier:
+        tag, margin = classifier.classify([embedding])[0]
+        if margin >= TAG_MARGIN_THRESHOLD:
+            return tag
+        print(f"Ambiguous tag {tag} (margin {margin:.3f})")
+
+    if TAG_LLM_FALLBACK and tagger.supports("llm_tag"):
+        llm_tag = await tagger.llm_tag(text)
+        if llm_tag in VALID_TAGS:
+            tag = llm_tag
+
+    return tag
+
+
+def view(context: StageContext, backend: InferenceBackend, stage: str) -> str:
+    """
+    The article text as the stage can consume it on the given backend.
+    """
+    return article_view(context.article, backend.views.get(stage, stage))
+
+
+async def compute_token_budget(context: StageContext, backend: InferenceBackend):
+    # tokenize once with every stage's tokenizer; the stages then get text
+    # that already fits instead of each re-tokenizing the full article
+    context.article.token_budget = await backend.token_budget(context.article.text)
+    return context.article.token_budget
+
+
+async def explain_lean(context: StageContext, backend: InferenceBackend) -> str:
+    lean = context.results["lean"]
+    predicted_lean = lean["predicted_lean"]
+    return await backend.lean_explanation(
+        view(context, backend, "lean_and_explanation"),
+        predicted_lean,
+        lean["probabilities"].get(predicted_lean, 0.0),
+    )
+
+
+async def embed_article(context: StageContext, backend: InferenceBackend) -> list:
+    embedding = await backend.embed_article(context.article.text)
+    if not embedding:
+        # stored, it would leave the article untagged and out of the related
+        # articles index under a current version; let the router fail over
+        raise BackendError(f"Empty embedding from {backend.name}")
+    return embedding
+
+
+async def tag_article(context: StageContext, backend: InferenceBackend) -> str:
+    embedder_name = context.backends.get("embedding")
+    if embedder_name is None:
+        # an embedding restored from the article, see analyze_article's only
+        stored = (context.article.stage_versions or {}).get("embedding") or {}
+        embedder_name = stored.get("backend") or backend.name
+    return await classify_tag(
+        context.article.text,
+        context.results["embedding"],
+        get_backends((embedder_name,))[embedder_name],
+        backend,
+    )
+
+
+# The analysis pipeline: (stage, backend method the stage needs, call, options
+# of the Stage).
+# Each stage starts as soon as its dependencies are done, on the backend the
+# router picks among those implementing the method. Modal computes lean with
+# its explanation and topics with their contextualization in one call each,
+# so on Modal the second stage just reuses the first's result.
+ANALYSIS_STAGES = [
+    (
+        "token_budget",
+        "token_budget",
+        compute_token_budget,
+        dict(
+            reuse=lambda context: context.article.token_budget or None,
+            optional=True,
+        ),
+    ),
+    (
+        "summary",
+        "summarize",
+        lambda context, backend: backend.summarize(view(context, backend, "summary")),
+        dict(deps=("token_budget",)),
+    ),
+    (
+        "lean",
+        "political_lean",
+        lambda context, backend: backend.political_lean(view(context, backend, "lean")),
+        dict(deps=("token_budget",)),
+    ),
+    (
+        "lean_explanation",
+        "lean_explanation",
+        explain_lean,
+        dict(
+            deps=("lean",),
+            reuse=lambda context: context.results["lean"].get("explanation"),
+        ),
+    ),
+    (
+        "topics",
+        "extract_topics",
+        lambda context, backend: backend.extract_topics(
+            view(context, backend, "topics_and_contextualization")
+        ),
+        dict(deps=("token_budget",)),
+    ),
+    (
+        "contextualization",
+        "contextualize",
+        lambda context, backend: backend.contextualize(
+            view(context, backend, "topics_and_contextualization"),
+            context.results["topics"]["topics"],
+        ),
+        dict(
+            deps=("topics",),
+            reuse=lambda context: context.results["topics"].get("contextualization"),
+        ),
+    ),
+    (
+        "logical_fallacies",
+        "logical_fallacies",
+        lambda context, backend: backend.logical_fallacies(
+            view(context, backend, "logical_fallacies"), context.deadline
+        ),
+        # already nine concurrent calls, so not hedged
+        dict(deps=("token_budget",), hedge=False),
+    ),
+    # embeddings and keywords use the full text, sentence by sentence
+    (
+        "embedding",
+        "embed_article",
+        embed_article,
+        {},
+    ),
+    # any backend can tag, with the embedder's label embeddings
+    ("tag", None, tag_article, dict(deps=("embedding",))),
+    (
+        "keywords",
+        "keywords",
+        lambda context, backend: backend.keywords(context.article.text),
+        dict(deps=("embedding",), optional=True),
+    ),
+]
+
+
+# stage -> the stages it depends on
+STAGE_DEPS = {name: options.get("deps", ()) for name, _, _, options in ANALYSIS_STAGES}
+
+# stages whose result can be rebuilt from the stored article (field, result
+# from the field's value), so that re-running a later stage doesn't re-run them
+RESTORABLE_STAGES = {
+    "token_budget": ("token_budget", lambda value: value or None),
+    "topics": ("topics", lambda value: {"topics": value} if value else None),
+    "embedding": ("embedding", lambda value: value or None),
+}
+
+
+def restored_stage(name: str, article: NewslyArticle) -> Stage:
+    """
+    A stage that returns its result from the stored article instead of running.
+    """
+    if name not in RESTORABLE_STAGES:
+        raise ValueError(f"Stage {name} can't be restored from the article")
+    field_name, restore = RESTORABLE_STAGES[name]
+    result = restore(getattr(article, field_name))
+    if result is None:
+        raise ValueError(f"Article has no {field_name} to restore stage {name}")
+    return Stage(name, {}, reuse=lambda context: result)
+
+
+def analysis_stages(
+    backends: dict[str, InferenceBackend],
+    only: set[str] | None = None,
+    article: NewslyArticle | None = None,
+) -> list[Stage]:
+    """
+    The ANALYSIS_STAGES DAG, with calls for every backend that implements each
+    stage. With only, the other stages the DAG needs are restored from the
+    article rather than run, and the rest are left out.
+    """
+    stages = [
+        Stage(
+            name,
+            {
+                backend_name: (
+                    lambda context, call=call, backend=backend: call(context, backend)
+                )
+                for backend_name, backend in backends.items()
+                if method is None or backend.supports(method)
+            },
+            **options,
         )
-        topics_contextualization = modal_extract_topics_and_contextualize.remote.aio(
-            article.text
+        for name, method, call, options in ANALYSIS_STAGES
+    ]
+    if only is None:
+        return stages
+
+    needed = {dep for name in only for dep in STAGE_DEPS[name]} - only
+    return [stage for stage in stages if stage.name in only] + [
+        restored_stage(name, article) for name in needed
+    ]
+
+
+def apply_results(article: NewslyArticle, run) -> None:
+    """
+    Set the article fields from the results of a pipeline run, and stamp the
+    version of each stage that produced one.
+    """
+    results = run.results
+    if "summary" in results:
+        article.summary = results["summary"]
+    if "lean" in results:
+        article.lean = results["lean"]["predicted_lean"]
+    if "lean_explanation" in results:
+        article.lean_explanation = results["lean_explanation"]
+    if "topics" in results:
+        article.topics = results["topics"]["topics"]
+    if results.get("keywords") is not None:
+        article.keywords = results["keywords"]
+    if "tag" in results:
+        article.tag = results["tag"]
+    if "contextualization" in results:
+        article.contextualization = results["contextualization"]
+    if "logical_fallacies" in results:
+        article.logical_fallacies = results["logical_fallacies"]
+    if "embedding" in results:
+        article.embedding = results["embedding"]
+
+    stage_versions = dict(article.stage_versions or {})
+    for name, backend in run.backends.items():
+        if results.get(name) is None:
+            continue
+        reused = run.timings[name].backend == "reused"
+        stage_versions[name] = stamp(
+            name, backend, STAGE_DEPS[name][0] if reused else None
         )
-        keywords = modal_get_keywords.remote.aio(article.text)
-        tag = modal_get_tag.remote.aio(article.text)
-        logical_fallacies = get_logical_fallacies(article.text)
-        # context got combined into topics
-        # contextualization = modal_contextualize_article.remote.aio(article.text)
-        (
-            summary,
-            lean_and_explanation,
-            topics_contextualization,
-            keywords,
-            tag,
-            logical_fallacies,
-        ) = await asyncio.gather(
-            summary,
-            lean_and_explanation,
-            topics_contextualization,
-            keywords,
-            tag,
-            logical_fallacies,
-            # contextualization,
+    article.stage_versions = stage_versions
+
+
+@traced()
+async def analyze_article(
+    article: NewslyArticle,
+    no_modal: bool = False,
+    deadline: Deadline | None = None,
+    backends: tuple[str, ...] | None = None,
+    priority: str = "interactive",
+    only: set[str] | None = None,
+) -> None:
+    """
+    Analyze an article. It will set the properties of the article to the result of the analysis.
+    The analysis first queues for a slot in the scheduler under its priority
+    class (interactive, prefetch or backfill); the wait counts against the
+    deadline.
+    Runs the ANALYSIS_STAGES with each stage routed to one of the enabled
+    backends (INFERENCE_BACKENDS, the given backends, or only Together if
+    no_modal is set) under its own deadline, capped by the request deadline;
+    if a stage fails on every backend or times out, the others are cancelled.
+    With only, just those stages are run (see app.reanalysis); their
+    dependencies come from the article's stored results.
+    Raises:
+        DeadlineExceeded: If a stage did not finish in time.
+    """
+
+    if no_modal:
+        backends = ("together",)
+    if not article.text:
+        # articles read from the database come without their text
+        await asyncio.to_thread(load_article_text, article)
+    if article.id:
+        # nor the stored stage versions and token budget the stages build on
+        await asyncio.to_thread(load_article_internals, article)
+    if only is not None and "token_budget" in only:
+        # otherwise the stage reuses the stored budget
+        article.token_budget = {}
+    stages = analysis_stages(get_backends(backends), only, article)
+    async with scheduler.slot(priority, deadline) as waited:
+        print(f"Analyzing article ({priority}, queued {waited:.1f}s)")
+        current_span().add_event(
+            "scheduler slot acquired", **{"scheduler.wait_seconds": waited}
         )
-        #  combined with modal_political_lean
-        lean_explanation_text = lean_and_explanation["explanation"]
-        predicted_lean = lean_and_explanation["predicted_lean"]
-        lean_probability = lean_and_explanation["probabilities"]
-
-        # lean_explanation_text = await modal_lean_explanation.remote.aio(
-        #     article.text,
-        #     lean["predicted_lean"],
-        #     lean["probabilities"][lean["predicted_lean"]],
-        # )
-
-    topics = topics_contextualization["topics"]
-    contextualization = topics_contextualization["contextualization"]
-
-    # set the properties of the article to the result of the analysis
-    article.summary = summary
-    article.lean = predicted_lean
-    article.lean_explanation = lean_explanation_text
-    article.topics = topics
-    article.keywords = keywords
-    article.tag = tag
-    article.contextualization = contextualization
-    article.logical_fallacies = logical_fallacies
-
-
-async def process_article_db(url: str, cache=True) -> NewslyArticle | None:
+        run = await run_stages(stages, article, deadline)
+    print(run.report())
+    if article.token_budget:
+        print(token_report(article))
+
+    apply_results(article, run)
+
+
+async def analyze_article_within_deadline(
+    article: NewslyArticle, deadline: Deadline, priority: str = "interactive"
+) -> None:
+    try:
+        await analyze_article(article, deadline=deadline, priority=priority)
+    except DeadlineExceeded as e:
+        print(f"Analysis timed out: {e}")
+        raise HTTPException(status_code=504, detail=f"Analysis timed out: {e}")
+
+
+@traced()
+async def process_article_db(
+    url: str,
+    cache=True,
+    near_duplicates=True,
+    deadline: Deadline | None = None,
+    writer=None,
+    priority: str = "interactive",
+    count_read: bool = True,
+) -> NewslyArticle | None:
     """
     Analyze an article from the given URL.
+    If near_duplicates is set, a new article whose text matches an already
+    analyzed one reuses that analysis instead of running the pipeline.
+    The analysis must finish before the deadline (REQUEST_DEADLINE by default).
+    With a writer (see ingest.BatchWriter), caching the article is left to
+    the writer, which batches the database writes; the returned article is
+    then not stored yet. priority is the scheduler class of the analysis.
+    count_read is off for callers that aren't a reader (the crawler).
     """
+    if deadline is None:
+        deadline = Deadline()
+    current_span().set_attribute("url.full", url)
+
     # Check if the article is already in the database
+    requested_url = url
     url = normalize_url(url)
     article = get_article_by_url(url)
 
+    if not article and legacy_normalize_url(requested_url) != url:
+        # articles stored before URL canonicalization are keyed the old way
+        article = get_article_by_url(legacy_normalize_url(requested_url))
+        if article:
+            add_article_aliases(article.id, [url])
+
+    parsed_article = None
+    if not article:
+        # parse article
+        # parsing fetches the page; keep the event loop free meanwhile. The
+        # page is fetched as requested, the canonical URL is only the key
+        parsed_article = await asyncio.to_thread(
+            parse_article, fetch_url(requested_url)
+        )
+
+        if not parsed_article:
+            raise HTTPException(
+                status_code=404, detail="Article not found or not supported"
+            )
+
+        # the page's rel=canonical link may resolve to an article we already have
+        if parsed_article.url != url:
+            article = get_article_by_url(parsed_article.url)
+            if article:
+                add_article_aliases(article.id, [url])
+
     if article:  # If the article is already in the database, increment the read count
-        increment_article_read_count(article.id, article.read_count)
+        if count_read:
+            increment_article_read_count(article.id, article.read_count)
 
         # If the article is already analyzed, return it
-        if (
-            article.summary
-            and article.lean
-            and article.lean_explanation
-            and article.topics
-            and article.contextualization
-            and article.logical_fallacies
-        ):
+        if is_analyzed(article):
             print("Article already analyzed")
             return article
         else:
             print("Article not analyzed yet, analyzing it now")
-            await analyze_article(article)
+            await analyze_article_within_deadline(article, deadline, priority)
 
-            if cache:
+            if cache and writer:
+                writer.update(url, article)
+            elif cache:
                 print("Caching article to db")
                 article = update_article(article)
+                index_article(article)
     else:
-        # parse article
-        article = parse_article(url)
-
-        if not article:
-            raise HTTPException(
-                status_code=404, detail="Article not found or not supported"
-            )
+        article = parsed_article
 
-        # Analyze article
-        await analyze_article(article)
+        duplicate = find_analyzed_near_duplicate(article) if near_duplicates else None
+        if duplicate:
+            print("Reusing analysis of near-duplicate article")
+            copy_analysis(duplicate, article)
+        else:
+            # Analyze article
+            await analyze_article_within_deadline(article, deadline, priority)
 
         # Add article to the database
-        if cache:
+        if cache and writer:
+            writer.insert(url, article, aliases=[url])
+        elif cache:
             print("Caching article to db")
             article = add_article_to_db(article)
+            index_article(article)
+            if article and article.id and article.url != url:
+                add_article_aliases(article.id, [url])
 
     return article
+
+
+# the fields parse_article sets, replaced when a refetched page's text changed
+PARSED_FIELDS = (
+    "title",
+    "text",
+    "authors",
+    "image_url",
+    "published_date",
+    "images",
+    "movies",
+    "fingerprint",
+)
+
+
+@traced()
+async def refresh_article(
+    article: NewslyArticle,
+    deadline: Deadline | None = None,
+    priority: str = "backfill",
+) -> str:
+    """
+    Re-fetch a stored article's page, conditionally if it is in the fetch
+    cache, and re-analyze and store it only if its text changed.
+    Returns:
+        str: "not_modified" if the publisher answered 304 (nothing is parsed
+            or analyzed), "unchanged" if the text is the same, or "changed".
+    """
+    url = article.source_url or article.url
+    fetched = await asyncio.to_thread(fetch_html, url)
+    if fetched.not_modified:
+        return "not_modified"
+
+    parsed = await asyncio.to_thread(parse_article, url, fetched.html)
+    stored_hash = article.text_hash or text_hash(
+        await asyncio.to_thread(load_article_text, article)
+    )
+    if text_hash(parsed.text) == stored_hash:
+        return "unchanged"
+
+    print(f"Text of {article.url} changed, re-analyzing it")
+    for field_name in PARSED_FIELDS:
+        setattr(article, field_name, getattr(parsed, field_name))
+    article.token_budget = {}
+    await analyze_article(article, deadline=deadline, priority=priority)
+    article.last_analyzed_at = datetime.now(timezone.utc).isoformat()
+    index_article(await asyncio.to_thread(update_article, article))
+    return "changed"
@@ -0,0 +1,371 @@
+import json
+import os
+import sqlite3
+import threading
+import typing
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import fields
+from datetime import date, datetime, timezone
+
+from dotenv import load_dotenv
+
+from app.newsly_types import NewslyArticle
+
+load_dotenv()
+
+# Where app.db keeps the articles: "supabase" (the production database) or
+# "sqlite" (a local file at SQLITE_PATH, for development, benchmarks and
+# single-node deployments).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "newsly.db")
+
+# A filter is (column, op, value) with op one of "eq", "in", "gt" or
+# "not_null" (value ignored), the subset of PostgREST app.db needs.
+Filter = tuple[str, str, typing.Any]
+
+
+class Store(ABC):
+    """
+    Table-level operations app.db is written against. Rows are dicts of
+    JSON values, as Supabase returns them (timestamps as ISO strings).
+    """
+
+    name = ""
+
+    @abstractmethod
+    def select(
+        self,
+        table: str,
+        columns: str = "*",
+        where: list[Filter] = (),
+        order: str | None = None,
+        limit: int | None = None,
+    ) -> list[dict]: ...
+
+    @abstractmethod
+    def insert(self, table: str, rows: list[dict]) -> list[dict]: ...
+
+    @abstractmethod
+    def upsert(
+        self,
+        table: str,
+        rows: list[dict],
+        on_conflict: str,
+        ignore_duplicates: bool = False,
+    ) -> list[dict]: ...
+
+    @abstractmethod
+    def update(self, table: str, values: dict, where: list[Filter]) -> list[dict]: ...
+
+    @abstractmethod
+    def delete(self, table: str, where: list[Filter]) -> list[dict]: ...
+
+
+class SupabaseStore(Store):
+    name = "supabase"
+
+    def __init__(self, url: str | None = None, key: str | None = None):
+        from supabase import create_client
+
+        self.client = create_client(
+            url or os.environ.get("SUPABASE_URL"),
+            key or os.environ.get("SUPABASE_SERVICE_KEY"),
+        )
+
+    @staticmethod
+    def _filter(query, where: list[Filter]):
+        for column, op, value in where:
+            if op == "eq":
+                query = query.eq(column, value)
+            elif op == "in":
+                query = query.in_(column, list(value))
+            elif op == "gt":
+                query = query.gt(column, value)
+            elif op == "not_null":
+                query = query.not_.is_(column, "null")
+            else:
+                raise ValueError(f"Unknown filter {op}")
+        return query
+
+    def select(self, table, columns="*", where=(), order=None, limit=None):
+        query = self._filter(self.client.table(table).select(columns), where)
+        if order:
+            query = query.order(order)
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    def insert(self, table, rows):
+        return self.client.table(table).insert(rows).execute().data or []
+
+    def upsert(self, table, rows, on_conflict, ignore_duplicates=False):
+        response = (
+            self.client.table(table)
+            .upsert(rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+            .execute()
+        )
+        return response.data or []
+
+    def update(self, table, values, where):
+        query = self._filter(self.client.table(table).update(values), where)
+        return query.execute().data or []
+
+    def delete(self, table, where):
+        query = self._filter(self.client.table(table).delete(), where)
+        return query.execute().data or []
+
+
+def _article_columns() -> dict[str, str]:
+    # the articles table follows NewslyArticle; lists, dicts and nested
+    # dataclasses are JSON columns
+    columns = {}
+    for f in fields(NewslyArticle):
+        if f.type is str:
+            columns[f.name] = "text"
+        elif f.type is int:
+            columns[f.name] = "integer"
+        elif f.type is datetime:
+            columns[f.name] = "timestamp"
+        else:
+            columns[f.name] = "json"
+    return columns
+
+
+# table: ({column: text | integer | timestamp | json}, primary key, indexes)
+SQLITE_TABLES = {
+    "articles": (
+        _article_columns(),
+        "id",
+        ["url", "created_at", "tag", "last_analyzed_at", "text_hash"],
+    ),
+    "article_aliases": (
+        {"url": "text", "article_id": "text"},
+        "url",
+        ["article_id"],
+    ),
+    "topic_backgrounds": (
+        {
+            "topic_key": "text",
+            "topic": "text",
+            "background": "text",
+            "updated_at": "timestamp",
+        },
+        "topic_key",
+        [],
+    ),
+    "article_texts": (
+        {"content_hash": "text", "codec": "text", "size": "integer", "data": "text"},
+        "content_hash",
+        [],
+    ),
+}
+# rows whose article is deleted go with it, as with the Postgres foreign key
+CASCADES = {"articles": [("article_aliases", "article_id", "id")]}
+
+
+def _encode(value, kind: str):
+    if value is None:
+        return None
+    if kind == "json":
+        return json.dumps(value, default=str)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        # e.g. the lean of articles from before it was a plain label
+        return json.dumps(value, default=str)
+    return value
+
+
+class SqliteStore(Store):
+    """
+    The same tables in one SQLite file, JSON columns stored as text. Tables,
+    indexes and columns added to NewslyArticle are created on open.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        # app.db is called from worker threads too (asyncio.to_thread)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("pragma journal_mode = wal")
+            for table, (columns, key, indexes) in SQLITE_TABLES.items():
+                self._create(table, columns, key, indexes)
+
+    def _create(self, table: str, columns: dict, key: str, indexes: list[str]):
+        definitions = ", ".join(
+            f'"{column}"' + (" primary key" if column == key else "")
+            for column in columns
+        )
+        self.connection.execute(f'create table if not exists "{table}" ({definitions})')
+        existing = {
+            row["name"]
+            for row in self.connection.execute(f'pragma table_info("{table}")')
+        }
+        for column in columns:
+            if column not in existing:
+                self.connection.execute(f'alter table "{table}" add column "{column}"')
+        for column in indexes:
+            self.connection.execute(
+                f'create index if not exists "{table}_{column}" on "{table}" ("{column}")'
+            )
+
+    def _columns(self, table: str) -> dict[str, str]:
+        if table not in SQLITE_TABLES:
+            raise ValueError(f"Unknown table {table}")
+        return SQLITE_TABLES[table][0]
+
+    def _check(self, table: str, columns) -> None:
+        unknown = [column for column in columns if column not in self._columns(table)]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} of {table}")
+
+    def _where(self, table: str, where: list[Filter]) -> tuple[str, list]:
+        columns = self._columns(table)
+        self._check(table, [column for column, _, _ in where])
+        clauses, params = [], []
+        for column, op, value in where:
+            kind = columns[column]
+            if op == "eq":
+                clauses.append(f'"{column}" = ?')
+                params.append(_encode(value, kind))
+            elif op == "in":
+                values = list(value)
+                clauses.append(f'"{column}" in ({", ".join("?" * len(values))})')
+                params += [_encode(v, kind) for v in values]
+            elif op == "gt":
+                clauses.append(f'"{column}" > ?')
+                params.append(_encode(value, kind))
+            elif op == "not_null":
+                clauses.append(f'"{column}" is not null')
+            else:
+                raise ValueError(f"Unknown filter {op}")
+        return (" where " + " and ".join(clauses)) if clauses else "", params
+
+    def _decode(self, table: str, row: sqlite3.Row) -> dict:
+        columns = self._columns(table)
+        decoded = {}
+        for column in row.keys():
+            value = row[column]
+            if value is not None and columns[column] == "json":
+                value = json.loads(value)
+            decoded[column] = value
+        return decoded
+
+    def _execute(self, table: str, sql: str, params: list) -> list[dict]:
+        with self.lock, self.connection:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [self._decode(table, row) for row in rows]
+
+    def _prepare(self, table: str, row: dict) -> dict:
+        columns = self._columns(table)
+        self._check(table, row)
+        row = {column: _encode(value, columns[column]) for column, value in row.items()}
+        if table == "articles":
+            # generated by the database in Postgres
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        return row
+
+    def select(self, table, columns="*", where=(), order=None, limit=None):
+        if columns.strip() == "*":
+            selected = list(self._columns(table))
+        else:
+            selected = [column.strip() for column in columns.split(",")]
+        self._check(table, selected + ([order] if order else []))
+        clause, params = self._where(table, where)
+        names = ", ".join(f'"{column}"' for column in selected)
+        sql = f'select {names} from "{table}"{clause}'
+        if order:
+            sql += f' order by "{order}"'
+        if limit:
+            sql += f" limit {int(limit)}"
+        return self._execute(table, sql, params)
+
+    def _insert(self, table: str, rows: list[dict], conflict=None) -> list[dict]:
+        stored = []
+        # one transaction for the batch
+        with self.lock, self.connection:
+            for row in rows:
+                row = self._prepare(table, row)
+                names = ", ".join(f'"{column}"' for column in row)
+                marks = ", ".join("?" * len(row))
+                sql = f'insert into "{table}" ({names}) values ({marks})'
+                if conflict:
+                    sql += conflict(row)
+                cursor = self.connection.execute(
+                    sql + " returning *", list(row.values())
+                )
+                stored += cursor.fetchall()
+        return [self._decode(table, row) for row in stored]
+
+    def insert(self, table, rows):
+        return self._insert(table, rows)
+
+    def upsert(self, table, rows, on_conflict, ignore_duplicates=False):
+        def conflict(row: dict) -> str:
+            if ignore_duplicates:
+                return f' on conflict ("{on_conflict}") do nothing'
+            updates = ", ".join(
+                f'"{column}" = excluded."{column}"'
+                for column in row
+                if column != on_conflict
+            )
+            return f' on conflict ("{on_conflict}") do update set {updates}'
+
+        return self._insert(table, rows, conflict)
+
+    def update(self, table, values, where):
+        columns = self._columns(table)
+        self._check(table, values)
+        values = {column: _encode(v, columns[column]) for column, v in values.items()}
+        assignments = ", ".join(f'"{column}" = ?' for column in values)
+        clause, params = self._where(table, where)
+        return self._execute(
+            table,
+            f'update "{table}" set {assignments}{clause} returning *',
+            list(values.values()) + params,
+        )
+
+    def delete(self, table, where):
+        clause, params = self._where(table, where)
+        deleted = self._execute(
+            table, f'delete from "{table}"{clause} returning *', params
+        )
+        for child, column, key in CASCADES.get(table, []):
+            keys = [row[key] for row in deleted]
+            if keys:
+                self.delete(child, [(column, "in", keys)])
+        return deleted
+
+
+STORE_CLASSES = {
+    "supabase": SupabaseStore,
+    "sqlite": SqliteStore,
+}
+_store: Store | None = None
+
+
+def get_store() -> Store:
+    """
+    The STORAGE_BACKEND store, opened on first use.
+    """
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND not in STORE_CLASSES:
+            raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND}")
+        _store = STORE_CLASSES[STORAGE_BACKEND]()
+    return _store
+
+
+def use_store(store: Store) -> None:
+    """
+    Make app.db use the given store, e.g. a SqliteStore(":memory:") in a benchmark.
+    """
+    global _store
+    _store = store
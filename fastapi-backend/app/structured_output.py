@@ -0,0 +1,131 @@
+import re
+from pydantic import ValidationError
+from app.newsly_types import TopicsAPI
+from app.tagging import VALID_TAGS
+import app.prompts as prompts
+
+# Constrained decoding for the Hugging Face text-generation pipelines: tokens
+# are filtered with lm-format-enforcer so the output is always a valid topics
+# JSON object or one of VALID_TAGS on the first pass. The unconstrained retry
+# loops are kept for scripts/benchmark_constrained_decoding.py.
+MAX_RETRIES = 3
+
+# the tags contain no regex metacharacters, so they can be joined as they are
+TAG_PATTERN = "(" + "|".join(VALID_TAGS) + ")"
+
+# tokenizer vocabularies preprocessed for lm-format-enforcer, per model
+_tokenizer_data = {}
+
+
+def topics_json_schema(n_topics: int) -> dict:
+    schema = TopicsAPI.model_json_schema()
+    schema["properties"]["topics"]["maxItems"] = n_topics
+    return schema
+
+
+def _prefix_allowed_tokens_fn(tokenizer, parser):
+    from lmformatenforcer.integrations.transformers import (
+        build_token_enforcer_tokenizer_data,
+        build_transformers_prefix_allowed_tokens_fn,
+    )
+
+    key = tokenizer.name_or_path
+    if key not in _tokenizer_data:
+        _tokenizer_data[key] = build_token_enforcer_tokenizer_data(tokenizer)
+    return build_transformers_prefix_allowed_tokens_fn(_tokenizer_data[key], parser)
+
+
+def parse_topics(output: str, n_topics: int) -> list[str] | None:
+    """
+    Parse {"topics": [...]} from the model output without evaluating it.
+    Returns None if there is no valid topics object in the output.
+    """
+    match = re.search(r"\{.*\}", output, re.DOTALL)
+    if not match:
+        return None
+    try:
+        topics = TopicsAPI.model_validate_json(match.group(0)).topics
+    except ValidationError:
+        return None
+    return [topic.strip() for topic in topics if topic.strip()][:n_topics]
+
+
+def generate_topics(
+    pipe, text: str, n_topics: int = 3, constrained: bool = True
+) -> tuple[list[str], int]:
+    """
+    Extract the main topics of the text.
+    Returns:
+        tuple[list[str], int]: The topics and the number of generations it took.
+    """
+    prompt = prompts.topics.format(text=text, n_topics=n_topics)
+
+    if constrained:
+        from lmformatenforcer import JsonSchemaParser
+
+        result = pipe(
+            prompt,
+            max_new_tokens=64,
+            do_sample=False,
+            return_full_text=False,
+            prefix_allowed_tokens_fn=_prefix_allowed_tokens_fn(
+                pipe.tokenizer, JsonSchemaParser(topics_json_schema(n_topics))
+            ),
+        )
+        return parse_topics(result[0]["generated_text"], n_topics) or [], 1
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        result = pipe(
+            prompt,
+            max_new_tokens=64,
+            do_sample=True,
+            return_full_text=False,
+        )
+        topics = parse_topics(result[0]["generated_text"], n_topics)
+        if topics is not None:
+            return topics, attempt
+        print(f"Invalid topics: {result[0]['generated_text']}, retrying...")
+
+    return [], MAX_RETRIES
+
+
+def generate_tag(pipe, text: str, constrained: bool = True) -> tuple[str, int]:
+    """
+    Pick one of VALID_TAGS for the text.
+    Returns:
+        tuple[str, int]: The tag ("N/A" if none) and the number of generations it took.
+    """
+    prompt = prompts.tag.format(text=text)
+
+    if constrained:
+        from lmformatenforcer import RegexParser
+
+        result = pipe(
+            prompt,
+            max_new_tokens=16,
+            do_sample=False,
+            return_full_text=False,
+            pad_token_id=pipe.tokenizer.eos_token_id,
+            prefix_allowed_tokens_fn=_prefix_allowed_tokens_fn(
+                pipe.tokenizer, RegexParser(TAG_PATTERN)
+            ),
+        )
+        tag = result[0]["generated_text"].strip()
+        return (tag if tag in VALID_TAGS else "N/A"), 1
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        result = pipe(
+            prompt,
+            max_new_tokens=10,
+            do_sample=True,
+            temperature=0.3,
+            return_full_text=False,
+            pad_token_id=pipe.tokenizer.eos_token_id,
+        )
+        tag = result[0]["generated_text"].split("\n")[0].strip()
+        tag = re.sub(r"^[^\w\s&]+|[^\w\s&]+$", "", tag)
+        if tag in VALID_TAGS:
+            return tag, attempt
+        print(f"Invalid tag: {tag}, retrying...")
+
+    return "N/A", MAX_RETRIES
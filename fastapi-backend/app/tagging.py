@@ -0,0 +1,87 @@
+import os
+import numpy as np
+
+# The fixed set of article tags shown in the feed
+VALID_TAGS = [
+    "Politics & Government",
+    "Business & Economy",
+    "Health & Science",
+    "Technology & Innovation",
+    "Social Issues & Inequality",
+    "Crime & Law",
+    "World Affairs",
+    "Environment & Climate",
+    "Culture & Entertainment",
+    "Sports",
+    "Education",
+    "Opinion & Editorial",
+    "Religion & Ethics",
+]
+
+# Embedded together with the tag name so the label vectors describe what
+# articles under each tag are actually about
+TAG_DESCRIPTIONS = {
+    "Politics & Government": "elections, campaigns, Congress, the White House, legislation, political parties and government policy",
+    "Business & Economy": "companies, markets, stocks, jobs, inflation, trade, earnings and the economy",
+    "Health & Science": "medicine, public health, diseases, hospitals, scientific research and discoveries",
+    "Technology & Innovation": "tech companies, software, artificial intelligence, gadgets, the internet and startups",
+    "Social Issues & Inequality": "civil rights, race, gender, poverty, housing, immigration and inequality",
+    "Crime & Law": "crime, police, arrests, courts, trials, lawsuits and the justice system",
+    "World Affairs": "international relations, foreign countries, war, diplomacy and global conflicts",
+    "Environment & Climate": "climate change, weather disasters, pollution, energy, wildlife and conservation",
+    "Culture & Entertainment": "movies, music, television, celebrities, art, books and pop culture",
+    "Sports": "games, teams, athletes, leagues, tournaments and sports results",
+    "Education": "schools, teachers, students, universities, colleges and education policy",
+    "Opinion & Editorial": "opinion columns, editorials, commentary and personal essays arguing a point of view",
+    "Religion & Ethics": "religion, faith, churches, religious leaders, morality and ethical debates",
+}
+
+# If the best tag beats the runner-up by less than this (cosine similarity),
+# the classification is ambiguous and the LLM tagger decides instead.
+TAG_MARGIN_THRESHOLD = float(os.environ.get("TAG_MARGIN_THRESHOLD", "0.02"))
+TAG_LLM_FALLBACK = bool(int(os.environ.get("TAG_LLM_FALLBACK", "1")))
+
+
+def tag_label_texts() -> list[str]:
+    """
+    The texts to embed for each tag, in VALID_TAGS order.
+    """
+    return [f"{tag}: news about {TAG_DESCRIPTIONS[tag]}" for tag in VALID_TAGS]
+
+
+class TagClassifier:
+    """
+    Zero-shot tag classifier: picks the tag whose label embedding is closest
+    (cosine similarity) to the article embedding.
+    """
+
+    def __init__(self, label_embeddings):
+        labels = np.asarray(label_embeddings, dtype=np.float32)
+        if labels.shape[0] != len(VALID_TAGS):
+            raise ValueError(
+                f"Expected {len(VALID_TAGS)} label embeddings, got {labels.shape[0]}"
+            )
+        self.labels = labels / np.linalg.norm(labels, axis=1, keepdims=True)
+
+    def classify(self, embeddings) -> list[tuple[str, float]]:
+        """
+        Classify a batch of article embeddings.
+        Args:
+            embeddings: An (n_articles, dim) array or list of embeddings.
+        Returns:
+            list[tuple[str, float]]: (tag, margin over the runner-up) per article.
+        """
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        scores = vectors @ self.labels.T
+
+        top_two = np.argsort(-scores, axis=1)[:, :2]
+        rows = np.arange(len(scores))
+        margins = scores[rows, top_two[:, 0]] - scores[rows, top_two[:, 1]]
+
+        return [
+            (VALID_TAGS[best], float(margin))
+            for best, margin in zip(top_two[:, 0], margins)
+        ]
@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+from app.storage import get_store
+
+load_dotenv()
+
+# Article bodies live outside the articles table, compressed and keyed by the
+# sha256 of their text (articles.text_hash), so that the hot rows stay small
+# and syndicated copies of a story share one body. Either in the
+# article_texts table of app.storage ("table") or as one file per body under
+# TEXT_STORE_PATH ("files", a stand-in for an object store):
+#   article_texts: content_hash text primary key, codec text, size integer,
+#   data text (base64 of the compressed body)
+TEXT_STORE = os.environ.get("TEXT_STORE", "table")
+TEXT_STORE_PATH = os.environ.get("TEXT_STORE_PATH", "article-texts")
+ZSTD_LEVEL = 10
+# file suffix of each codec
+CODECS = {"zstd": ".zst", "zlib": ".zz"}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(text: str) -> tuple[str, bytes]:
+    """
+    (codec, compressed text): zstd if zstandard is installed, otherwise zlib.
+    """
+    data = text.encode()
+    zstandard = _zstandard()
+    if zstandard:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == "zlib":
+        return zlib.decompress(data).decode()
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if not zstandard:
+            raise RuntimeError("Reading zstd article texts needs zstandard")
+        return zstandard.ZstdDecompressor().decompress(data).decode()
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class TableTextStore:
+    name = "table"
+
+    def exists(self, content_hash: str) -> bool:
+        return bool(
+            get_store().select(
+                "article_texts", "content_hash", [("content_hash", "eq", content_hash)]
+            )
+        )
+
+    def put(self, content_hash: str, codec: str, data: bytes, size: int) -> None:
+        get_store().upsert(
+            "article_texts",
+            [
+                {
+                    "content_hash": content_hash,
+                    "codec": codec,
+                    "size": size,
+                    "data": base64.b64encode(data).decode(),
+                }
+            ],
+            on_conflict="content_hash",
+            ignore_duplicates=True,
+        )
+
+    def get(self, content_hash: str) -> tuple[str, bytes] | None:
+        rows = get_store().select(
+            "article_texts", "codec, data", [("content_hash", "eq", content_hash)]
+        )
+        if not rows:
+            return None
+        return rows[0]["codec"], base64.b64decode(rows[0]["data"])
+
+
+class FileTextStore:
+    name = "files"
+
+    def __init__(self, path: str = TEXT_STORE_PATH):
+        self.path = path
+
+    def _path(self, content_hash: str, codec: str) -> str:
+        # sharded by the first two hex digits to keep directories small
+        return os.path.join(self.path, content_hash[:2], content_hash + CODECS[codec])
+
+    def exists(self, content_hash: str) -> bool:
+        return any(os.path.exists(self._path(content_hash, codec)) for codec in CODECS)
+
+    def put(self, content_hash: str, codec: str, data: bytes, size: int) -> None:
+        path = self._path(content_hash, codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so that readers never see half a body
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def get(self, content_hash: str) -> tuple[str, bytes] | None:
+        for codec in CODECS:
+            path = self._path(content_hash, codec)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return codec, f.read()
+        return None
+
+
+TEXT_STORE_CLASSES = {
+    "table": TableTextStore,
+    "files": FileTextStore,
+}
+_text_store = None
+
+
+def get_text_store():
+    """
+    The TEXT_STORE text store, created on first use.
+    """
+    global _text_store
+    if _text_store is None:
+        if TEXT_STORE not in TEXT_STORE_CLASSES:
+            raise ValueError(f"Unknown TEXT_STORE {TEXT_STORE}")
+        _text_store = TEXT_STORE_CLASSES[TEXT_STORE]()
+    return _text_store
+
+
+def use_text_store(text_store) -> None:
+    global _text_store
+    _text_store = text_store
+
+
+def save_text(text: str) -> str:
+    """
+    Store the text, unless a body with the same hash already is. Returns the hash.
+    """
+    content_hash = text_hash(text)
+    store = get_text_store()
+    if not store.exists(content_hash):
+        codec, data = compress(text)
+        store.put(content_hash, codec, data, len(text))
+    return content_hash
+
+
+def load_text(content_hash: str) -> str | None:
+    stored = get_text_store().get(content_hash)
+    if stored is None:
+        return None
+    return decompress(*stored)
@@ -0,0 +1,61 @@
+from app.newsly_types import NewslyArticle
+
+# Tokenizers used by the analysis stages
+TOKENIZERS = {
+    "bart": "facebook/bart-large-cnn",
+    "bert": "bucketresearch/politicalBiasBERT",
+    "llama": "meta-llama/Llama-3.1-8B-Instruct",
+    "mixtral": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+}
+
+# How many article tokens the stages using each tokenizer can consume:
+# BART and BERT are capped by their position embeddings (minus the special
+# tokens), Llama by a cost budget, and Mixtral by the 2048-token prompt of
+# ml_modal.get_logical_fallacies minus the fallacy prompt itself, which the
+# Tokenizers Modal class subtracts when it computes the budget.
+TOKEN_LIMITS = {
+    "bart": 1022,
+    "bert": 510,
+    "llama": 8000,
+    "mixtral": 2048,
+}
+
+# Which tokenizer's view of the article each stage gets
+STAGE_TOKENIZERS = {
+    "summary": "bart",
+    "lean": "bert",
+    "lean_and_explanation": "llama",
+    "topics_and_contextualization": "llama",
+    "tag": "llama",
+    "logical_fallacies": "llama",
+    "modal_logical_fallacies": "mixtral",
+}
+
+
+def article_view(article: NewslyArticle, stage: str) -> str:
+    """
+    The article text truncated to what the given stage can consume, using the
+    offsets computed once per article in article.token_budget. Without a
+    budget, the full text is returned and the stage truncates on its own.
+    """
+    budget = (article.token_budget or {}).get(STAGE_TOKENIZERS[stage])
+    if not budget:
+        return article.text
+    return article.text[: budget["char_end"]]
+
+
+def token_report(article: NewslyArticle) -> str:
+    """
+    One line per stage with the tokens it consumes out of the article's total.
+    """
+    lines = []
+    for stage, tokenizer in STAGE_TOKENIZERS.items():
+        budget = (article.token_budget or {}).get(tokenizer)
+        if not budget:
+            continue
+        used = min(budget["tokens"], budget["limit"])
+        lines.append(
+            f"{stage}: {used}/{budget['tokens']} {tokenizer} tokens"
+            + (" (truncated)" if budget["tokens"] > budget["limit"] else "")
+        )
+    return "\n".join(lines)
@@ -0,0 +1,256 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import socket
+import threading
+import time
+
+# Spans around the article fetch, every app.db call, every Modal call and
+# Together attempt, JSON extraction and the analysis stages, in the
+# OpenTelemetry data model. TRACE_EXPORTER=file appends them to TRACE_FILE as
+# OTLP JSON lines (what the collector's otlpjsonfile receiver reads),
+# TRACE_EXPORTER=console prints one line per span; unset, spans are no-ops.
+# The current span is a context variable, so the tasks of asyncio.gather and
+# asyncio.to_thread inherit it and one article's spans share a trace.
+# OTEL_SERVICE_NAME and OTEL_RESOURCE_ATTRIBUTES (e.g.
+# "deployment.environment=prod,service.version=abc123") tag the resource, to
+# compare traces across deployments (scripts/trace_report.py).
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "newsly-backend")
+RESOURCE_ATTRIBUTES = {
+    "service.name": SERVICE_NAME,
+    "host.name": socket.gethostname(),
+    "process.pid": os.getpid(),
+    **dict(
+        item.split("=", 1)
+        for item in os.environ.get("OTEL_RESOURCE_ATTRIBUTES", "").split(",")
+        if "=" in item
+    ),
+}
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+class Span:
+    """
+    One timed operation, the child of the span current when it started.
+    Use it as a context manager (in sync or async code alike); an exception
+    leaving it is recorded and marks it failed.
+    """
+
+    def __init__(self, name: str, attributes: dict):
+        parent = _current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.attributes = attributes
+        self.events = []
+        self.status = (0, "")
+        self.start = self.end = 0
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes) -> None:
+        self.events.append((name, time.time_ns(), attributes))
+
+    def set_error(self, message: str) -> None:
+        self.status = (STATUS_ERROR, message)
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time_ns()
+        _current_span.reset(self.token)
+        if exc is not None:
+            self.add_event(
+                "exception",
+                **{"exception.type": exc_type.__name__, "exception.message": str(exc)},
+            )
+            self.set_error(f"{exc_type.__name__}: {exc}")
+        get_exporter()(self)
+        return False
+
+    def otlp(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": 1,  # internal
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {
+                    "name": name,
+                    "timeUnixNano": str(timestamp),
+                    "attributes": _otlp_attributes(attributes),
+                }
+                for name, timestamp, attributes in self.events
+            ],
+            "status": {"code": self.status[0], "message": self.status[1]},
+        }
+
+
+class _NoopSpan:
+    # what span() returns while tracing is off
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """
+    A span to enter around an operation, e.g.
+        with span("modal.call", **{"rpc.method": name}) as s: ...
+    """
+    if not TRACE_EXPORTER:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+def current_span():
+    """
+    The innermost span entered in this context (a no-op span if none).
+    """
+    return _current_span.get() or NOOP_SPAN
+
+
+def traced(name: str | None = None, **attributes):
+    """
+    Decorator running each call of a function (sync or async) in a span,
+    named after it by default (e.g. db.get_article_by_url).
+    """
+
+    def decorator(function):
+        module = function.__module__.removeprefix("app.")
+        span_name = name or f"{module}.{function.__qualname__}"
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class FileExporter:
+    """
+    Appends every span to a file, one OTLP JSON ExportTraceServiceRequest
+    per line.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.resource = {"attributes": _otlp_attributes(RESOURCE_ATTRIBUTES)}
+
+    def __call__(self, span: Span) -> None:
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": self.resource,
+                        "scopeSpans": [
+                            {"scope": {"name": "newsly"}, "spans": [span.otlp()]}
+                        ],
+                    }
+                ]
+            }
+        )
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", buffering=1)
+            self.file.write(line + "\n")
+
+
+def console_exporter(span: Span) -> None:
+    error = f" {span.status[1]}" if span.status[0] == STATUS_ERROR else ""
+    print(
+        f"[trace {span.trace_id[:8]}] {span.name} "
+        f"{(span.end - span.start) / 1e6:.1f}ms{error}"
+    )
+
+
+EXPORTERS = {
+    "file": FileExporter,
+    "console": lambda: console_exporter,
+}
+_exporter = None
+
+
+def get_exporter():
+    """
+    The TRACE_EXPORTER exporter, created on first use.
+    """
+    global _exporter
+    if _exporter is None:
+        if TRACE_EXPORTER not in EXPORTERS:
+            raise ValueError(f"Unknown TRACE_EXPORTER {TRACE_EXPORTER}")
+        _exporter = EXPORTERS[TRACE_EXPORTER]()
+    return _exporter
+
+
+def use_exporter(exporter) -> None:
+    """
+    Send the spans to exporter (a callable taking a finished Span), which
+    also turns tracing on.
+    """
+    global _exporter, TRACE_EXPORTER
+    _exporter = exporter
+    TRACE_EXPORTER = TRACE_EXPORTER or "custom"
@@ -1,18 +1,15 @@
-from fastapi import HTTPException
-from newspaper import Article
-import modal
-from datetime import datetime
+from datetime import datetime, timezone
 from urllib.parse import urlparse, urlunparse
 from dataclasses import fields
 import json
 import re
 import os
-from newspaper.exceptions import ArticleException
 from pydantic import BaseModel, ValidationError
 from app.newsly_types import NewslyArticle, LogicalFallacyComplete
-
-modal_summarize = modal.Function.from_name("newsly-modal-test", "summarize")
-modal_political_lean = modal.Function.from_name("newsly-modal-test", "political_lean")
+from app.dedup import compute_fingerprint
+from app.canonical import canonicalize_url, site_of
+from app.fetch_cache import fetch_html
+from app.tracing import current_span, span, traced
 
 TEST = int(os.environ.get("TEST", "0"))
 
@@ -33,18 +30,48 @@ def filter_article_data(data: dict) -> dict:
 
 def normalize_url(url: str) -> str:
     """
-    Normalize a URL by removing the query and fragment components.
+    Normalize a URL to the canonical form used as the article cache key.
+    See app.canonical.canonicalize_url for the rules.
     Args:
         url (str): The URL to normalize.
     Returns:
         str: The normalized URL.
     """
+    return canonicalize_url(url)
+
+
+def legacy_normalize_url(url: str) -> str:
+    """
+    The cache key used before canonicalization (query and fragment removed).
+    Articles stored before then are still keyed this way.
+    """
     parsed = urlparse(url)
     normalized = parsed._replace(query="", fragment="")
     return urlunparse(normalized)
 
 
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parse a timestamp returned by the database into an aware datetime.
+    Postgres trims trailing zeros from fractional seconds, which
+    datetime.fromisoformat only accepts from Python 3.11 on.
+    """
+    value = value.replace("Z", "+00:00")
+    value = re.sub(r"\.(\d+)", lambda m: "." + m.group(1).ljust(6, "0")[:6], value)
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
 def extract_json(text: str):
+    with span("utils.extract_json", **{"text.length": len(text)}) as s:
+        json_obj = _extract_json(text)
+        s.set_attribute("json.parsed", json_obj is not None)
+        return json_obj
+
+
+def _extract_json(text: str):
     block_matches = list(re.finditer(r"```(?:json)?\\s*(.*?)```", text, re.DOTALL))
     bracket_matches = list(re.finditer(r"\{.*?\}", text, re.DOTALL))
 
@@ -79,9 +106,12 @@ def extract_json(text: str):
         return None
 
 
-def parse_article(url: str) -> NewslyArticle:
+@traced()
+def parse_article(url: str, html: str | None = None) -> NewslyArticle:
     """
     Parse an article from the given URL.
+    The page is fetched through app.fetch_cache (a conditional request if it
+    was fetched before), or taken from html if given.
 
     The Article object has the following attributes:
     - title: The title of the article.
@@ -93,13 +123,23 @@ def parse_article(url: str) -> NewslyArticle:
 
     Args:
         url (str): The URL of the article to parse.
+        html (str): The page, if already fetched.
 
     Returns:
         Article: An object containing the parsed article data.
     """
+    # newspaper and fastapi take a third of a second each to import, which
+    # the callers that only need the URL helpers shouldn't pay
+    from fastapi import HTTPException
+    from newspaper import Article
+    from newspaper.exceptions import ArticleException
+
+    current_span().set_attribute("url.full", url)
     try:
+        if html is None:
+            html = fetch_html(url).html
         article = Article(url)
-        article.download()
+        article.download(input_html=html)
         article.parse()
     except Exception as e:
         if isinstance(e, ArticleException):
@@ -114,8 +154,14 @@ def parse_article(url: str) -> NewslyArticle:
     date = article.publish_date
     date = date.isoformat()
 
+    # prefer the publisher's rel=canonical link as the article's key, but only
+    # when it points at the same site (a page can claim any canonical URL)
+    canonical_url = normalize_url(url)
+    if article.canonical_link and site_of(article.canonical_link) == site_of(url):
+        canonical_url = normalize_url(article.canonical_link)
+
     return NewslyArticle(
-        url=url,
+        url=canonical_url,
         title=article.title,
         text=article.text,
         authors=article.authors,
@@ -126,4 +172,5 @@ def parse_article(url: str) -> NewslyArticle:
         keywords=article.keywords or [],
         images=article.images or [],
         movies=article.movies or [],
+        fingerprint=compute_fingerprint(article.text),
     )
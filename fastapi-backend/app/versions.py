@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+import app.prompts as prompts
+from app.backends import BACKEND_CLASSES, FALLACY_TYPES
+from app.related import EMBEDDING_MODEL
+from app.tagging import TAG_LLM_FALLBACK, TAG_MARGIN_THRESHOLD, tag_label_texts
+from app.token_budget import TOKEN_LIMITS
+
+# Every analysis stage's result is stored with a version fingerprint of what
+# produced it (NewslyArticle.stage_versions): the backend's models for the
+# stage, the prompts and settings it uses and its code version below. When
+# any of them changes, the stored results of that stage are outdated and
+# app.reanalysis re-runs just those stages.
+
+# Bump a stage's number when its code changes what it returns, including the
+# prompts written inline in ml_modal.py and ml_newsly.py.
+CODE_VERSIONS = {
+    "token_budget": 1,
+    "summary": 1,
+    "lean": 1,
+    "lean_explanation": 1,
+    "topics": 1,
+    "contextualization": 1,
+    "logical_fallacies": 1,
+    "embedding": 1,
+    "tag": 1,
+    "keywords": 1,
+}
+
+# stage -> the prompts and settings shared by the backends
+STAGE_INPUTS = {
+    "token_budget": TOKEN_LIMITS,
+    "topics": prompts.topics,
+    "logical_fallacies": FALLACY_TYPES,
+    "embedding": EMBEDDING_MODEL,
+    "keywords": EMBEDDING_MODEL,
+    # the labels are compared with the embedder's embeddings
+    "tag": [
+        prompts.tag,
+        EMBEDDING_MODEL,
+        tag_label_texts(),
+        TAG_MARGIN_THRESHOLD,
+        TAG_LLM_FALLBACK,
+    ],
+}
+
+
+def stage_version(stage: str, backend: str) -> str:
+    """
+    The current fingerprint of the stage's result when run on the backend.
+    """
+    backend_class = BACKEND_CLASSES.get(backend)
+    payload = {
+        "stage": stage,
+        "backend": backend,
+        "models": backend_class.models.get(stage, ()) if backend_class else (),
+        "inputs": STAGE_INPUTS.get(stage),
+        "code": CODE_VERSIONS.get(stage, 1),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def stamp(stage: str, backend: str, reused_from: str | None = None) -> dict:
+    """
+    The stage_versions entry for a result the backend just produced. A result
+    reused from another stage's call records that stage, which has to be
+    re-run to reproduce it.
+    """
+    entry = {"backend": backend, "version": stage_version(stage, backend)}
+    if reused_from:
+        entry["reused_from"] = reused_from
+    return entry
+
+
+def is_outdated(stage: str, entry: dict | None) -> bool:
+    """
+    Whether a stored stage_versions entry no longer matches what its backend
+    would produce now (or there is none).
+    """
+    if not entry or not entry.get("backend"):
+        return True
+    return entry.get("version") != stage_version(stage, entry["backend"])
@@ -1,20 +1,28 @@
 #!/usr/bin/env python
 import asyncio
+import contextlib
 import json
+import os
 import click
-from app.server import process_article_db, analyze_article
 import app.utils as utils
 from app.utils import parse_article
-from app.ml_newsly import get_combined_logical_fallacies
-from app.ml_modal import extract_topics
 import dataclasses
 
+# The app modules a command needs are imported in the command: the analysis
+# pipeline, its backends and their libraries take seconds to import, which
+# commands like parse shouldn't pay. Option defaults that come from those
+# modules are therefore resolved in the command too.
+
 
 async def process_article_wrapper(url, cache=True):
+    from app.server import process_article_db
+
     return await process_article_db(url, cache=cache)
 
 
 async def analyze_article_wrapper(url):
+    from app.server import analyze_article
+
     article = parse_article(url)
     if not article:
         raise click.ClickException("Failed to fetch or parse the URL")
@@ -34,23 +42,209 @@ def cli():
 @click.option("--test", is_flag=True, help="Run in test mode")
 @click.option("--no-cache", is_flag=True, help="Cache the article")
 def process_article(url, json_output, test, no_cache):
-
-    if test:
-        utils.TEST = 1
-
     """Analyze an article from the given URL."""
 
     if test:
+        utils.TEST = 1
         no_cache = True
 
     result = asyncio.run(process_article_wrapper(url, cache=not no_cache))
+    result_dict = dataclasses.asdict(result)
 
     if json_output:
-        click.echo(json.dumps(result, indent=2))
+        click.echo(json.dumps(result_dict, indent=2, default=str))
     else:
-        for key, value in result.items():
+        for key, value in result_dict.items():
             click.echo(f"{key}: {value}")
-        # Add other fields as needed
+
+
+@cli.command()
+@click.argument("urls", type=click.File("r"), default="-")
+@click.option(
+    "--state-file",
+    default="ingest-state.jsonl",
+    show_default=True,
+    help="Progress checkpoint; rerun with the same file to resume",
+)
+@click.option("--concurrency", type=int, help="[default: INGEST_CONCURRENCY]")
+@click.option("--batch-size", type=int, help="[default: INGEST_BATCH_SIZE]")
+@click.option("--deadline", type=float, help="Per-article deadline in seconds")
+@click.option("--no-retry-failed", is_flag=True, help="Skip URLs that failed before")
+@click.option("--quiet", is_flag=True, help="Only print the progress lines")
+@click.option("--test", is_flag=True, help="Run in test mode")
+def ingest(
+    urls, state_file, concurrency, batch_size, deadline, no_retry_failed, quiet, test
+):
+    """Analyze and store every URL in a file (or stdin), one per line."""
+    from app.ingest import ingest as run_ingest, INGEST_BATCH_SIZE, INGEST_CONCURRENCY
+
+    if test:
+        utils.TEST = 1
+
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            # the pipeline prints a lot per article; progress goes to stderr
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        stats = asyncio.run(
+            run_ingest(
+                urls,
+                state_file=state_file,
+                concurrency=concurrency or INGEST_CONCURRENCY,
+                batch_size=batch_size or INGEST_BATCH_SIZE,
+                retry_failed=not no_retry_failed,
+                deadline_seconds=deadline,
+            )
+        )
+
+    for error, count in sorted(stats.errors.items(), key=lambda e: -e[1]):
+        click.echo(f"{count:>6}  {error}", err=True)
+
+
+@cli.command()
+@click.argument("out_dir", type=click.Path(file_okay=False))
+@click.option(
+    "--format", "format_", type=click.Choice(["parquet", "arrow"]), default="parquet"
+)
+@click.option("--since", help="Only articles analyzed after this ISO timestamp")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only articles analyzed since the last incremental export to OUT_DIR",
+)
+@click.option("--with-text", is_flag=True, help="Include the article text")
+@click.option("--page-size", type=int, help="[default: EXPORT_PAGE_SIZE]")
+def export(out_dir, format_, since, incremental, with_text, page_size):
+    """Export the analyzed articles and their fallacies to Parquet or Arrow files."""
+    from app.export import export_articles, EXPORT_PAGE_SIZE
+
+    try:
+        result = export_articles(
+            out_dir,
+            format=format_,
+            since=since,
+            incremental=incremental,
+            with_text=with_text,
+            page_size=page_size or EXPORT_PAGE_SIZE,
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2))
+
+
+@cli.command()
+@click.argument("feeds", nargs=-1)
+@click.option("--loop", is_flag=True, help="Keep crawling every interval")
+@click.option("--interval", type=float, help="[default: CRAWLER_INTERVAL_SECONDS]")
+@click.option("--concurrency", type=int, help="[default: CRAWLER_CONCURRENCY]")
+def crawl(feeds, loop, interval, concurrency):
+    """Pre-analyze new articles from RSS feeds and sitemaps (default: CRAWLER_FEEDS)."""
+    from app.crawler import (
+        Crawler,
+        CRAWLER_FEEDS,
+        CRAWLER_INTERVAL,
+        CRAWLER_CONCURRENCY,
+    )
+
+    crawler = Crawler(
+        feeds or CRAWLER_FEEDS, concurrency=concurrency or CRAWLER_CONCURRENCY
+    )
+    if not crawler.feeds:
+        raise click.ClickException("No feeds given and CRAWLER_FEEDS is not set")
+
+    if loop:
+        asyncio.run(crawler.run(interval or CRAWLER_INTERVAL))
+    else:
+        click.echo(json.dumps(asyncio.run(crawler.crawl_once()), indent=2))
+
+
+def check_stages(stages: tuple[str, ...]) -> list[str] | None:
+    from app.reanalysis import STAGE_DEPS
+
+    unknown = sorted(set(stages) - set(STAGE_DEPS))
+    if unknown:
+        raise click.BadParameter(
+            f"unknown stages {unknown}, choose from {list(STAGE_DEPS)}",
+            param_hint="--stage",
+        )
+    return list(stages) or None
+
+
+@cli.command("plan-reanalysis")
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    metavar="STAGE",
+    help="Only these stages",
+)
+@click.option("--limit", type=int, help="Stop after this many articles")
+def plan_reanalysis_command(stages, limit):
+    """List the outdated analysis stages and what re-running them takes."""
+    from app.reanalysis import plan_reanalysis
+
+    click.echo(plan_reanalysis(check_stages(stages), limit).report())
+
+
+@cli.command()
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    metavar="STAGE",
+    help="Only re-run these stages (and what they need) when outdated",
+)
+@click.option("--limit", type=int, help="Stop after this many articles")
+@click.option("--concurrency", type=int, help="[default: REANALYSIS_CONCURRENCY]")
+@click.option("--deadline", type=float, help="Per-article deadline in seconds")
+@click.option("--after", help="Resume after this article id")
+def reanalyze(stages, limit, concurrency, deadline, after):
+    """Re-run the analysis stages whose version fingerprint is out of date."""
+    from app.reanalysis import reanalyze as run_reanalyze, REANALYSIS_CONCURRENCY
+
+    progress = asyncio.run(
+        run_reanalyze(
+            check_stages(stages),
+            limit=limit,
+            concurrency=concurrency or REANALYSIS_CONCURRENCY,
+            deadline_seconds=deadline,
+            after=after,
+        )
+    )
+    for error in progress.errors:
+        click.echo(error, err=True)
+    click.echo(json.dumps(dict(progress.runs), indent=2))
+
+
+@cli.command()
+@click.option("--limit", type=int, help="Stop after this many articles")
+@click.option("--concurrency", type=int, help="[default: REANALYSIS_CONCURRENCY]")
+@click.option("--deadline", type=float, help="Per-article deadline in seconds")
+@click.option("--after", help="Resume after this article id")
+def refresh(limit, concurrency, deadline, after):
+    """Re-fetch stored articles and re-analyze those whose text changed."""
+    from app.reanalysis import refresh_articles, REANALYSIS_CONCURRENCY
+
+    outcomes = asyncio.run(
+        refresh_articles(
+            limit=limit,
+            concurrency=concurrency or REANALYSIS_CONCURRENCY,
+            deadline_seconds=deadline,
+            after=after,
+        )
+    )
+    click.echo(json.dumps(dict(outcomes), indent=2))
+
+
+@cli.command()
+@click.argument("backend")
+@click.option("--dry-run", is_flag=True)
+def stamp_stage_versions(backend, dry_run):
+    """Record the current stage versions of BACKEND on articles analyzed without them."""
+    from app.migrations import run_migration
+    from app.reanalysis import stamp_migration
+
+    run_migration(stamp_migration(backend), dry_run=dry_run)
 
 
 @cli.command()
@@ -58,10 +252,12 @@ def process_article(url, json_output, test, no_cache):
 @click.option("--json-output", is_flag=True, help="Output as JSON")
 def parse(url, json_output):
     """Parse an article from the given URL."""
-    result = asyncio.run(parse_article(url))
+    result = parse_article(url)
 
     if json_output:
-        click.echo(json.dumps(result, indent=2))
+        click.echo(json.dumps(dataclasses.asdict(result), indent=2, default=str))
+    else:
+        click.echo(f"{result.title}\n{result.url}\n\n{result.text}")
 
 
 @cli.command()
@@ -129,6 +325,8 @@ def get_logical(url, json_output, test, sequential):
     if not article:
         raise click.ClickException("Failed to fetch or parse the URL")
 
+    from app.ml_newsly import get_combined_logical_fallacies
+
     text = article.text
     result = asyncio.run(get_combined_logical_fallacies(text))
 
@@ -0,0 +1,51 @@
+"""
+Compare free sampling with retries against constrained decoding for the topic
+and tag stages, on the deployed Modal app.
+
+The corpus is a JSONL file with one {"text": ...} article per line.
+
+    python scripts/benchmark_constrained_decoding.py corpus.jsonl --limit 50
+"""
+
+import argparse
+import json
+
+import modal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", help="JSONL file with a text field per line")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--n-topics", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    texts = texts[: args.limit]
+
+    benchmark = modal.Function.from_name(
+        "newsly-modal-test", "benchmark_constrained_decoding"
+    )
+    stats = benchmark.remote(texts, args.n_topics)
+
+    print(f"{len(texts)} articles")
+    print(
+        f"{'stage':<7} {'mode':<14} {'generations':>11} {'failures':>8} {'seconds':>8}"
+    )
+    for stage in ("topics", "tag"):
+        for mode in ("unconstrained", "constrained"):
+            result = stats[mode][stage]
+            print(
+                f"{stage:<7} {mode:<14} {result['generations']:>11} "
+                f"{result['failures']:>8} {result['seconds']:>8.1f}"
+            )
+        avoided = (
+            stats["unconstrained"][stage]["generations"]
+            - stats["constrained"][stage]["generations"]
+        )
+        print(f"{stage}: {avoided} retries avoided")
+
+
+if __name__ == "__main__":
+    main()
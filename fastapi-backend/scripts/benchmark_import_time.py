@@ -0,0 +1,115 @@
+"""
+Benchmark how long the server and the CLI take to import, against a budget.
+
+Imports each entry point in a fresh interpreter with `python -X importtime`
+(best of --runs), prints its cumulative import time next to its budget and
+the heaviest modules it pulled in, and with --check exits non-zero when an
+entry point is over budget or imports one of LAZY_MODULES at startup.
+
+    python scripts/benchmark_import_time.py --check
+"""
+
+import sys
+import os
+import argparse
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# entry point -> import time budget in ms, about twice what it takes on a
+# laptop, so that only a new eager import of a heavy library trips it
+BUDGETS_MS = {
+    "app.utils": 250,
+    "app.db": 300,
+    "app.server": 1000,
+    "app.main": 1000,
+    "cli": 300,
+}
+# imported on first use only (a Modal handle lookup, a model, a page fetch)
+LAZY_MODULES = (
+    "modal",
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "newspaper",
+    "supabase",
+    "pyarrow",
+    "zstandard",
+)
+# the app reads these at import; no connection is made
+IMPORT_ENV = {
+    "SUPABASE_URL": "http://localhost",
+    "SUPABASE_SERVICE_KEY": "import-time",
+}
+
+
+def import_times(module: str) -> dict[str, int]:
+    """
+    Cumulative import time in µs of every module imported by `import module`.
+    """
+    env = {**IMPORT_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Heaviest imports shown")
+    parser.add_argument(
+        "--check", action="store_true", help="Exit 1 if anything is over budget"
+    )
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'entry point':<12} {'import ms':>10} {'budget ms':>10}")
+    for module, budget in BUDGETS_MS.items():
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda times: times[module])
+        elapsed = best[module] / 1000
+        over = elapsed > budget
+        print(f"{module:<12} {elapsed:>10.0f} {budget:>10}{'  OVER' if over else ''}")
+        if over:
+            failures.append(f"{module} imports in {elapsed:.0f} ms > {budget} ms")
+
+        # the top-level packages (not the entry point's own) by cumulative time
+        packages = defaultdict(int)
+        for name, cumulative in best.items():
+            top = name.split(".")[0]
+            if top not in ("app", module, "site", "encodings") and "." not in name:
+                packages[top] = max(packages[top], cumulative)
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[: args.top]
+        print(
+            "    "
+            + ", ".join(
+                f"{name} {cumulative / 1000:.0f}" for name, cumulative in heaviest
+            )
+        )
+        eager = [name for name in LAZY_MODULES if name in best]
+        if eager:
+            failures.append(f"{module} imports {', '.join(eager)} at startup")
+
+    for failure in failures:
+        print(failure)
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Precision/recall benchmark for near-duplicate detection.
+
+The corpus is a JSONL file with one article per line: {"text": ..., "cluster": ...}.
+Articles sharing a cluster are the same story (e.g. one wire report on several
+outlets). Without a corpus, --synthetic generates one by perturbing random texts.
+
+    python scripts/benchmark_near_duplicates.py corpus.jsonl
+    python scripts/benchmark_near_duplicates.py --synthetic 500
+"""
+
+import sys
+import os
+import argparse
+import json
+import random
+import time
+from itertools import combinations
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.dedup import NearDuplicateIndex, compute_fingerprint
+
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_corpus(n_clusters: int, seed: int = 0) -> list[dict]:
+    """
+    Each cluster is one random "story" plus copies with outlet boilerplate,
+    dropped sentences and a few edited words, like syndicated wire copy.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    corpus = []
+    for cluster in range(n_clusters):
+        sentences = [
+            " ".join(rng.choices(vocabulary, k=rng.randint(12, 25)))
+            for _ in range(rng.randint(15, 40))
+        ]
+        corpus.append({"text": ". ".join(sentences), "cluster": cluster})
+
+        for _ in range(rng.randint(0, 4)):
+            copy = [s for s in sentences if rng.random() > 0.03]
+            copy = [
+                " ".join(
+                    rng.choice(vocabulary) if rng.random() < 0.005 else word
+                    for word in sentence.split()
+                )
+                for sentence in copy
+            ]
+            copy.append(f"reporting by outlet{rng.randint(0, 50)} staff")
+            corpus.append({"text": ". ".join(copy), "cluster": cluster})
+    return corpus
+
+
+def evaluate(corpus: list[dict], fingerprints: list[str], threshold: float) -> dict:
+    index = NearDuplicateIndex(threshold)
+    predicted = set()
+
+    start = time.perf_counter()
+    for i, fingerprint in enumerate(fingerprints):
+        for key, _ in index.query(fingerprint):
+            predicted.add((int(key), i))
+        index.add(str(i), fingerprint)
+    elapsed = time.perf_counter() - start
+
+    actual = {
+        (i, j)
+        for i, j in combinations(range(len(corpus)), 2)
+        if corpus[i]["cluster"] == corpus[j]["cluster"]
+    }
+
+    true_positives = len(predicted & actual)
+    precision = true_positives / len(predicted) if predicted else 1.0
+    recall = true_positives / len(actual) if actual else 1.0
+    return {
+        "threshold": threshold,
+        "precision": precision,
+        "recall": recall,
+        "predicted_pairs": len(predicted),
+        "actual_pairs": len(actual),
+        "ms_per_article": 1000 * elapsed / len(corpus),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="?", help="JSONL corpus with text/cluster")
+    parser.add_argument("--synthetic", type=int, default=0, help="Clusters to generate")
+    parser.add_argument(
+        "--thresholds",
+        default="0.8,0.85,0.9,0.95",
+        help="Comma-separated similarity thresholds",
+    )
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    elif args.synthetic:
+        corpus = synthetic_corpus(args.synthetic)
+    else:
+        parser.error("pass a corpus file or --synthetic N")
+
+    start = time.perf_counter()
+    fingerprints = [compute_fingerprint(article["text"]) for article in corpus]
+    fingerprint_ms = 1000 * (time.perf_counter() - start) / len(corpus)
+    print(f"{len(corpus)} articles, {fingerprint_ms:.2f} ms/article to fingerprint")
+
+    print(
+        f"{'threshold':>9} {'precision':>9} {'recall':>7} {'pairs':>13} {'ms/article':>10}"
+    )
+    for threshold in args.thresholds.split(","):
+        result = evaluate(corpus, fingerprints, float(threshold))
+        print(
+            f"{result['threshold']:>9.2f} {result['precision']:>9.3f} "
+            f"{result['recall']:>7.3f} "
+            f"{result['predicted_pairs']:>6}/{result['actual_pairs']:<6} "
+            f"{result['ms_per_article']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
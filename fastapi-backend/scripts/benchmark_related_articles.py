@@ -0,0 +1,78 @@
+"""
+Benchmark the related-articles ANN index on a synthetic corpus.
+
+Articles are generated as noisy copies of "story" vectors, so each story has
+several close neighbours, like coverage of one event by different outlets.
+Reports incremental insert cost, query latency and recall@k against exact
+search.
+
+    python scripts/benchmark_related_articles.py --articles 100000
+"""
+
+import sys
+import os
+import argparse
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.related import RelatedArticlesIndex, EMBEDDING_DIM
+
+
+def synthetic_embeddings(n_articles: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n_stories = max(1, n_articles // 10)
+    stories = rng.standard_normal((n_stories, dim), dtype=np.float32)
+    story_of = rng.integers(0, n_stories, n_articles)
+    noise = rng.standard_normal((n_articles, dim), dtype=np.float32)
+    vectors = stories[story_of] + 0.6 * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--n-probe", type=int, default=8)
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.articles, EMBEDDING_DIM)
+    index = RelatedArticlesIndex(n_probe=args.n_probe)
+
+    start = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.add(str(i), vector)
+    elapsed = time.perf_counter() - start
+    print(
+        f"added {len(index)} articles in {elapsed:.1f}s "
+        f"({1e6 * elapsed / len(index):.0f} us/article incl. retraining), "
+        f"{len(index.centroids) if index.centroids is not None else 0} lists"
+    )
+
+    rng = np.random.default_rng(1)
+    queries = rng.choice(args.articles, min(args.queries, args.articles), replace=False)
+
+    latencies = []
+    hits = 0
+    for q in queries:
+        start = time.perf_counter()
+        results = index.search(vectors[q], args.k, exclude={str(q)})
+        latencies.append(time.perf_counter() - start)
+
+        scores = vectors @ vectors[q]
+        scores[q] = -np.inf
+        exact = set(np.argpartition(-scores, args.k)[: args.k].tolist())
+        hits += len(exact & {int(article_id) for article_id, _ in results})
+
+    latencies_ms = 1000 * np.array(latencies)
+    print(
+        f"query p50 {np.percentile(latencies_ms, 50):.2f} ms, "
+        f"p95 {np.percentile(latencies_ms, 95):.2f} ms, "
+        f"recall@{args.k} {hits / (len(queries) * args.k):.3f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
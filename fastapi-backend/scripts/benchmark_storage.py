@@ -0,0 +1,137 @@
+"""
+Benchmark the app.db layer offline, on the SQLite store.
+
+Fills a fresh database with synthetic analyzed articles through
+add_articles_to_db, then times the lookups the server makes per request
+(by URL, by alias, previews), the crawler's known-URL check and a full
+keyset scan.
+
+    python scripts/benchmark_storage.py --articles 50000 --path /tmp/newsly-bench.db
+"""
+
+import sys
+import os
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.storage import SqliteStore, use_store
+from app.newsly_types import NewslyArticle
+import app.db as db
+
+TAGS = ["politics", "business", "sports", "science", "world", "entertainment"]
+
+
+def synthetic_article(rng: random.Random, i: int) -> NewslyArticle:
+    now = datetime.now(timezone.utc)
+    return NewslyArticle(
+        url=f"https://example.com/news/{i}",
+        title=f"Article {i}",
+        text=" ".join(rng.choices(TAGS, k=800)),
+        authors=["A. Writer"],
+        image_url="",
+        published_date=now,
+        last_analyzed_at=now,
+        source_url="https://example.com",
+        fingerprint=f"{rng.getrandbits(64):016x}",
+        summary="A summary. " * 10,
+        lean="center",
+        topics=rng.sample(TAGS, 2),
+        tag=rng.choice(TAGS),
+        embedding=[rng.random() for _ in range(384)],
+    )
+
+
+def timed(label: str, calls, repeat: int) -> None:
+    latencies = []
+    for call in calls[:repeat]:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = 1000 * np.array(latencies)
+    print(
+        f"{label:<24} p50 {np.percentile(latencies_ms, 50):7.3f} ms  "
+        f"p95 {np.percentile(latencies_ms, 95):7.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=20_000)
+    parser.add_argument("--path", default=":memory:")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.path != ":memory:" and os.path.exists(args.path):
+        os.remove(args.path)
+    use_store(SqliteStore(args.path))
+    rng = random.Random(0)
+
+    ids = []
+    start = time.perf_counter()
+    for first in range(0, args.articles, args.batch_size):
+        batch = [
+            synthetic_article(rng, i)
+            for i in range(first, min(first + args.batch_size, args.articles))
+        ]
+        stored = db.add_articles_to_db(batch)
+        ids += [article.id for article in stored]
+        db.add_article_aliases(stored[0].id, [f"https://example.com/amp/{first}"])
+    elapsed = time.perf_counter() - start
+    print(
+        f"inserted {len(ids)} articles in {elapsed:.1f}s "
+        f"({1e6 * elapsed / len(ids):.0f} us/article)\n"
+    )
+
+    n = args.articles
+    hits = [rng.randrange(n) for _ in range(args.queries)]
+    timed(
+        "get_article_by_url",
+        [
+            lambda i=i: db.get_article_by_url(f"https://example.com/news/{i}")
+            for i in hits
+        ],
+        args.queries,
+    )
+    timed(
+        "url miss (+ alias)",
+        [lambda i=i: db.get_article_by_url(f"https://example.com/x/{i}") for i in hits],
+        args.queries,
+    )
+    timed(
+        "get_article_by_id",
+        [lambda i=i: db.get_article_by_id(ids[i]) for i in hits],
+        args.queries,
+    )
+    timed(
+        "get_article_previews(5)",
+        [lambda: db.get_article_previews(rng.sample(ids, 5)) for _ in hits],
+        args.queries,
+    )
+    timed(
+        "get_known_urls(50)",
+        [
+            lambda: db.get_known_urls(
+                [f"https://example.com/news/{rng.randrange(2 * n)}" for _ in range(50)]
+            )
+            for _ in range(100)
+        ],
+        100,
+    )
+
+    start = time.perf_counter()
+    rows = sum(len(page) for page in db.iter_article_pages("fingerprint"))
+    elapsed = time.perf_counter() - start
+    print(f"\nkeyset scan of fingerprints: {rows} rows in {elapsed:.2f}s")
+    start = time.perf_counter()
+    db.get_article_embeddings()
+    print(f"get_article_embeddings: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
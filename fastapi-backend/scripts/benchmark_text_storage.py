@@ -0,0 +1,129 @@
+"""
+Benchmark the text store offline, on the SQLite store.
+
+Stores synthetic articles (Zipf-distributed words, with a share of
+syndicated copies) through add_articles_to_db, then compares the size of an
+articles row with and without its text, the compression of the bodies and
+the time to read rows and load texts lazily.
+
+    python scripts/benchmark_text_storage.py --articles 2000 --duplicates 0.2
+"""
+
+import sys
+import os
+import argparse
+import dataclasses
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.storage import SqliteStore, get_store, use_store
+from app.newsly_types import NewslyArticle
+from app.text_store import compress
+import app.db as db
+
+
+def synthetic_text(rng: random.Random, vocabulary: list[str], words: int) -> str:
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    sentences = []
+    while words > 0:
+        n = rng.randint(8, 30)
+        sentence = " ".join(rng.choices(vocabulary, weights, k=n))
+        sentences.append(sentence.capitalize() + ".")
+        words -= n
+    return " ".join(sentences)
+
+
+def synthetic_article(rng: random.Random, i: int, text: str) -> NewslyArticle:
+    now = datetime.now(timezone.utc)
+    return NewslyArticle(
+        url=f"https://example.com/news/{i}",
+        title=f"Article {i}",
+        text=text,
+        authors=["A. Writer"],
+        image_url="https://example.com/image.jpg",
+        published_date=now,
+        last_analyzed_at=now,
+        source_url="https://example.com",
+        summary="A summary of the article. " * 6,
+        lean="center",
+        lean_explanation="An explanation of the lean. " * 8,
+        topics=["budget", "senate"],
+        tag="politics",
+        contextualization="Some context. " * 20,
+        embedding=[rng.random() for _ in range(384)],
+    )
+
+
+def row_bytes(row: dict) -> int:
+    return len(json.dumps(row, default=str).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=900, help="Words per article")
+    parser.add_argument(
+        "--duplicates", type=float, default=0.2, help="Share of syndicated copies"
+    )
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    use_store(SqliteStore(":memory:"))
+    rng = random.Random(0)
+    vocabulary = [
+        "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10)))
+        for _ in range(5000)
+    ]
+    texts = []
+    for _ in range(args.articles):
+        if texts and rng.random() < args.duplicates:
+            texts.append(rng.choice(texts))
+        else:
+            texts.append(synthetic_text(rng, vocabulary, args.words))
+    articles = [synthetic_article(rng, i, text) for i, text in enumerate(texts)]
+
+    full_rows = [row_bytes(dataclasses.asdict(article)) for article in articles]
+    raw = sum(len(text.encode()) for text in texts)
+    codec, _ = compress(texts[0])
+    compressed = sum(len(compress(text)[1]) for text in set(texts))
+
+    start = time.perf_counter()
+    ids = [article.id for article in db.add_articles_to_db(articles)]
+    elapsed = time.perf_counter() - start
+    print(f"stored {len(ids)} articles in {elapsed:.1f}s")
+
+    hot_rows = [
+        row_bytes(row) for row in get_store().select("articles", db.ARTICLE_COLUMNS)
+    ]
+    bodies = get_store().select("article_texts", "data")
+    print(
+        f"row with text  {np.mean(full_rows):8.0f} bytes\n"
+        f"row without    {np.mean(hot_rows):8.0f} bytes "
+        f"({np.mean(full_rows) / np.mean(hot_rows):.1f}x smaller)\n"
+        f"bodies         {raw / 1e6:8.2f} MB raw, {len(bodies)} distinct, "
+        f"{compressed / 1e6:.2f} MB {codec} ({raw / compressed:.1f}x smaller)\n"
+    )
+
+    latencies = {"get_article_by_id": [], "load_article_text": []}
+    for _ in range(args.queries):
+        start = time.perf_counter()
+        article = db.get_article_by_id(rng.choice(ids))
+        latencies["get_article_by_id"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        db.load_article_text(article)
+        latencies["load_article_text"].append(time.perf_counter() - start)
+    for label, values in latencies.items():
+        values_ms = 1000 * np.array(values)
+        print(
+            f"{label:<20} p50 {np.percentile(values_ms, 50):7.3f} ms  "
+            f"p95 {np.percentile(values_ms, 95):7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Check the Together path of the analysis stages offline.
+
+Replaces the Together API client with canned replies, then checks that every
+TogetherBackend text method returns an actual result (not an un-awaited
+coroutine), and that when Together gives no reply (None after its retries)
+the stage raises, so that the router records the failure and falls back to
+the fake backend. Also checks that an empty embedding fails the embedding
+stage, that Together only offers embeddings with sentence-transformers
+installed, and that an error caused by the input doesn't count against the
+backend. Exits 1 on the first failed check.
+
+    python scripts/check_together_routing.py
+"""
+
+import sys
+import os
+import asyncio
+import json
+import warnings
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import app.ml_newsly as ml_newsly
+from app.backends import FakeBackend, TogetherBackend
+from app.pipeline import StageContext
+import app.routing as routing
+from app.routing import Router
+from app.server import embed_article
+
+TEXT = "The senate voted on the budget bill today. " * 20
+LEAN = {"probabilities": {"left": 0.2, "center": 0.5, "right": 0.3}}
+REPLIES = {
+    # the political lean prompt asks for JSON
+    "political lean": json.dumps({**LEAN, "predicted_lean": "center"}),
+    "": "Analysis: The article reports the vote evenly.",
+}
+
+
+class EmptyEmbedder(FakeBackend):
+    async def embed_article(self, text: str) -> list[float]:
+        return []
+
+
+async def canned_reply(model, messages, **kwargs):
+    prompt = messages[-1]["content"]
+    return next(reply for key, reply in REPLIES.items() if key in prompt)
+
+
+async def no_reply(model, messages, **kwargs):
+    return None
+
+
+async def bad_input():
+    raise ValueError("Article has no text")
+
+
+def check(ok: bool, message: str) -> None:
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        sys.exit(1)
+
+
+async def main():
+    # an un-awaited coroutine is the bug being checked for; make it an error
+    warnings.simplefilter("error", RuntimeWarning)
+    if ml_newsly.get_device() == "cuda":
+        sys.exit("Local models are used on a GPU; run this on a CPU machine")
+    together = TogetherBackend()
+    stages = {
+        "summary": lambda: together.summarize(TEXT),
+        "lean": lambda: together.political_lean(TEXT),
+        "lean_explanation": lambda: together.lean_explanation(TEXT, "center", 0.5),
+    }
+
+    ml_newsly.generate_together = canned_reply
+    for stage, call in stages.items():
+        result = await call()
+        check(
+            isinstance(result, (str, dict)) and bool(result),
+            f"{stage} on together returns {type(result).__name__}",
+        )
+
+    ml_newsly.generate_together = no_reply
+    # Together first every time, rather than exploring the fake backend
+    routing.ROUTER_EXPLORE_RATE = 0
+    fake = FakeBackend(latency_scale=0.001, cold_start_rate=0, seed=0)
+    fake_calls = {
+        "summary": lambda: fake.summarize(TEXT),
+        "lean": lambda: fake.political_lean(TEXT),
+        "lean_explanation": lambda: fake.lean_explanation(TEXT, "center", 0.5),
+    }
+    router = Router()
+    for stage, call in stages.items():
+        backend, result = await router.route(
+            stage, {"together": call, "fake": fake_calls[stage]}, hedge=False
+        )
+        check(
+            backend == "fake" and router.error_rate("together", stage) == 1,
+            f"{stage} without a Together reply fails over to {backend}",
+        )
+
+    check(
+        together.supports("embed_article") == ml_newsly.local_embedder_installed(),
+        "together offers embeddings only with sentence-transformers installed",
+    )
+    context = StageContext(SimpleNamespace(text=TEXT), {})
+    empty = EmptyEmbedder(latency_scale=0.001, cold_start_rate=0, seed=0)
+    backend, embedding = await router.route(
+        "embedding",
+        {
+            # tried first, as Together is
+            "together": lambda: embed_article(context, empty),
+            "fake": lambda: embed_article(context, fake),
+        },
+        hedge=False,
+    )
+    check(
+        backend == "fake"
+        and len(embedding) > 0
+        and router.error_rate("together", "embedding") == 1,
+        f"an empty embedding fails over to {backend}",
+    )
+
+    router = Router()
+    try:
+        await router.route("summary", {"together": bad_input}, hedge=False)
+    except ValueError:
+        pass
+    check(
+        router.error_rate("together", "summary") == 0
+        and router.breaker("together").failures == 0,
+        "an error caused by the input doesn't count against together",
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Load-test the analysis orchestration offline, on the fake inference backend.
+
+Runs analyze_article on synthetic articles at a fixed concurrency and reports
+end-to-end latency, failures, per-stage timings, router state and the
+concurrency limiters. Latencies, failure and cold-start rates of the fake
+backend are set with --latency-scale, --failure-rate and --cold-start-rate.
+With --backfill, that many backfill-priority articles are analyzed alongside
+the interactive ones, to see how well the scheduler shields the latter.
+
+    python scripts/load_test.py --articles 200 --concurrency 20 --latency-scale 0.05
+    python scripts/load_test.py --articles 100 --backfill 500 --analysis-concurrency 16
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.backends import FakeBackend, backends
+from app.deadlines import Deadline, DeadlineExceeded
+from app.limiter import limiter_stats
+from app.newsly_types import NewslyArticle
+from app.routing import router
+from app.scheduler import PriorityScheduler
+import app.server as server
+
+WORDS = """senate election economy inflation climate court police school
+hospital vaccine market election campaign border trade energy war treaty
+league championship film festival church protest union strike budget tax
+court ruling governor mayor policy reform technology startup research""".split()
+
+
+def synthetic_article(rng: random.Random, i: int) -> NewslyArticle:
+    sentences = [
+        " ".join(rng.choices(WORDS, k=rng.randint(8, 20))).capitalize() + "."
+        for _ in range(rng.randint(10, 60))
+    ]
+    now = datetime.now()
+    return NewslyArticle(
+        url=f"https://example.com/article-{i}",
+        title=f"Article {i}",
+        text=" ".join(sentences),
+        authors=[],
+        image_url="",
+        published_date=now,
+        last_analyzed_at=now,
+        source_url="https://example.com",
+    )
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(args) -> None:
+    rng = random.Random(args.seed)
+    backends["fake"] = FakeBackend(
+        latency_scale=args.latency_scale,
+        failure_rate=args.failure_rate,
+        cold_start_rate=args.cold_start_rate,
+        seed=args.seed,
+    )
+    router.set_probe("fake", backends["fake"].probe)
+    server.scheduler = PriorityScheduler(
+        capacity=args.analysis_concurrency, reserved=args.interactive_reserved
+    )
+
+    latencies, failures = defaultdict(list), defaultdict(lambda: defaultdict(int))
+
+    async def one(i: int, priority: str, semaphore: asyncio.Semaphore) -> None:
+        article = synthetic_article(rng, i)
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                await server.analyze_article(
+                    article,
+                    deadline=Deadline(args.deadline),
+                    backends=("fake",),
+                    priority=priority,
+                )
+                latencies[priority].append(time.monotonic() - start)
+            except DeadlineExceeded:
+                failures[priority]["deadline"] += 1
+            except Exception as e:
+                failures[priority][type(e).__name__] += 1
+
+    interactive = asyncio.Semaphore(args.concurrency)
+    # the backfill submits everything at once, like cli.py ingest with a
+    # high --concurrency
+    backfill = asyncio.Semaphore(max(1, args.backfill))
+    start = time.monotonic()
+    # the per-article pipeline reports would drown the summary
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(
+            *(one(i, "backfill", backfill) for i in range(args.backfill)),
+            *(one(i, "interactive", interactive) for i in range(args.articles)),
+        )
+    elapsed = time.monotonic() - start
+
+    print(
+        f"\n{args.articles} articles in {elapsed:.1f}s, concurrency {args.concurrency}"
+        + (f", with {args.backfill} backfill" if args.backfill else "")
+    )
+    for priority in ("interactive", "backfill"):
+        if not latencies[priority] and not failures[priority]:
+            continue
+        values = latencies[priority]
+        print(
+            f"{priority:<12} ok: {len(values)}  failed: {dict(failures[priority])}  "
+            f"latency p50 {percentile(values, 0.5):.2f}s  "
+            f"p95 {percentile(values, 0.95):.2f}s  p99 {percentile(values, 0.99):.2f}s"
+        )
+
+    print("\nclass        admitted  mean wait  p95 wait  max wait")
+    for priority, stats in server.scheduler.stats()["classes"].items():
+        print(
+            f"{priority:<12} {stats['admitted']:>8}  {stats['mean_wait_seconds']:8.2f}s  "
+            f"{stats['p95_wait_seconds']:7.2f}s  {stats['max_wait_seconds']:7.2f}s"
+        )
+
+    print("\nstage              calls  p50      p95      errors")
+    for stage, stats in router.status().get("fake", {}).get("stages", {}).items():
+        print(
+            f"{stage:<18} {stats['calls']:>5}  {stats['p50_seconds'] or 0:6.2f}s  "
+            f"{stats['p95_seconds'] or 0:6.2f}s  {stats['error_rate']:.1%}"
+        )
+
+    print("\nlimiter                     limit  queue  mean wait  slow  429")
+    for name, stats in limiter_stats().items():
+        print(
+            f"{name:<27} {stats['limit']:>5}  {stats['queue_depth']:>5}  "
+            f"{stats['mean_wait_seconds']:8.2f}s  {stats['slow']:>4}  "
+            f"{stats['rate_limited']:>3}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--backfill", type=int, default=0)
+    parser.add_argument("--analysis-concurrency", type=int, default=32)
+    parser.add_argument("--interactive-reserved", type=int, default=8)
+    parser.add_argument("--latency-scale", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--cold-start-rate", type=float, default=0.01)
+    parser.add_argument("--deadline", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Report how many article tokens each tokenizer sees and how much of it the
+stages actually consume, from the token budgets stored with the articles.
+
+    python scripts/token_report.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.db import get_article_token_budgets
+from app.token_budget import STAGE_TOKENIZERS, TOKENIZERS
+
+
+def main():
+    budgets = get_article_token_budgets()
+    print(f"{len(budgets)} articles with a token budget")
+    if not budgets:
+        return
+
+    print(
+        f"{'tokenizer':<10} {'stages':>6} {'mean tokens':>11} "
+        f"{'mean used':>9} {'truncated':>9}"
+    )
+    for name in TOKENIZERS:
+        entries = [budget[name] for budget in budgets if name in budget]
+        if not entries:
+            continue
+        n_stages = list(STAGE_TOKENIZERS.values()).count(name)
+        mean_tokens = sum(entry["tokens"] for entry in entries) / len(entries)
+        mean_used = sum(
+            min(entry["tokens"], entry["limit"]) for entry in entries
+        ) / len(entries)
+        truncated = sum(entry["tokens"] > entry["limit"] for entry in entries)
+        print(
+            f"{name:<10} {n_stages:>6} {mean_tokens:>11.0f} {mean_used:>9.0f} "
+            f"{100 * truncated / len(entries):>8.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Reconstruct the critical path of traced analyses and compare deployments.
+
+Reads the OTLP JSON lines written with TRACE_EXPORTER=file (app/tracing.py).
+With --trace, prints that trace's span tree, marking the spans on its
+critical path. Otherwise groups the traces of --root spans by a resource
+attribute (--group-by, e.g. service.version from OTEL_RESOURCE_ATTRIBUTES)
+and prints, per span name, the mean seconds it spends on the critical path
+of a trace in each group.
+
+    python scripts/trace_report.py traces-v1.jsonl traces-v2.jsonl
+    python scripts/trace_report.py traces.jsonl --trace 4bf92f3577b34da6
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class TraceSpan:
+    trace_id: str
+    span_id: str
+    parent_id: str
+    name: str
+    start: float  # seconds
+    end: float
+    error: bool
+    resource: dict
+    children: list = field(default_factory=list)
+
+
+def _value(value: dict):
+    return next(iter(value.values()), None)
+
+
+def read_spans(paths: list[str]) -> list[TraceSpan]:
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for resource_spans in json.loads(line)["resourceSpans"]:
+                    resource = {
+                        attribute["key"]: _value(attribute["value"])
+                        for attribute in resource_spans["resource"]["attributes"]
+                    }
+                    for scope_spans in resource_spans["scopeSpans"]:
+                        for span in scope_spans["spans"]:
+                            spans.append(
+                                TraceSpan(
+                                    span["traceId"],
+                                    span["spanId"],
+                                    span.get("parentSpanId", ""),
+                                    span["name"],
+                                    int(span["startTimeUnixNano"]) / 1e9,
+                                    int(span["endTimeUnixNano"]) / 1e9,
+                                    span.get("status", {}).get("code") == 2,
+                                    resource,
+                                )
+                            )
+    return spans
+
+
+def build_traces(spans: list[TraceSpan]) -> dict[str, TraceSpan]:
+    """
+    trace id -> root span, with the children of every span linked.
+    """
+    by_id = {(span.trace_id, span.span_id): span for span in spans}
+    roots = {}
+    for span in spans:
+        parent = by_id.get((span.trace_id, span.parent_id))
+        if parent:
+            parent.children.append(span)
+        elif not span.parent_id:
+            roots[span.trace_id] = span
+    return roots
+
+
+def critical_path(span: TraceSpan, end: float | None = None) -> list[tuple]:
+    """
+    (span, seconds) for the spans on the critical path of span, ending at
+    end: walking back from the end, the child that finished last is what the
+    span waited for, then the one that finished last before that child
+    started, and so on; the rest is the span's own time.
+    """
+    cursor = span.end if end is None else end
+    path = []
+    own = 0.0
+    while True:
+        candidates = [child for child in span.children if child.start < cursor]
+        if not candidates:
+            break
+        # a child that finished by then over one still running (clipped)
+        child = max(
+            candidates,
+            key=lambda child: (child.end <= cursor, min(child.end, cursor)),
+        )
+        child_end = min(child.end, cursor)
+        own += cursor - child_end
+        path += critical_path(child, child_end)
+        cursor = max(child.start, span.start)
+    own += max(cursor - span.start, 0.0)
+    return [(span, own)] + path
+
+
+def print_tree(root: TraceSpan) -> None:
+    on_path = {id(span) for span, _ in critical_path(root)}
+
+    def show(span: TraceSpan, depth: int) -> None:
+        mark = "*" if id(span) in on_path else " "
+        error = "  failed" if span.error else ""
+        print(
+            f"{mark} +{span.start - root.start:7.3f}s {span.end - span.start:7.3f}s  "
+            f"{'  ' * depth}{span.name}{error}"
+        )
+        for child in sorted(span.children, key=lambda child: child.start):
+            show(child, depth + 1)
+
+    show(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="TRACE_FILE files")
+    parser.add_argument("--trace", help="Print this trace (id or id prefix)")
+    parser.add_argument("--root", default="server.process_article_db")
+    parser.add_argument("--group-by", default="service.version")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    roots = build_traces(read_spans(args.paths))
+    if args.trace:
+        matches = [root for id, root in roots.items() if id.startswith(args.trace)]
+        if not matches:
+            raise SystemExit(f"No trace {args.trace}")
+        print_tree(matches[0])
+        return
+
+    # group -> span name -> seconds on the critical path, per trace
+    groups = defaultdict(lambda: defaultdict(list))
+    durations = defaultdict(list)
+    for root in roots.values():
+        if root.name != args.root:
+            continue
+        group = str(root.resource.get(args.group_by, "unknown"))
+        durations[group].append(root.end - root.start)
+        seconds = defaultdict(float)
+        for span, own in critical_path(root):
+            seconds[span.name] += own
+        for name, value in seconds.items():
+            groups[group][name].append(value)
+    if not durations:
+        raise SystemExit(f"No complete {args.root} traces")
+
+    names = sorted(groups)
+    print(f"{'':<40}" + "".join(f"{name[:14]:>16}" for name in names))
+    print(f"{'traces':<40}" + "".join(f"{len(durations[name]):>16}" for name in names))
+    print(
+        f"{'p50 duration (s)':<40}"
+        + "".join(f"{np.percentile(durations[name], 50):>16.2f}" for name in names)
+    )
+    print("mean seconds on the critical path")
+    totals = defaultdict(float)
+    for group in names:
+        for span_name, values in groups[group].items():
+            totals[span_name] += sum(values) / len(durations[group])
+    for span_name in sorted(totals, key=lambda name: -totals[name])[: args.top]:
+        row = f"{span_name[:40]:<40}"
+        for group in names:
+            row += f"{sum(groups[group][span_name]) / len(durations[group]):>16.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()